@@ -0,0 +1,116 @@
+"""
+Concurrency limit that adapts AIMD-style to upstream feedback.
+
+Callers `acquire()` a slot before a call and `release()` it with the outcome.
+Successful calls whose latency stays near the observed baseline raise the
+limit by about one slot per window of calls (additive increase); an overload
+signal (429 / 503) or latency well above the baseline cuts it by a factor
+(multiplicative decrease), at most once per cooldown so a burst of failures
+from the same window does not collapse it. Waiters are served in FIFO order,
+and the queue depth, wait time and limit are kept for `/metrics`.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Optional
+
+OK = "ok"
+OVERLOAD = "overload"
+ERROR = "error"
+
+
+class AdaptiveLimiter:
+    def __init__(self, name: str, initial: float, min_limit: float, max_limit: float,
+                 backoff: float = 0.5, latency_tolerance: float = 2.0, cooldown: float = 5.0):
+        self.name = name
+        self.limit = float(initial)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.backoff = backoff
+        # A success slower than baseline * tolerance counts as a (milder) congestion signal
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        # Slow-moving average of successful call latency
+        self.baseline: Optional[float] = None
+        self._last_decrease = 0.0
+        self.stats = {"acquired": 0, "queued": 0, "timeouts": 0, "wait_seconds": 0.0,
+                      "increases": 0, "decreases": 0, "peak_queue": 0}
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _has_slot(self) -> bool:
+        return self.in_flight < max(1, int(self.limit))
+
+    async def acquire(self, timeout: Optional[float] = None) -> float:
+        """
+        Waits for a slot and returns the seconds spent queued. Raises asyncio.TimeoutError after `timeout`.
+        """
+        if not self._waiters and self._has_slot():
+            self.in_flight += 1
+            self.stats["acquired"] += 1
+            return 0.0
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.stats["queued"] += 1
+        self.stats["peak_queue"] = max(self.stats["peak_queue"], len(self._waiters))
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we gave up; pass it on
+                self.in_flight -= 1
+                self._wake()
+            else:
+                waiter.cancel()
+                try:
+                    self._waiters.remove(waiter)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                self.stats["timeouts"] += 1
+            raise
+        waited = time.monotonic() - start
+        self.stats["acquired"] += 1
+        self.stats["wait_seconds"] += waited
+        return waited
+
+    def release(self, outcome: str = OK, latency: Optional[float] = None) -> None:
+        self.in_flight -= 1
+        self._adjust(outcome, latency)
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self._has_slot():
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _adjust(self, outcome: str, latency: Optional[float]) -> None:
+        now = time.monotonic()
+        if outcome == OVERLOAD:
+            self._decrease(now, self.backoff)
+        elif outcome == OK and latency is not None:
+            if self.baseline is not None and latency > self.baseline * self.latency_tolerance:
+                self._decrease(now, 0.9)
+            elif self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self.stats["increases"] += 1
+            self.baseline = latency if self.baseline is None else self.baseline * 0.95 + latency * 0.05
+
+    def _decrease(self, now: float, factor: float) -> None:
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * factor)
+        self.stats["decreases"] += 1
+
+    def to_dict(self) -> dict:
+        return dict(self.stats, name=self.name, limit=self.limit, in_flight=self.in_flight,
+                    queue_depth=len(self._waiters))
@@ -0,0 +1,321 @@
+"""
+Bounded in-memory cache used by every router.
+
+Each endpoint creates its own `TTLCache` through `create_cache`, which caps the
+number of entries and their approximate serialized size, expires entries after
+a TTL, and evicts the least recently used entry first. All operations are O(1)
+apart from measuring the size of a newly stored value.
+
+`get_or_create` also coalesces concurrent misses for the same key: the first
+caller starts the work and every other caller awaits the same result (or the
+same error) instead of repeating the page fetch and Gemini call.
+
+Caches created with `persistent=True` are backed by the shared SQLite tier in
+`disk_cache`: a memory miss is looked up on disk before calling the factory,
+new results are written through, and the memory tier is warmed from disk on
+startup.
+
+Router caches are created with `serialize=True`: results are encoded to JSON
+bytes once, when they are computed (with orjson when it is installed), and
+`get_or_create_response` returns those bytes as a `Response`. A hit then skips
+FastAPI's `jsonable_encoder` and `json.dumps`, and the same bytes are what the
+disk tier stores. `CACHE_SERIALIZED_RESPONSES=0` keeps the parsed values
+instead, for comparison with `benchmarks/bench_cache_hits.py`.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from fastapi.responses import Response
+
+from app.core import deadlines, disk_cache
+
+try:
+    import orjson
+except ImportError:  # optional; the standard library encoder gives the same bytes, more slowly
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# All caches created through create_cache, keyed by name (used for stats)
+CACHES: Dict[str, "TTLCache"] = {}
+
+_MISSING = object()
+
+SERIALIZED_RESPONSES = os.getenv("CACHE_SERIALIZED_RESPONSES", "1") == "1"
+
+
+def dumps(value: Any) -> bytes:
+    """
+    Compact UTF-8 JSON, as FastAPI's JSONResponse would render it.
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def loads(value: Any) -> Any:
+    """
+    Parses a value read from a serialized cache; values of other caches are returned unchanged.
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return orjson.loads(value) if orjson is not None else json.loads(value)
+    return value
+
+
+def _sizeof(value: Any) -> int:
+    """
+    Approximate memory footprint of a cached key or value, measured as its UTF-8 JSON size.
+    Objects that are not JSON data can report their own footprint through a `cache_size` attribute.
+    """
+    cache_size = getattr(value, "cache_size", None)
+    if cache_size is not None:
+        return cache_size
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    return len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+class _Entry:
+    __slots__ = ("value", "expires_at", "size")
+
+    def __init__(self, value: Any, expires_at: float, size: int):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+
+
+class TTLCache:
+    """
+    LRU cache with per-entry expiry, an entry limit and a byte limit.
+    """
+
+    def __init__(self, name: str, max_entries: int, max_bytes: int, ttl: float, persistent: bool = False,
+                 serialize: bool = False):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.persistent = persistent and disk_cache.ENABLED
+        # Values are stored as JSON bytes (see get_or_create_response)
+        self.serialize = serialize
+        self._data: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+        self.disk_hits = 0
+        # Work currently running for missed keys, shared by concurrent callers
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry.expires_at > time.monotonic()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if entry.expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Like `get`, for background checks: not counted in hits/misses and the LRU order is left unchanged.
+        """
+        entry = self._data.get(key)
+        if entry is None or entry.expires_at <= time.monotonic():
+            return default
+        return entry.value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        size = _sizeof(key) + _sizeof(value)
+        if key in self._data:
+            self._remove(key)
+        if size > self.max_bytes:
+            # Larger than the whole cache; storing it would only evict everything else
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = _Entry(value, expires_at, size)
+        self.current_bytes += size
+        while len(self._data) > self.max_entries or self.current_bytes > self.max_bytes:
+            oldest_key = next(iter(self._data))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    async def get_or_create(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Returns the cached value for `key`, or awaits `factory()` once for all
+        concurrent callers that miss on the same key and caches its result.
+        Errors are shared with every waiter and are not cached.
+        """
+        cached = self.get(key, _MISSING)
+        if cached is not _MISSING:
+            return cached
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = deadlines.spawn(self._load_or_compute(key, factory))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+        # One caller going away does not cancel the work the others are waiting for; the last one does
+        value, _ = await deadlines.join(task)
+        return value
+
+    async def get_or_create_response(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        `get_or_create` for a route handler: the stored JSON bytes are returned as a
+        `Response` without validating or encoding them again.
+        """
+        value = await self.get_or_create(key, factory)
+        if isinstance(value, (bytes, bytearray)):
+            return Response(content=value, media_type="application/json")
+        return value
+
+    def encode(self, value: Any) -> Any:
+        """
+        Converts a computed result to the form this cache stores, for callers that `set()` directly.
+        """
+        return dumps(value) if self.serialize else value
+
+    async def _load_or_compute(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Tuple[Any, float]:
+        """
+        Returns (value, remaining ttl), reading the disk tier before falling back to `factory()`.
+        """
+        if self.persistent:
+            try:
+                stored = await asyncio.to_thread(disk_cache.get, self.name, key, self.serialize)
+            except sqlite3.Error:
+                logger.exception("disk cache read failed for %s", self.name)
+                stored = None
+            if stored is not None:
+                self.disk_hits += 1
+                value, expires_at = stored
+                return value, expires_at - time.time()
+
+        value = self.encode(await factory())
+        await self._write_disk(key, value)
+        return value, self.ttl
+
+    async def _write_disk(self, key: Hashable, value: Any) -> None:
+        if self.persistent:
+            try:
+                await asyncio.to_thread(disk_cache.put, self.name, key, value, self.ttl)
+            except sqlite3.Error:
+                logger.exception("disk cache write failed for %s", self.name)
+
+    async def store(self, key: Hashable, result: Any) -> None:
+        """
+        Stores a result computed outside `get_or_create` (e.g. by a background job) in both tiers.
+        """
+        value = self.encode(result)
+        self.set(key, value)
+        await self._write_disk(key, value)
+
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if task.cancelled():
+            return
+        if task.exception() is None:
+            value, ttl = task.result()
+            self.set(key, value, ttl)
+
+    def fill(self, entries: List[Tuple[Hashable, Any, float]]) -> None:
+        """
+        Stores (key, value, expires_at) rows read from the disk tier, ordered longest-lived first.
+        """
+        now = time.time()
+        # Longest-lived entries are stored last so they end up most recently used
+        for key, value, expires_at in reversed(entries):
+            self.set(key, value, expires_at - now)
+
+    def delete(self, key: Hashable) -> None:
+        if key in self._data:
+            self._remove(key)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.current_bytes = 0
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._data.pop(key)
+        self.current_bytes -= entry.size
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._data),
+            "bytes": self.current_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "coalesced": self.coalesced,
+            "disk_hits": self.disk_hits,
+            "inflight": len(self._inflight),
+        }
+
+
+def create_cache(name: str, max_entries: int, max_bytes: int, ttl: float, persistent: bool = False,
+                 serialize: bool = False) -> TTLCache:
+    """
+    Creates and registers a cache. Limits can be overridden per endpoint with
+    CACHE_<NAME>_MAX_ENTRIES, CACHE_<NAME>_MAX_BYTES and CACHE_<NAME>_TTL (seconds).
+    `persistent=True` adds the shared on-disk tier behind the memory tier, and
+    `serialize=True` stores JSON-serializable results as response bytes.
+    """
+    prefix = f"CACHE_{name.upper()}_"
+    cache = TTLCache(
+        name,
+        max_entries=int(os.getenv(prefix + "MAX_ENTRIES", max_entries)),
+        max_bytes=int(os.getenv(prefix + "MAX_BYTES", max_bytes)),
+        ttl=float(os.getenv(prefix + "TTL", ttl)),
+        persistent=persistent,
+        serialize=serialize and SERIALIZED_RESPONSES,
+    )
+    CACHES[name] = cache
+    return cache
+
+
+async def warm_persistent_caches() -> None:
+    """
+    Loads recent entries from the disk tier into every persistent cache, so a fresh worker starts warm.
+    """
+    for cache in CACHES.values():
+        if not cache.persistent:
+            continue
+        try:
+            entries = await asyncio.to_thread(disk_cache.load, cache.name, min(disk_cache.WARM_LIMIT, cache.max_entries),
+                                              cache.serialize)
+            cache.fill(entries)
+            logger.info("warmed cache %s with %d entries from disk", cache.name, len(entries))
+        except sqlite3.Error:
+            logger.exception("failed to warm cache %s from disk", cache.name)
+
+
+def cache_stats() -> Dict[str, dict]:
+    return {name: cache.stats() for name, cache in CACHES.items()}
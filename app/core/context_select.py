@@ -0,0 +1,158 @@
+"""
+Relevance-ranked selection of page text for LLM prompts.
+
+Instead of sending Gemini the first N characters of a page, the cleaned text
+is split into blocks of consecutive lines, each block is scored against the
+user's target/condition with BM25, and the best blocks are packed into a token
+budget and emitted in page order. Pages that already fit the budget are sent
+unchanged. Prompt sizes before and after selection are counted in `STATS`.
+"""
+import logging
+import math
+import os
+import re
+from collections import Counter
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Approximate token budget for the page text in one prompt
+TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000"))
+# Target size of one scored block, in characters
+BLOCK_CHARS = int(os.getenv("CONTEXT_BLOCK_CHARS", "600"))
+
+# Most ASCII characters one selected block can add when joined: a newline, and "..." plus a newline before a gap
+_SEPARATOR_CHARS = len("\n...\n")
+
+_K1 = 1.5
+_B = 0.75
+
+# Latin words/numbers, or runs of Japanese/Chinese characters (scored as bigrams)
+_TOKEN_RE = re.compile(r"[0-9a-z]+|[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff\uff66-\uff9f]+")
+
+# Running totals reported by the metrics endpoint
+STATS = {
+    "selections": 0,
+    "chars_before": 0,
+    "chars_after": 0,
+    "tokens_before": 0,
+    "tokens_after": 0,
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough Gemini token count: about four ASCII characters or one CJK character per token.
+    """
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return ascii_chars // 4 + (len(text) - ascii_chars)
+
+
+def _char_counts(text: str) -> Tuple[int, int]:
+    # (ASCII, other) characters; estimate_tokens() of joined text is computed from their sums
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return ascii_chars, len(text) - ascii_chars
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for match in _TOKEN_RE.findall(text.lower()):
+        if match.isascii():
+            tokens.append(match)
+        elif len(match) == 1:
+            tokens.append(match)
+        else:
+            tokens.extend(match[i:i + 2] for i in range(len(match) - 1))
+    return tokens
+
+
+def split_blocks(text: str, block_chars: int = BLOCK_CHARS) -> List[str]:
+    """
+    Groups consecutive lines into blocks of roughly `block_chars` characters.
+    """
+    blocks = []
+    current: List[str] = []
+    size = 0
+    for line in text.split("\n"):
+        current.append(line)
+        size += len(line) + 1
+        if size >= block_chars:
+            blocks.append("\n".join(current))
+            current = []
+            size = 0
+    if current:
+        blocks.append("\n".join(current))
+    return blocks
+
+
+def _bm25_scores(blocks: List[str], query: str) -> List[float]:
+    query_terms = set(tokenize(query))
+    block_terms = [Counter(tokenize(block)) for block in blocks]
+    lengths = [sum(terms.values()) for terms in block_terms]
+    average_length = (sum(lengths) / len(lengths)) or 1.0
+    count = len(blocks)
+
+    idf = {}
+    for term in query_terms:
+        frequency = sum(1 for terms in block_terms if term in terms)
+        idf[term] = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+
+    scores = []
+    for terms, length in zip(block_terms, lengths):
+        score = 0.0
+        norm = _K1 * (1 - _B + _B * length / average_length)
+        for term in query_terms:
+            tf = terms.get(term)
+            if tf:
+                score += idf[term] * tf * (_K1 + 1) / (tf + norm)
+        scores.append(score)
+    return scores
+
+
+def select_context(text: str, query: str, token_budget: int = TOKEN_BUDGET, record: bool = True) -> str:
+    """
+    Returns the parts of `text` most relevant to `query` that fit in `token_budget` tokens.
+    `record=False` leaves the selection out of `STATS` (background work such as monitor checks).
+    """
+    tokens_before = estimate_tokens(text)
+    if tokens_before <= token_budget:
+        selected = text
+    else:
+        blocks = split_blocks(text)
+        scores = _bm25_scores(blocks, query)
+        block_chars = [_char_counts(block) for block in blocks]
+
+        # The first block usually holds the page title; keep it, then add the best-scoring blocks.
+        # With no matching terms at all this degrades to the leading blocks, like plain truncation.
+        # Characters are summed rather than per-block token estimates, and each block is charged for
+        # the separators it may bring, so the joined text stays within the budget.
+        order = [0] + sorted(range(1, len(blocks)), key=lambda i: (-scores[i], i))
+        chosen = []
+        used_ascii = used_other = 0
+        for i in order:
+            ascii_chars = used_ascii + block_chars[i][0] + _SEPARATOR_CHARS
+            other_chars = used_other + block_chars[i][1]
+            if ascii_chars // 4 + other_chars > token_budget:
+                continue
+            chosen.append(i)
+            used_ascii, used_other = ascii_chars, other_chars
+
+        parts = []
+        previous = None
+        for i in sorted(chosen):
+            if previous is not None and i != previous + 1:
+                parts.append("...")
+            parts.append(blocks[i])
+            previous = i
+        selected = "\n".join(parts)
+
+    tokens_after = estimate_tokens(selected)
+    if not record:
+        return selected
+    STATS["selections"] += 1
+    STATS["chars_before"] += len(text)
+    STATS["chars_after"] += len(selected)
+    STATS["tokens_before"] += tokens_before
+    STATS["tokens_after"] += tokens_after
+    logger.debug("context selection: %d -> %d tokens for %r", tokens_before, tokens_after, query)
+    return selected
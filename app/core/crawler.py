@@ -0,0 +1,334 @@
+"""
+Site crawler behind ai-scrape's crawl mode.
+
+A crawl starts from a seed page and/or the `<loc>` entries of a sitemap (one
+level of sitemap index is followed) and follows links breadth-first, up to
+`max_depth` hops and `max_pages` pages. Discovered links stay on the seed's
+host unless `same_host` is off, and must match the include / exclude patterns.
+
+Each crawl runs `CRAWL_CONCURRENCY` workers. Across all crawls in the process,
+a host gets at most `CRAWL_HOST_CONNECTIONS` requests at a time, started at
+least `CRAWL_HOST_DELAY` seconds apart, so a crawl does not hammer the site
+it reads.
+
+URLs are canonicalized before they are queued (lowercase scheme and host, no
+default port, fragment or tracking parameters, sorted query), so a page is not
+fetched twice under different spellings. A page whose `<link rel=canonical>`
+names a page already crawled, or whose extracted markdown hashes the same as
+an earlier page, is reported as a duplicate of it. Extracted pages come from
+the caller's cache (ai-scrape's `SCRAPE_CACHE`): a cached page is not
+extracted again, and is only fetched (through the document cache) when its
+links are still needed.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import xml.etree.ElementTree as ET
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Pattern, Sequence, Set, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from fastapi import HTTPException
+
+from app.core.cache import loads
+from app.core.documents import DOCUMENT_CACHE, Document, fetch_document
+from app.core.html_text import page_links
+from app.core.http_client import FETCH_ERRORS, fetch_bytes
+from app.core.parse_pool import PARSE_POOL
+
+logger = logging.getLogger(__name__)
+
+CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "8"))
+HOST_CONNECTIONS = int(os.getenv("CRAWL_HOST_CONNECTIONS", "2"))
+HOST_DELAY = float(os.getenv("CRAWL_HOST_DELAY", "0.5"))
+MAX_DEPTH = int(os.getenv("CRAWL_MAX_DEPTH", "5"))
+MAX_PAGES = int(os.getenv("CRAWL_MAX_PAGES", "200"))
+# Child sitemaps read from a sitemap index
+MAX_SITEMAPS = int(os.getenv("CRAWL_MAX_SITEMAPS", "10"))
+
+FETCH_ERROR_DETAIL = "URLが無効、またはアクセスがブロックされました。"
+
+STATS = {"crawls": 0, "pages": 0, "cache_hits": 0, "duplicate_urls": 0, "duplicate_content": 0, "errors": 0,
+         "host_waits": 0}
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+_TRACKING_PARAMS = frozenset({"gclid", "fbclid", "yclid", "msclkid"})
+# Links that are clearly not pages
+_SKIPPED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".svg", ".ico", ".pdf", ".zip", ".gz", ".mp3",
+                       ".mp4", ".mov", ".avi", ".css", ".js", ".woff", ".woff2", ".ttf", ".xml", ".json")
+
+
+def canonical_url(url: str) -> Optional[str]:
+    """
+    Normalized form of an http(s) URL used to recognize the same page, or None for anything else.
+    """
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return None
+    scheme = parts.scheme.lower()
+    host = parts.hostname
+    if scheme not in _DEFAULT_PORTS or not host:
+        return None
+    if ":" in host:
+        host = f"[{host}]"
+    if port and port != _DEFAULT_PORTS[scheme]:
+        host = f"{host}:{port}"
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in _TRACKING_PARAMS
+    ))
+    return urlunsplit((scheme, host, parts.path or "/", query, ""))
+
+
+def cache_key(url: str) -> str:
+    """
+    Key for a page in ai-scrape's SCRAPE_CACHE, shared by GET / and the crawler so each finds the other's entries.
+    """
+    return canonical_url(url) or url
+
+
+def sitemap_urls(content: bytes) -> Tuple[bool, List[str]]:
+    """
+    Whether `content` is a sitemap index, and its `<loc>` entries.
+    A truncated sitemap yields the entries read before the cut; raises ValueError when there are none.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    index = False
+    locs = []
+    try:
+        parser.feed(content)
+        # A syntax error is raised from read_events() after the events that precede it
+        for event, element in parser.read_events():
+            tag = element.tag.rsplit("}", 1)[-1]
+            if event == "start":
+                index = index or tag == "sitemapindex"
+            elif tag == "loc" and element.text and element.text.strip():
+                locs.append(element.text.strip())
+            elif tag in ("url", "sitemap"):
+                element.clear()
+    except ET.ParseError:
+        if not locs:
+            raise ValueError("not a sitemap")
+    return index, locs
+
+
+class HostGate:
+    """
+    Per-host connection cap and spacing between request starts, shared by every crawl.
+    """
+
+    def __init__(self, connections: int = HOST_CONNECTIONS, delay: float = HOST_DELAY):
+        self.connections = max(1, connections)
+        self.delay = delay
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._next: Dict[str, float] = {}
+
+    @asynccontextmanager
+    async def slot(self, host: str) -> AsyncIterator[None]:
+        semaphore = self._semaphores.get(host)
+        if semaphore is None:
+            if len(self._semaphores) > 10000:
+                self._prune()
+            semaphore = self._semaphores[host] = asyncio.Semaphore(self.connections)
+        async with semaphore:
+            now = time.monotonic()
+            # Reserve the next start time before sleeping, so concurrent waiters line up behind each other
+            start = max(now, self._next.get(host, 0.0))
+            self._next[host] = start + self.delay
+            if start > now:
+                STATS["host_waits"] += 1
+                await asyncio.sleep(start - now)
+            yield
+
+    def _prune(self) -> None:
+        # Hosts not requested for a minute; their limits start afresh on the next request
+        cutoff = time.monotonic() - 60
+        self._next = {host: due for host, due in self._next.items() if due > cutoff}
+        self._semaphores = {host: semaphore for host, semaphore in self._semaphores.items() if host in self._next}
+
+
+HOST_GATE = HostGate()
+
+
+def _host(url: str) -> str:
+    return urlsplit(url).netloc
+
+
+class Crawl:
+    """
+    One crawl. Add seeds with `add_seed()` / `add_sitemap()`, then iterate `run()` for one dict per page,
+    in the order pages complete: `index` (order queued), `url`, `depth`, `status` ("success", "duplicate"
+    or "error") and `content`, `duplicate_of` or `status_code` / `error`.
+    `scrape(url)` extracts a page for `cache`, which holds its results serialized under `cache_key(url)`.
+    """
+
+    def __init__(self, cache, scrape: Callable[[str], Awaitable[dict]], max_depth: int, max_pages: int,
+                 include: Sequence[Pattern] = (), exclude: Sequence[Pattern] = (), same_host: bool = True,
+                 concurrency: int = CONCURRENCY, gate: HostGate = HOST_GATE):
+        self.cache = cache
+        self.scrape = scrape
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self.same_host = same_host
+        self.concurrency = max(1, concurrency)
+        self.gate = gate
+        self._hosts: Set[str] = set()
+        self._queued: Set[str] = set()
+        # Canonical URL -> the page reported for it; content digest -> the page that had it
+        self._claimed: Dict[str, str] = {}
+        self._digests: Dict[str, str] = {}
+        self._frontier: asyncio.Queue = asyncio.Queue()
+        self._results: asyncio.Queue = asyncio.Queue()
+        self._scheduled = 0
+        self._pending = 0
+
+    def add_seed(self, url: str) -> None:
+        """
+        Queues a start page. Its host is allowed, and the include / exclude patterns do not apply to it.
+        """
+        url = canonical_url(url) or url
+        self._hosts.add(_host(url))
+        self._enqueue(url, 0)
+
+    def add(self, url: str, depth: int = 0) -> bool:
+        """
+        Queues `url` if it passes the host, pattern and page limits and has not been seen yet.
+        """
+        url = canonical_url(url)
+        if url is None or url in self._queued or url in self._claimed:
+            return False
+        if self.same_host and _host(url) not in self._hosts:
+            return False
+        if urlsplit(url).path.lower().endswith(_SKIPPED_EXTENSIONS):
+            return False
+        if self.include and not any(pattern.search(url) for pattern in self.include):
+            return False
+        if any(pattern.search(url) for pattern in self.exclude):
+            return False
+        return self._enqueue(url, depth)
+
+    def _enqueue(self, url: str, depth: int) -> bool:
+        if self._scheduled >= self.max_pages or url in self._queued:
+            return False
+        self._queued.add(url)
+        self._frontier.put_nowait((self._scheduled, url, depth))
+        self._scheduled += 1
+        self._pending += 1
+        return True
+
+    async def add_sitemap(self, url: str) -> None:
+        """
+        Queues the pages listed in a sitemap (or in the first MAX_SITEMAPS sitemaps of an index).
+        Raises the errors in `http_client.FETCH_ERRORS` when it cannot be fetched and ValueError when it cannot be read.
+        """
+        self._hosts.add(_host(canonical_url(url) or url))
+        index, locs = await self._sitemap(url)
+        if index:
+            children = locs[:MAX_SITEMAPS]
+            results = await asyncio.gather(*(self._sitemap(child) for child in children), return_exceptions=True)
+            locs = []
+            for child, result in zip(children, results):
+                if isinstance(result, BaseException):
+                    logger.warning("sitemap %s failed: %r", child, result)
+                elif not result[0]:
+                    locs.extend(result[1])
+        for loc in locs:
+            self.add(loc)
+
+    async def _sitemap(self, url: str) -> Tuple[bool, List[str]]:
+        async with self.gate.slot(_host(url)):
+            content = await fetch_bytes(url)
+        # ElementTree's C parser reads even a capped (2 MB) sitemap in a few milliseconds
+        return sitemap_urls(content)
+
+    async def run(self) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Crawls until the frontier is exhausted, yielding each page as it completes.
+        Closing the iterator stops the crawl.
+        """
+        STATS["crawls"] += 1
+        if not self._pending:
+            return
+        workers = [asyncio.ensure_future(self._worker()) for _ in range(self.concurrency)]
+        try:
+            while True:
+                item = await self._results.get()
+                if item is None:
+                    return
+                yield item
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def _worker(self) -> None:
+        while True:
+            index, url, depth = await self._frontier.get()
+            try:
+                item = await self._visit(url, depth)
+            except HTTPException as e:
+                item = {"status": "error", "status_code": e.status_code, "error": str(e.detail)}
+            except Exception as e:
+                item = {"status": "error", "status_code": 500, "error": f"予期せぬエラーが発生しました: {str(e)}"}
+            if item["status"] == "error":
+                STATS["errors"] += 1
+            STATS["pages"] += 1
+            self._results.put_nowait(dict(item, index=index, url=url, depth=depth))
+            # Links found by the page were queued before it counts as finished
+            self._pending -= 1
+            if not self._pending:
+                self._results.put_nowait(None)
+
+    async def _fetch(self, url: str) -> Document:
+        cached = DOCUMENT_CACHE.get(url)
+        if cached is not None and cached.is_fresh():
+            # No request, so no need to wait for the host
+            return cached
+        try:
+            async with self.gate.slot(_host(url)):
+                return await fetch_document(url, parse=False)
+        except FETCH_ERRORS:
+            raise HTTPException(status_code=400, detail=FETCH_ERROR_DETAIL)
+
+    async def _visit(self, url: str, depth: int) -> Dict[str, Any]:
+        if self._claimed.get(url, url) != url:
+            # Named as canonical by a page crawled after this URL was queued
+            STATS["duplicate_urls"] += 1
+            return {"status": "duplicate", "duplicate_of": self._claimed[url]}
+
+        follow = depth < self.max_depth
+        key = cache_key(url)
+        cached = key in self.cache
+        # A cached page is only downloaded when its links are still needed
+        document = await self._fetch(url) if follow or not cached else None
+
+        links: List[str] = []
+        if document is not None:
+            canonical, links = await PARSE_POOL.run(page_links, document.content, url, document.declared_encoding,
+                                                    size=len(document.content))
+            canonical = canonical_url(canonical) if canonical else None
+            if canonical and canonical != url:
+                if self._claimed.get(canonical, url) != url:
+                    STATS["duplicate_urls"] += 1
+                    return {"status": "duplicate", "duplicate_of": self._claimed[canonical]}
+                self._claimed[canonical] = url
+        self._claimed[url] = url
+
+        if cached:
+            STATS["cache_hits"] += 1
+        result = loads(await self.cache.get_or_create(key, lambda: self.scrape(url)))
+        content = result.get("content") or ""
+        digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        if self._digests.setdefault(digest, url) != url:
+            STATS["duplicate_content"] += 1
+            return {"status": "duplicate", "duplicate_of": self._digests[digest]}
+
+        if follow:
+            for link in links:
+                self.add(link, depth + 1)
+        return {"status": "success", "content": content}
@@ -0,0 +1,231 @@
+"""
+End-to-end request deadlines and cancellation of abandoned work.
+
+`DeadlineMiddleware` gives every API request a deadline of
+`REQUEST_TIMEOUT_SECONDS`, or of the client's `X-Request-Timeout` header (in
+seconds, capped at `REQUEST_TIMEOUT_MAX_SECONDS`). The deadline is kept in a
+context variable, so the fetch and LLM stages below the handler bound their
+own timeouts by what is left of it (`timeout()` / `at()`). If the deadline
+passes before the response starts, the handler is cancelled and a 504 is
+returned; if the client disconnects, the handler is cancelled. Once a
+(streamed) response has started, only a disconnect stops it.
+
+Work shared by several requests (cache misses, page downloads) is started
+with `spawn()` and awaited with `join()`. It is cancelled when the last
+request waiting for it goes away. With `REQUEST_FINISH_ABANDONED=1` it runs
+to completion instead, without the request deadline, so its result still
+fills the cache.
+"""
+import asyncio
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Dict, Iterable, List, Optional
+
+from fastapi import HTTPException
+from starlette.responses import JSONResponse
+
+TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "30"))
+MAX_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_MAX_SECONDS", "120"))
+FINISH_ABANDONED = os.getenv("REQUEST_FINISH_ABANDONED", "0") == "1"
+
+TIMEOUT_HEADER = b"x-request-timeout"
+EXPIRED_DETAIL = "リクエストの処理が制限時間内に完了しませんでした。"
+
+STATS = {"timeouts": 0, "disconnects": 0, "abandoned_cancelled": 0, "abandoned_finished": 0}
+
+
+class Deadline:
+    """
+    A `time.monotonic()` deadline, shared by reference with the tasks a request starts.
+    `at` is None when there is no deadline (background work, or a response that has started streaming).
+    """
+
+    __slots__ = ("at",)
+
+    def __init__(self, at: Optional[float]):
+        self.at = at
+
+    def remaining(self) -> Optional[float]:
+        return None if self.at is None else self.at - time.monotonic()
+
+
+_current: ContextVar[Optional[Deadline]] = ContextVar("request_deadline", default=None)
+
+
+def remaining() -> Optional[float]:
+    """
+    Seconds left before the current request's deadline, or None outside a request.
+    """
+    deadline = _current.get()
+    return None if deadline is None else deadline.remaining()
+
+
+def at(default_seconds: float) -> float:
+    """
+    Monotonic deadline for a stage allowed `default_seconds`, brought forward to the request deadline.
+    """
+    until = time.monotonic() + default_seconds
+    deadline = _current.get()
+    if deadline is not None and deadline.at is not None:
+        return min(until, deadline.at)
+    return until
+
+
+def timeout(seconds: float) -> float:
+    """
+    `seconds`, shortened to the time left for the request. Raises a 504 once the deadline has passed.
+    """
+    left = remaining()
+    if left is None:
+        return seconds
+    if left <= 0:
+        raise HTTPException(status_code=504, detail=EXPIRED_DETAIL)
+    return min(seconds, left)
+
+
+# Shared task -> [its own deadline, number of requests awaiting it]
+_shared: Dict[asyncio.Future, List[Any]] = {}
+
+
+async def _run_with(deadline: Deadline, awaitable: Awaitable) -> Any:
+    _current.set(deadline)
+    return await awaitable
+
+
+def spawn(awaitable: Awaitable) -> asyncio.Task:
+    """
+    Starts work that several requests may `join()`, under a copy of the current request deadline.
+    """
+    parent = _current.get()
+    deadline = Deadline(parent.at if parent is not None else None)
+    task = asyncio.ensure_future(_run_with(deadline, awaitable))
+    _shared[task] = [deadline, 0]
+    task.add_done_callback(lambda t: _shared.pop(t, None))
+    return task
+
+
+async def join(task: asyncio.Future) -> Any:
+    """
+    Awaits a `spawn()`ed task without letting one caller's cancellation cancel it for the others.
+    When the last caller is cancelled, the task is cancelled too (or, with
+    REQUEST_FINISH_ABANDONED=1, left to finish with no deadline).
+    """
+    entry = _shared.get(task)
+    if entry is None:
+        return await asyncio.shield(task)
+    entry[1] += 1
+    try:
+        return await asyncio.shield(task)
+    finally:
+        entry[1] -= 1
+        if not entry[1] and not task.done():
+            if FINISH_ABANDONED:
+                STATS["abandoned_finished"] += 1
+                entry[0].at = None
+            else:
+                STATS["abandoned_cancelled"] += 1
+                task.cancel()
+
+
+def _requested_timeout(scope) -> float:
+    for name, value in scope["headers"]:
+        if name == TIMEOUT_HEADER:
+            try:
+                seconds = float(value)
+            except ValueError:
+                break
+            if seconds > 0:
+                return min(seconds, MAX_TIMEOUT_SECONDS)
+            break
+    return TIMEOUT_SECONDS
+
+
+class DeadlineMiddleware:
+    """
+    ASGI middleware that runs API requests under a deadline and cancels them
+    when the deadline passes before the response starts or the client disconnects.
+    """
+
+    def __init__(self, app, prefixes: Iterable[str] = ()):
+        self.app = app
+        self.prefixes = tuple(prefixes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        deadline = Deadline(time.monotonic() + _requested_timeout(scope))
+        messages: asyncio.Queue = asyncio.Queue()
+        started = complete = False
+
+        async def receive_queued():
+            return await messages.get()
+
+        async def send_tracked(message):
+            nonlocal started, complete
+            if message["type"] == "http.response.start":
+                started = True
+                # The client has its headers; a streamed body is bounded by the client staying connected
+                deadline.at = None
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                complete = True
+            await send(message)
+
+        async def listen():
+            # Reads ahead of the handler so a disconnect is seen while it is busy
+            while True:
+                message = await receive()
+                messages.put_nowait(message)
+                if message["type"] == "http.disconnect":
+                    return
+                if not message.get("more_body", False):
+                    break
+            # The body is complete; only a disconnect is left to wait for. Anything else a
+            # misbehaving server sends is dropped, yielding in between so it cannot spin the loop
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    messages.put_nowait(message)
+                    return
+                await asyncio.sleep(0)
+
+        token = _current.set(deadline)
+        try:
+            handler = asyncio.ensure_future(self.app(scope, receive_queued, send_tracked))
+        finally:
+            _current.reset(token)
+        listener = asyncio.ensure_future(listen())
+        expired = False
+        try:
+            while not handler.done():
+                left = deadline.remaining()
+                done, _ = await asyncio.wait({handler, listener}, timeout=None if left is None else max(0.0, left),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if handler in done:
+                    break
+                if listener in done:
+                    # After a complete response the handler is only running background tasks; let them finish
+                    if not complete:
+                        STATS["disconnects"] += 1
+                        handler.cancel()
+                    break
+                if not started:
+                    STATS["timeouts"] += 1
+                    expired = True
+                    handler.cancel()
+                    break
+        except asyncio.CancelledError:
+            handler.cancel()
+            raise
+        finally:
+            listener.cancel()
+
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                raise
+        if expired and not started:
+            await JSONResponse({"detail": EXPIRED_DETAIL}, status_code=504)(scope, receive_queued, send)
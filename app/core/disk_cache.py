@@ -0,0 +1,169 @@
+"""
+Persistent second cache tier backed by a local SQLite database in WAL mode.
+
+Every uvicorn worker on the host opens the same file, so a result computed by
+one worker is reused by the others and survives restarts. Rows carry an
+absolute expiry time; a background task deletes expired rows and trims the
+file to `DISK_CACHE_MAX_BYTES`. No external service is required.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Hashable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ENABLED = os.getenv("DISK_CACHE_ENABLED", "1") == "1"
+DB_PATH = os.getenv("DISK_CACHE_PATH", os.path.join(_BASE_DIR, ".cache", "cache.sqlite3"))
+MAX_BYTES = int(os.getenv("DISK_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+COMPACT_INTERVAL = float(os.getenv("DISK_CACHE_COMPACT_INTERVAL", "600"))
+# Maximum entries per cache copied into memory when a worker starts
+WARM_LIMIT = int(os.getenv("DISK_CACHE_WARM_LIMIT", "1000"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    expires_at REAL NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (namespace, key)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at);
+"""
+
+# One connection per thread; sqlite3 connections must not be shared across threads
+_local = threading.local()
+_compact_task: Optional[asyncio.Task] = None
+
+
+def connect() -> sqlite3.Connection:
+    """
+    Returns this thread's connection to the shared database file (also used by the rate limiter).
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=5, isolation_level=None, check_same_thread=False)
+        # auto_vacuum only takes effect on a new database, before the first table is created
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+        _local.conn = conn
+    return conn
+
+
+def encode_key(key: Hashable) -> str:
+    return json.dumps(key, ensure_ascii=False, separators=(",", ":"))
+
+
+def decode_key(raw: str) -> Hashable:
+    key = json.loads(raw)
+    # Tuple keys come back from JSON as lists
+    return tuple(key) if isinstance(key, list) else key
+
+
+def encode_value(value: Any) -> bytes:
+    # Already-serialized JSON (see TTLCache.serialize) is stored as is
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def decode_value(raw: bytes, keep_bytes: bool = False) -> Any:
+    return bytes(raw) if keep_bytes else json.loads(raw)
+
+
+def get(namespace: str, key: Hashable, keep_bytes: bool = False) -> Optional[Tuple[Any, float]]:
+    """
+    Returns (value, expires_at) for a live entry, or None. expires_at is a wall-clock timestamp.
+    With `keep_bytes` the value is returned as its stored JSON bytes.
+    """
+    row = connect().execute(
+        "SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ? AND expires_at > ?",
+        (namespace, encode_key(key), time.time()),
+    ).fetchone()
+    if row is None:
+        return None
+    return decode_value(row[0], keep_bytes), row[1]
+
+
+def put(namespace: str, key: Hashable, value: Any, ttl: float) -> None:
+    raw = encode_value(value)
+    connect().execute(
+        "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, size) VALUES (?, ?, ?, ?, ?)",
+        (namespace, encode_key(key), raw, time.time() + ttl, len(raw)),
+    )
+
+
+def load(namespace: str, limit: int, keep_bytes: bool = False) -> List[Tuple[Hashable, Any, float]]:
+    """
+    Returns up to `limit` live entries of a namespace, longest-lived first, for warming memory on boot.
+    """
+    rows = connect().execute(
+        "SELECT key, value, expires_at FROM cache WHERE namespace = ? AND expires_at > ? "
+        "ORDER BY expires_at DESC LIMIT ?",
+        (namespace, time.time(), limit),
+    ).fetchall()
+    return [(decode_key(key), decode_value(value, keep_bytes), expires_at) for key, value, expires_at in rows]
+
+
+def compact() -> int:
+    """
+    Deletes expired rows, then the soonest-expiring rows until the total size fits MAX_BYTES.
+    Returns the number of rows deleted.
+    """
+    conn = connect()
+    deleted = conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),)).rowcount
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+    if total > MAX_BYTES:
+        # Smallest expiry whose running total of sizes covers the excess
+        row = conn.execute(
+            "SELECT expires_at FROM (SELECT expires_at, SUM(size) OVER (ORDER BY expires_at) AS freed FROM cache) "
+            "WHERE freed >= ? LIMIT 1",
+            (total - MAX_BYTES,),
+        ).fetchone()
+        if row is not None:
+            deleted += conn.execute("DELETE FROM cache WHERE expires_at <= ?", (row[0],)).rowcount
+    conn.execute("PRAGMA incremental_vacuum")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return deleted
+
+
+async def _compact_loop() -> None:
+    while True:
+        await asyncio.sleep(COMPACT_INTERVAL)
+        try:
+            deleted = await asyncio.to_thread(compact)
+            logger.info("disk cache compaction removed %d rows", deleted)
+        except sqlite3.Error:
+            logger.exception("disk cache compaction failed")
+
+
+async def startup() -> None:
+    global _compact_task
+    if not ENABLED:
+        return
+    try:
+        await asyncio.to_thread(compact)
+    except sqlite3.Error:
+        logger.exception("disk cache compaction failed")
+    _compact_task = asyncio.create_task(_compact_loop())
+
+
+async def shutdown() -> None:
+    global _compact_task
+    if _compact_task is not None:
+        _compact_task.cancel()
+        _compact_task = None
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
@@ -0,0 +1,159 @@
+"""
+URL-level document cache shared by web-extract, condition-check and ai-scrape.
+
+A page is downloaded once and kept with its raw bytes, its validators
+(ETag / Last-Modified) and, on first use, its cleaned text. Within
+`DOCUMENT_FRESH_SECONDS` the cached copy is served without any network call;
+after that it is revalidated with If-None-Match / If-Modified-Since, so an
+unchanged page costs a 304 and is not downloaded or parsed again.
+
+Bodies are streamed under the `HTTP_MAX_RESPONSE_BYTES` / `HTTP_MAX_RESPONSE_SECONDS`
+caps and fed to the text extractor as they arrive. When the parse pool is
+enabled (`app/core/parse_pool.py`), the text is extracted there instead, once
+the body is complete.
+"""
+import asyncio
+import os
+import time
+from typing import Dict, Optional
+
+from app.core import deadlines, metrics
+from app.core.cache import create_cache
+from app.core.html_text import MAX_TEXT_CHARS, get_extractor, html_to_text, sniff_encoding
+from app.core.http_client import CappedBody, get_client
+from app.core.parse_pool import PARSE_POOL
+
+FRESH_SECONDS = float(os.getenv("DOCUMENT_FRESH_SECONDS", "60"))
+
+
+class Document:
+    """
+    A downloaded page. `text` is computed from `content` on first access and then reused.
+    """
+
+    def __init__(self, url: str, content: bytes, encoding: Optional[str], etag: Optional[str],
+                 last_modified: Optional[str], truncated: bool = False, declared_encoding: Optional[str] = None):
+        self.url = url
+        self.content = content
+        self.encoding = encoding
+        # Charset from the Content-Type header, which takes precedence over <meta> when parsing
+        self.declared_encoding = declared_encoding
+        self.etag = etag
+        self.last_modified = last_modified
+        # True when the body was cut at HTTP_MAX_RESPONSE_BYTES / HTTP_MAX_RESPONSE_SECONDS
+        self.truncated = truncated
+        self.fetched_at = time.monotonic()
+        self._text: Optional[str] = None
+
+    @property
+    def html(self) -> str:
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            with metrics.stage("parse"):
+                self._text = html_to_text(self.content, encoding=self.declared_encoding)
+        return self._text
+
+    @property
+    def cache_size(self) -> int:
+        # Raw bytes plus room for the cleaned text, which is never longer than the page
+        return 2 * len(self.content)
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() - self.fetched_at < FRESH_SECONDS
+
+
+# Key: url, Value: Document
+DOCUMENT_CACHE = create_cache("documents", max_entries=1000, max_bytes=128 * 1024 * 1024, ttl=60 * 60)
+
+# Downloads in progress, shared by concurrent callers for the same URL
+_inflight: Dict[str, asyncio.Task] = {}
+
+
+async def _download(url: str, cached: Optional[Document], timeout: float, parse: bool) -> Document:
+    # Extraction runs between chunks; its time is reported as "parse" and the rest as "fetch"
+    started = time.perf_counter()
+    parse_seconds = 0.0
+    headers = {}
+    if cached is not None:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
+    async with get_client().stream("GET", url, headers=headers, timeout=timeout) as response:
+        if response.status_code == 304 and cached is not None:
+            cached.fetched_at = time.monotonic()
+            DOCUMENT_CACHE.set(url, cached)
+            metrics.observe_stage("fetch", time.perf_counter() - started)
+            return cached
+        response.raise_for_status()
+
+        # Stream the body under the byte/time caps, feeding the text extractor as data arrives
+        body = CappedBody(response)
+        extraction = get_extractor().start(response.charset_encoding, MAX_TEXT_CHARS) if parse and not PARSE_POOL.enabled else None
+        chunks = []
+        async for chunk in body:
+            chunks.append(chunk)
+            if extraction is not None and not extraction.done:
+                feed_started = time.perf_counter()
+                extraction.feed(chunk)
+                parse_seconds += time.perf_counter() - feed_started
+
+    content = b"".join(chunks)
+    document = Document(
+        url,
+        content,
+        encoding=sniff_encoding(content[:4096], response.charset_encoding),
+        declared_encoding=response.charset_encoding,
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+        truncated=body.truncated,
+    )
+    if extraction is not None:
+        close_started = time.perf_counter()
+        document._text = extraction.close()
+        parse_seconds += time.perf_counter() - close_started
+        metrics.observe_stage("parse", parse_seconds)
+    metrics.observe_stage("fetch", time.perf_counter() - started - parse_seconds)
+    if parse and extraction is None:
+        await _parse(document)
+    DOCUMENT_CACHE.set(url, document)
+    return document
+
+
+async def _parse(document: Document) -> None:
+    document._text = await PARSE_POOL.run(html_to_text, document.content, MAX_TEXT_CHARS, document.declared_encoding,
+                                          size=len(document.content))
+
+
+def _finish(url: str, task: asyncio.Task) -> None:
+    _inflight.pop(url, None)
+    if not task.cancelled():
+        # Mark the error as retrieved even if every caller has gone away
+        task.exception()
+
+
+async def fetch_document(url: str, timeout: float = 15, parse: bool = True) -> Document:
+    """
+    Returns the page at `url`, from cache when fresh, revalidated when stale, downloaded otherwise.
+    With `parse=True` the cleaned text is extracted while the body streams in;
+    otherwise it is computed on first access to `Document.text`.
+    Raises the errors in `http_client.FETCH_ERRORS` when the page cannot be fetched.
+    `timeout` is shortened to what is left of the request deadline.
+    """
+    cached = DOCUMENT_CACHE.get(url)
+    if cached is not None and cached.is_fresh():
+        if parse and cached._text is None and PARSE_POOL.enabled:
+            # Downloaded without parsing (e.g. by ai-scrape); extract off the event loop now
+            await _parse(cached)
+        return cached
+
+    task = _inflight.get(url)
+    if task is None:
+        task = deadlines.spawn(_download(url, cached, deadlines.timeout(timeout), parse))
+        _inflight[url] = task
+        task.add_done_callback(lambda t: _finish(url, t))
+    return await deadlines.join(task)
@@ -0,0 +1,231 @@
+"""
+RSS / Atom feed ingestion for niche-data.
+
+Feeds are streamed under the shared byte/time caps and parsed incrementally
+with `XMLPullParser`: each `<item>` (or Atom `<entry>`) is reduced to its
+title and link as soon as it is complete, and the download stops once
+`max_items` have been read. A feed that is not well-formed XML falls back to
+BeautifulSoup on whatever was received.
+
+Parsed feeds are kept in their own short-lived cache, keyed by URL. Within
+`FEED_FRESH_SECONDS` a feed is served without a request; after that it is
+revalidated with If-None-Match / If-Modified-Since, so an unchanged feed
+costs a 304. `fetch_feeds()` reads several feeds concurrently and merges
+their items, dropping duplicate titles.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from app.core import deadlines, metrics
+from app.core.cache import create_cache
+from app.core.http_client import CappedBody, get_client
+
+logger = logging.getLogger(__name__)
+
+FRESH_SECONDS = float(os.getenv("FEED_FRESH_SECONDS", "300"))
+
+_ATOM = "{http://www.w3.org/2005/Atom}"
+
+STATS = {"downloads": 0, "not_modified": 0, "fresh_hits": 0, "stopped_early": 0, "fallback_parses": 0}
+
+# (title, link)
+Item = Tuple[str, str]
+
+
+class Feed:
+    """
+    The first items of a feed, with the validators needed to revalidate it.
+    `limit` is the number of items it was read for.
+    """
+
+    def __init__(self, url: str, items: List[Item], limit: int, etag: Optional[str], last_modified: Optional[str]):
+        self.url = url
+        self.items = items
+        self.limit = limit
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = time.monotonic()
+
+    @property
+    def cache_size(self) -> int:
+        return sum(len(title) + len(link) for title, link in self.items) * 2 + 256
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() - self.fetched_at < FRESH_SECONDS
+
+
+# Key: feed url, Value: Feed; kept past FRESH_SECONDS so stale feeds can be revalidated
+FEED_CACHE = create_cache("feeds", max_entries=2000, max_bytes=16 * 1024 * 1024, ttl=60 * 60)
+
+# Downloads in progress, shared by concurrent callers for the same URL
+_inflight: Dict[str, asyncio.Task] = {}
+
+
+def _text(element: Optional[ET.Element]) -> str:
+    return (element.text or "").strip() if element is not None else ""
+
+
+def _item(element: ET.Element) -> Optional[Item]:
+    if element.tag == "item":
+        title, link = _text(element.find("title")), _text(element.find("link"))
+    elif element.tag == _ATOM + "entry":
+        title = _text(element.find(_ATOM + "title"))
+        link_element = element.find(_ATOM + "link")
+        link = link_element.get("href", "") if link_element is not None else ""
+    else:
+        return None
+    return (title, link) if title else None
+
+
+class _ItemParser:
+    """
+    Feeds chunks to an `XMLPullParser` and collects items until `max_items` are read.
+    """
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self.items: List[Item] = []
+        self.failed = False
+        self._parser = ET.XMLPullParser(events=("end",))
+
+    def feed(self, chunk: bytes) -> None:
+        try:
+            self._parser.feed(chunk)
+            for _, element in self._parser.read_events():
+                item = _item(element)
+                if item is None:
+                    continue
+                self.items.append(item)
+                # Items are not needed once read; keep the tree from growing with the feed
+                element.clear()
+                if len(self.items) >= self.max_items:
+                    return
+        except ET.ParseError:
+            self.failed = True
+
+
+def _fallback_items(content: bytes, max_items: int) -> List[Item]:
+    # Lenient parse for feeds that are not well-formed XML
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, "html.parser")
+    items = []
+    for element in soup.find_all("item")[:max_items]:
+        title = element.title.text.strip() if element.title else ""
+        link = element.link.text.strip() if element.link else ""
+        if title:
+            items.append((title, link))
+    return items
+
+
+async def _download(url: str, cached: Optional[Feed], timeout: float, max_items: int) -> Feed:
+    started = time.perf_counter()
+    parse_seconds = 0.0
+    headers = {}
+    # A 304 only helps if the cached copy was read for at least as many items
+    if cached is not None and cached.limit >= max_items:
+        if cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
+    async with get_client().stream("GET", url, headers=headers, timeout=timeout) as response:
+        if response.status_code == 304 and headers:
+            STATS["not_modified"] += 1
+            cached.fetched_at = time.monotonic()
+            FEED_CACHE.set(url, cached)
+            metrics.observe_stage("fetch", time.perf_counter() - started)
+            return cached
+        response.raise_for_status()
+        STATS["downloads"] += 1
+
+        parser = _ItemParser(max_items)
+        chunks = []
+        async for chunk in CappedBody(response):
+            chunks.append(chunk)
+            if not parser.failed:
+                feed_started = time.perf_counter()
+                parser.feed(chunk)
+                parse_seconds += time.perf_counter() - feed_started
+                if len(parser.items) >= max_items:
+                    # Enough items: the rest of the feed is not downloaded
+                    STATS["stopped_early"] += 1
+                    break
+
+    items = parser.items
+    if parser.failed:
+        STATS["fallback_parses"] += 1
+        fallback_started = time.perf_counter()
+        items = _fallback_items(b"".join(chunks), max_items)
+        parse_seconds += time.perf_counter() - fallback_started
+    metrics.observe_stage("parse", parse_seconds)
+    metrics.observe_stage("fetch", time.perf_counter() - started - parse_seconds)
+
+    feed = Feed(url, items, max_items, etag=response.headers.get("ETag"), last_modified=response.headers.get("Last-Modified"))
+    FEED_CACHE.set(url, feed)
+    return feed
+
+
+def _finish(url: str, task: asyncio.Task) -> None:
+    _inflight.pop(url, None)
+    if not task.cancelled():
+        # Mark the error as retrieved even if every caller has gone away
+        task.exception()
+
+
+async def fetch_feed(url: str, max_items: int = 10, timeout: float = 10) -> Feed:
+    """
+    Returns the first `max_items` items of the feed at `url`, from cache when fresh,
+    revalidated when stale, downloaded otherwise.
+    Raises the errors in `http_client.FETCH_ERRORS` when the feed cannot be fetched.
+    """
+    cached = FEED_CACHE.get(url)
+    if cached is not None and cached.is_fresh() and cached.limit >= max_items:
+        STATS["fresh_hits"] += 1
+        return cached
+
+    task = _inflight.get(url)
+    if task is None:
+        task = deadlines.spawn(_download(url, cached, deadlines.timeout(timeout), max_items))
+        _inflight[url] = task
+        task.add_done_callback(lambda t: _finish(url, t))
+    return await deadlines.join(task)
+
+
+async def fetch_feeds(urls: Sequence[str], max_items: int = 10, timeout: float = 10) -> List[Item]:
+    """
+    Fetches `urls` concurrently and merges their items, taking them from each feed
+    in turn and skipping titles already seen, up to `max_items`.
+    Feeds that fail are skipped; the error of the first one is raised only if all of them fail.
+    """
+    results = await asyncio.gather(*(fetch_feed(url, max_items, timeout) for url in urls), return_exceptions=True)
+    feeds = []
+    for url, result in zip(urls, results):
+        if isinstance(result, Feed):
+            feeds.append(result)
+        else:
+            logger.warning("feed %s failed: %r", url, result)
+    if not feeds:
+        raise results[0]
+
+    merged: List[Item] = []
+    seen = set()
+    for row in range(max_items):
+        for feed in feeds:
+            if row < len(feed.items) and feed.items[row][0] not in seen:
+                seen.add(feed.items[row][0])
+                merged.append(feed.items[row])
+                if len(merged) >= max_items:
+                    return merged
+    return merged
+
+
+def fingerprint(items: Sequence[Item]) -> str:
+    """
+    Digest of the set of titles, independent of their order.
+    """
+    return hashlib.sha256("\n".join(sorted(title for title, _ in items)).encode("utf-8")).hexdigest()[:32]
@@ -0,0 +1,249 @@
+"""
+App-scoped Gemini client.
+
+The `genai.Client` is built once per worker and its async transport
+(`client.aio`) is reused by every router, so LLM calls are awaited instead of
+blocking the event loop and many of them can be in flight at the same time.
+
+`google.genai` takes about half a second to import, so it is only imported
+when a client or config is first needed (normally by the background warm-up in
+`app/core/warmup.py`), not when the app starts.
+
+`GEMINI_BASE_URL` points the client at another endpoint, such as the fake
+Gemini server used by `benchmarks/bench_load.py`.
+
+`generate_content` is also the gateway every call goes through. Calls wait for
+a slot of a worker-wide limiter and of a per-model limiter, both adapting
+AIMD-style to 429/503 replies and latency (`app/core/adaptive_limit.py`), so a
+burst queues here instead of tripping the upstream quota. 429, 5xx, timeouts
+and connection errors are retried with full-jitter backoff, honouring the
+server's retry hint. No attempt, wait or backoff runs past the call's
+deadline, which defaults to the request deadline (`app/core/deadlines.py`). When retries run out on overload, a 503 with `Retry-After` is
+raised instead of a generic 500.
+"""
+import asyncio
+import os
+import random
+import re
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from app.core import deadlines, metrics
+from app.core.adaptive_limit import ERROR, OK, OVERLOAD, AdaptiveLimiter
+
+if TYPE_CHECKING:
+    from google import genai
+
+load_dotenv()
+
+MODEL = "gemini-2.5-flash"
+BASE_URL = os.getenv("GEMINI_BASE_URL")
+
+# Concurrent calls per worker (all models) and per model; the limits move between MIN and the maximum
+MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "64"))
+MODEL_MAX_CONCURRENCY = int(os.getenv("GEMINI_MODEL_MAX_CONCURRENCY", "32"))
+INITIAL_CONCURRENCY = int(os.getenv("GEMINI_INITIAL_CONCURRENCY", "16"))
+MIN_CONCURRENCY = int(os.getenv("GEMINI_MIN_CONCURRENCY", "1"))
+MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "4"))
+BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "1"))
+BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "30"))
+# Budget for one generate_content call (queueing, attempts and backoff) when the caller sets no deadline
+DEADLINE_SECONDS = float(os.getenv("GEMINI_DEADLINE_SECONDS", "60"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Replies that mean "too much load", as opposed to a failed call
+OVERLOAD_STATUSES = {429, 503}
+
+_RETRY_DELAY = re.compile(r"^(\d+(?:\.\d+)?)s$")
+
+GLOBAL_LIMITER = AdaptiveLimiter("global", min(INITIAL_CONCURRENCY, MAX_CONCURRENCY), MIN_CONCURRENCY, MAX_CONCURRENCY)
+# Per-model limiters, created on first use
+MODEL_LIMITERS: Dict[str, AdaptiveLimiter] = {}
+STATS = {"calls": 0, "attempts": 0, "retries": 0, "overloaded": 0, "deadline_exceeded": 0}
+
+_client: Optional["genai.Client"] = None
+# The warm-up thread and the event loop may both create the client
+_client_lock = threading.Lock()
+
+
+def ensure_configured() -> None:
+    """
+    Raises a 500 error when GEMINI_API_KEY is missing, before a handler starts any work.
+    """
+    if not os.getenv("GEMINI_API_KEY"):
+        raise HTTPException(
+            status_code=500,
+            detail="GEMINI_API_KEYが設定されていません。.envファイルに設定してください。"
+        )
+
+
+def get_client() -> "genai.Client":
+    """
+    Returns the shared client, creating it on first use if the warm-up did not (e.g. the key was set later).
+    """
+    global _client
+    if _client is None:
+        ensure_configured()
+        with _client_lock:
+            if _client is None:
+                from google import genai
+                http_options = {"base_url": BASE_URL} if BASE_URL else None
+                _client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"), http_options=http_options)
+    return _client
+
+
+def content_config(**kwargs) -> "genai.types.GenerateContentConfig":
+    """
+    Builds a `GenerateContentConfig` without importing google.genai at module load.
+    """
+    from google.genai import types
+    return types.GenerateContentConfig(**kwargs)
+
+
+def _model_limiter(model: str) -> AdaptiveLimiter:
+    limiter = MODEL_LIMITERS.get(model)
+    if limiter is None:
+        limiter = MODEL_LIMITERS[model] = AdaptiveLimiter(
+            model, min(INITIAL_CONCURRENCY, MODEL_MAX_CONCURRENCY), MIN_CONCURRENCY, MODEL_MAX_CONCURRENCY
+        )
+    return limiter
+
+
+def _status_of(error: Exception) -> Optional[int]:
+    """
+    HTTP status of a failed call; None for timeouts and connection errors.
+    """
+    code = getattr(error, "code", None)
+    return code if isinstance(code, int) else None
+
+
+def _retry_hint(error: Exception) -> Optional[float]:
+    """
+    Seconds the server asked us to wait: a `RetryInfo.retryDelay` in the error body, or `Retry-After`.
+    """
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        for detail in (details.get("error") or {}).get("details") or []:
+            match = _RETRY_DELAY.match(str(detail.get("retryDelay", "")))
+            if match:
+                return float(match.group(1))
+    response = getattr(error, "response", None)
+    retry_after = getattr(response, "headers", {}).get("retry-after") if response is not None else None
+    if retry_after and retry_after.replace(".", "", 1).isdigit():
+        return float(retry_after)
+    return None
+
+
+def _backoff(attempt: int, hint: Optional[float]) -> float:
+    if hint is not None:
+        return min(hint, BACKOFF_MAX)
+    # Full jitter, so workers that failed together do not retry together
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+def _unavailable(retry_after: Optional[float]) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Gemini APIが混雑しています。しばらくしてから再度お試しください。",
+        headers={"Retry-After": str(max(1, round(retry_after or BACKOFF_BASE)))},
+    )
+
+
+def _timed_out() -> HTTPException:
+    return HTTPException(status_code=504, detail="Gemini APIの応答が制限時間内に得られませんでした。")
+
+
+async def _acquire(limiter: AdaptiveLimiter, deadline: float) -> None:
+    try:
+        waited = await limiter.acquire(timeout=max(0.0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        # Still queued when the budget ran out: the limiter is saturated
+        STATS["deadline_exceeded"] += 1
+        raise _unavailable(None)
+    if waited:
+        metrics.observe_stage("llm_queue", waited)
+
+
+async def generate_content(contents, config: Optional["genai.types.GenerateContentConfig"] = None, model: str = MODEL,
+                           deadline: Optional[float] = None):
+    """
+    Awaitable equivalent of `client.models.generate_content` using the shared async transport,
+    behind the adaptive concurrency limit and retry policy. `deadline` is a `time.monotonic()` time;
+    by default GEMINI_DEADLINE_SECONDS from now, or the request deadline if that comes first.
+    Timed as the "llm" stage (time queued for a slot as "llm_queue"); token usage is counted per router.
+    """
+    client = get_client()
+    if deadline is None:
+        deadline = deadlines.at(DEADLINE_SECONDS)
+    model_limiter = _model_limiter(model)
+    STATS["calls"] += 1
+
+    attempt = 0
+    while True:
+        attempt += 1
+        await _acquire(model_limiter, deadline)
+        try:
+            await _acquire(GLOBAL_LIMITER, deadline)
+        except BaseException:
+            model_limiter.release(ERROR)
+            raise
+
+        STATS["attempts"] += 1
+        start = time.monotonic()
+        outcome, error = ERROR, None
+        try:
+            with metrics.stage("llm"):
+                response = await asyncio.wait_for(
+                    client.aio.models.generate_content(model=model, contents=contents, config=config),
+                    max(0.0, deadline - start),
+                )
+            outcome = OK
+        except Exception as e:
+            error = e
+            if _status_of(e) in OVERLOAD_STATUSES:
+                outcome = OVERLOAD
+        finally:
+            latency = time.monotonic() - start
+            model_limiter.release(outcome, latency)
+            GLOBAL_LIMITER.release(outcome, latency)
+
+        if error is None:
+            metrics.add_gemini_usage(getattr(response, "usage_metadata", None))
+            return response
+
+        status = _status_of(error)
+        if isinstance(error, asyncio.TimeoutError):
+            STATS["deadline_exceeded"] += 1
+            raise _timed_out()
+        if status not in RETRY_STATUSES and not isinstance(error, httpx.TransportError):
+            raise error
+        hint = _retry_hint(error)
+        delay = _backoff(attempt, hint)
+        if attempt >= MAX_ATTEMPTS or time.monotonic() + delay >= deadline:
+            if status in OVERLOAD_STATUSES:
+                STATS["overloaded"] += 1
+                raise _unavailable(hint)
+            raise error
+        STATS["retries"] += 1
+        await asyncio.sleep(delay)
+
+
+def warm() -> None:
+    """
+    Creates the client ahead of the first request (called from the warm-up thread).
+    """
+    if os.getenv("GEMINI_API_KEY"):
+        get_client()
+
+
+async def shutdown() -> None:
+    global _client
+    if _client is not None:
+        await _client.aio.aclose()
+        _client.close()
+        _client = None
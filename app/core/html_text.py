@@ -0,0 +1,360 @@
+"""
+HTML-to-text cleanup shared by the routers that send page text to Gemini.
+
+Two interchangeable extractors produce the same output: the original
+BeautifulSoup path and a faster one built on lxml's C parser. `HTML_EXTRACTOR`
+selects one (`lxml` by default, `bs4` to fall back). Both accept a character
+budget and stop building text as soon as it is reached.
+`benchmarks/bench_html_extract.py` compares them over saved pages.
+
+Extractors can also be fed incrementally (`start()` / `feed()` / `close()`)
+while a page is still downloading. The lxml extractor decodes the charset
+incrementally and never builds a tree, so a large page is not held in memory
+twice.
+
+`page_links()` reads a page's links and canonical URL the same way, for the
+ai-scrape crawler.
+"""
+import codecs
+import os
+import re
+from typing import Iterable, List, Optional, Tuple
+from urllib.parse import urljoin
+
+try:
+    from lxml import etree
+except ImportError:  # pragma: no cover - lxml ships with trafilatura
+    etree = None
+
+# Tags whose content never carries useful page text
+REMOVED_TAGS = ["script", "style", "noscript", "meta", "link", "header", "footer"]
+
+# Default character budget for extracted page text (context selection narrows it further for prompts)
+MAX_TEXT_CHARS = int(os.getenv("HTML_TEXT_MAX_CHARS", "100000"))
+
+# Bytes inspected for a BOM or <meta charset> before decoding starts
+_SNIFF_BYTES = 4096
+# Slice size when a whole document is fed to an incremental parser
+_FEED_BYTES = 16384
+_META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([A-Za-z0-9_\-:.]+)""", re.IGNORECASE)
+_BOMS = [(codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16")]
+
+
+def _codec(name: Optional[str]) -> Optional[str]:
+    if not name:
+        return None
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+
+def sniff_encoding(head: bytes, declared: Optional[str] = None) -> str:
+    """
+    Picks the charset for a page from its Content-Type charset, BOM or <meta> declaration,
+    falling back to UTF-8 (or windows-1252 when the first bytes are not valid UTF-8).
+    """
+    encoding = _codec(declared)
+    if encoding:
+        return encoding
+    for bom, bom_encoding in _BOMS:
+        if head.startswith(bom):
+            return bom_encoding
+    match = _META_CHARSET.search(head[:_SNIFF_BYTES])
+    if match:
+        encoding = _codec(match.group(1).decode("ascii"))
+        if encoding:
+            return encoding
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "windows-1252"
+
+
+class _TextBudget:
+    """
+    Joins page strings one phrase per line, exactly like `"\\n".join(...)` over
+    `get_text(separator="\\n")`, and reports when `max_chars` has been reached.
+    """
+
+    def __init__(self, max_chars: Optional[int]):
+        self.max_chars = max_chars
+        self.chunks: List[str] = []
+        self.length = -1  # no separator before the first chunk
+        self.full = False
+
+    def add(self, string: str) -> bool:
+        for line in string.splitlines():
+            for phrase in line.strip().split("  "):
+                phrase = phrase.strip()
+                if not phrase:
+                    continue
+                self.chunks.append(phrase)
+                self.length += len(phrase) + 1
+                if self.max_chars is not None and self.length >= self.max_chars:
+                    self.full = True
+                    return True
+        return False
+
+    def text(self) -> str:
+        text = "\n".join(self.chunks)
+        return text if self.max_chars is None else text[:self.max_chars]
+
+
+def _clean_strings(strings: Iterable[str], max_chars: Optional[int]) -> str:
+    budget = _TextBudget(max_chars)
+    for string in strings:
+        if budget.add(string):
+            break
+    return budget.text()
+
+
+class _BufferedExtraction:
+    """
+    Incremental interface for extractors that can only parse a whole document.
+    """
+
+    def __init__(self, extractor, encoding: Optional[str], max_chars: Optional[int]):
+        self._extractor = extractor
+        self._encoding = encoding
+        self._max_chars = max_chars
+        self._chunks: List[bytes] = []
+        self.done = False
+
+    def feed(self, chunk: bytes) -> None:
+        self._chunks.append(chunk)
+
+    def close(self) -> str:
+        return self._extractor.extract(b"".join(self._chunks), self._max_chars, self._encoding)
+
+
+class BeautifulSoupExtractor:
+    """
+    Pure-Python html.parser path (the original implementation).
+    """
+    name = "bs4"
+
+    def extract(self, content: bytes, max_chars: Optional[int] = None, encoding: Optional[str] = None) -> str:
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(content, "html.parser", from_encoding=encoding)
+
+        # Remove unwanted tags
+        for script_or_style in soup(REMOVED_TAGS):
+            script_or_style.decompose()
+
+        return _clean_strings(soup.strings, max_chars)
+
+    def start(self, encoding: Optional[str] = None, max_chars: Optional[int] = None) -> _BufferedExtraction:
+        return _BufferedExtraction(self, encoding, max_chars)
+
+
+class _TextTarget:
+    """
+    lxml parser target that collects visible text without building a tree.
+    Removed tags, comments and processing instructions are skipped but the
+    text that follows them is kept.
+    """
+
+    # <template> content is not part of the rendered page (BeautifulSoup skips it too)
+    _SKIPPED = frozenset(REMOVED_TAGS) | {"template"}
+
+    def __init__(self, budget: _TextBudget):
+        self.budget = budget
+        self._pending: List[str] = []
+        self._skip_depth = 0
+
+    def _flush(self) -> None:
+        # A text node may arrive in several data() calls; it is only complete at the next event
+        if self._pending:
+            string = "".join(self._pending)
+            self._pending = []
+            if not self.budget.full:
+                self.budget.add(string)
+
+    def start(self, tag, attrib) -> None:
+        self._flush()
+        if self._skip_depth or tag in self._SKIPPED:
+            self._skip_depth += 1
+
+    def end(self, tag) -> None:
+        self._flush()
+        if self._skip_depth:
+            self._skip_depth -= 1
+
+    def data(self, data: str) -> None:
+        if not self._skip_depth:
+            self._pending.append(data)
+
+    def comment(self, text) -> None:
+        self._flush()
+
+    def pi(self, target, data=None) -> None:
+        self._flush()
+
+    def close(self) -> None:
+        self._flush()
+
+
+class _LxmlExtraction:
+    def __init__(self, encoding: Optional[str], max_chars: Optional[int]):
+        self._declared = encoding
+        self._head = b""
+        self._decoder = None
+        self._budget = _TextBudget(max_chars)
+        self._target = _TextTarget(self._budget)
+        self._parser = etree.HTMLParser(target=self._target)
+        self._fed = False
+
+    @property
+    def done(self) -> bool:
+        return self._budget.full
+
+    def _feed_text(self, text: str) -> None:
+        if text:
+            self._parser.feed(text)
+            self._fed = True
+
+    def feed(self, chunk: bytes) -> None:
+        if self.done:
+            return
+        if self._decoder is None:
+            self._head += chunk
+            if len(self._head) < _SNIFF_BYTES:
+                return
+            chunk, self._head = self._head, b""
+            self._decoder = codecs.getincrementaldecoder(sniff_encoding(chunk, self._declared))(errors="replace")
+        self._feed_text(self._decoder.decode(chunk))
+
+    def close(self) -> str:
+        if not self.done:
+            if self._decoder is None:
+                head, self._head = self._head, b""
+                self._decoder = codecs.getincrementaldecoder(sniff_encoding(head, self._declared))(errors="replace")
+                self._feed_text(self._decoder.decode(head))
+            self._feed_text(self._decoder.decode(b"", final=True))
+        if self._fed:
+            try:
+                self._parser.close()
+            except etree.XMLSyntaxError:
+                # Truncated or empty documents still yield the text seen so far
+                pass
+        return self._budget.text()
+
+
+class LxmlExtractor:
+    """
+    libxml2-backed path driven through a parser target, so no tree is built.
+    """
+    name = "lxml"
+
+    def extract(self, content: bytes, max_chars: Optional[int] = None, encoding: Optional[str] = None) -> str:
+        extraction = self.start(encoding, max_chars)
+        # Feed in slices so parsing stops soon after the budget is reached
+        for offset in range(0, len(content), _FEED_BYTES):
+            if extraction.done:
+                break
+            extraction.feed(content[offset:offset + _FEED_BYTES])
+        return extraction.close()
+
+    def start(self, encoding: Optional[str] = None, max_chars: Optional[int] = None) -> _LxmlExtraction:
+        return _LxmlExtraction(encoding, max_chars)
+
+
+EXTRACTORS = {"bs4": BeautifulSoupExtractor()}
+if etree is not None:
+    EXTRACTORS["lxml"] = LxmlExtractor()
+
+DEFAULT_EXTRACTOR = os.getenv("HTML_EXTRACTOR", "lxml" if etree is not None else "bs4")
+
+
+def get_extractor(name: Optional[str] = None):
+    return EXTRACTORS[name or DEFAULT_EXTRACTOR]
+
+
+def html_to_text(content: bytes, max_chars: Optional[int] = MAX_TEXT_CHARS, encoding: Optional[str] = None) -> str:
+    """
+    Strips non-content tags and returns the visible text, one phrase per line,
+    truncated to `max_chars` (None for the whole page). `encoding` is the
+    charset from the Content-Type header, if any.
+    """
+    return get_extractor().extract(content, max_chars, encoding)
+
+
+def extract_markdown(html: str) -> Optional[str]:
+    """
+    Main content of a page as markdown (trafilatura), or None when nothing could be extracted.
+    A module-level function so it can run in the parse pool's worker processes.
+    """
+    # Imported on first use; see app/core/warmup.py
+    import trafilatura
+    return trafilatura.extract(html, output_format="markdown")
+
+
+class _LinkTarget:
+    """
+    lxml parser target that collects `<a href>`, `<link rel=canonical>` and `<base href>` without building a tree.
+    """
+
+    def __init__(self):
+        self.hrefs: List[str] = []
+        self.canonical: Optional[str] = None
+        self.base: Optional[str] = None
+
+    def start(self, tag, attrib) -> None:
+        href = (attrib.get("href") or "").strip()
+        if not href:
+            return
+        if tag == "a":
+            self.hrefs.append(href)
+        elif tag == "link" and self.canonical is None and "canonical" in (attrib.get("rel") or "").lower().split():
+            self.canonical = href
+        elif tag == "base" and self.base is None:
+            self.base = href
+
+    def end(self, tag) -> None:
+        pass
+
+    def data(self, data) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+def page_links(content: bytes, url: str, encoding: Optional[str] = None) -> Tuple[Optional[str], List[str]]:
+    """
+    The page's canonical URL (if declared) and the targets of its links, resolved against `url`
+    (or its `<base href>`), in document order. Like `extract_markdown`, safe to run in the parse pool.
+    """
+    target = _LinkTarget()
+    text = content.decode(sniff_encoding(content[:_SNIFF_BYTES], encoding), errors="replace")
+    if etree is not None:
+        parser = etree.HTMLParser(target=target)
+        if text:
+            parser.feed(text)
+            try:
+                parser.close()
+            except etree.XMLSyntaxError:
+                pass
+    else:
+        from bs4 import BeautifulSoup
+        for element in BeautifulSoup(text, "html.parser").find_all(["a", "link", "base"]):
+            rel = element.get("rel") or []
+            target.start(element.name, {"href": element.get("href"), "rel": " ".join(rel) if isinstance(rel, list) else rel})
+
+    base = _resolve(url, target.base) or url
+    canonical = _resolve(base, target.canonical)
+    links = [_resolve(base, href) for href in target.hrefs]
+    return canonical, [link for link in links if link]
+
+
+def _resolve(base: str, href: Optional[str]) -> Optional[str]:
+    if not href:
+        return None
+    try:
+        return urljoin(base, href)
+    except ValueError:
+        # e.g. a malformed IPv6 host
+        return None
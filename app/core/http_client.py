@@ -0,0 +1,284 @@
+"""
+Shared async HTTP client used by every router for outbound requests.
+
+One pooled `httpx.AsyncClient` is created at application startup and closed at
+shutdown, so connections (and HTTP/2 sessions where the target supports them)
+are kept alive and reused across requests instead of blocking the event loop
+with `requests`.
+"""
+import asyncio
+import ipaddress
+import os
+import socket
+from contextlib import contextmanager
+from typing import AsyncIterator, Iterator, List, Optional
+
+import httpcore
+import httpx
+
+from app.core import deadlines, metrics
+from app.core.cache import TTLCache, create_cache
+
+# Browser-like User-Agent shared by the scraping routers
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"
+
+MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+DNS_CACHE_TTL = float(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+DNS_CACHE_MAX_ENTRIES = int(os.getenv("HTTP_DNS_CACHE_MAX_ENTRIES", "4096"))
+DEFAULT_TIMEOUT = float(os.getenv("HTTP_DEFAULT_TIMEOUT", "15"))
+# Budgets for a single response body; anything beyond them is dropped
+MAX_RESPONSE_BYTES = int(os.getenv("HTTP_MAX_RESPONSE_BYTES", str(2 * 1024 * 1024)))
+MAX_RESPONSE_SECONDS = float(os.getenv("HTTP_MAX_RESPONSE_SECONDS", "20"))
+
+# Errors raised by the client for unreachable hosts, bad status codes or malformed URLs
+FETCH_ERRORS = (httpx.HTTPError, httpx.InvalidURL)
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+# Key: (host, port), Value: [ip, ...]; bounded, since callers choose the hosts
+DNS_CACHE = create_cache("dns", max_entries=DNS_CACHE_MAX_ENTRIES, max_bytes=4 * 1024 * 1024, ttl=DNS_CACHE_TTL)
+
+
+class _CachingResolverBackend(httpcore.AsyncNetworkBackend):
+    """
+    Network backend that caches DNS lookups in `cache`.
+
+    Connections are opened to the resolved IP address; TLS still uses the
+    original hostname for SNI and certificate verification.
+    """
+
+    def __init__(self, cache: TTLCache):
+        self._backend = httpcore.AnyIOBackend()
+        self._cache = cache
+
+    async def _resolve(self, host: str, port: int) -> List[str]:
+        try:
+            ipaddress.ip_address(host)
+            return [host]
+        except ValueError:
+            pass
+
+        key = (host, port)
+        cached = self._cache.get(key)
+        if cached:
+            return cached
+
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            raise httpcore.ConnectError(str(e)) from e
+
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        self._cache.set(key, addresses)
+        return addresses
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        addresses = await self._resolve(host, port)
+        last_error: Optional[Exception] = None
+        for address in addresses:
+            try:
+                return await self._backend.connect_tcp(
+                    address, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                last_error = e
+        # Every cached address failed; resolve again on the next attempt
+        self._cache.delete((host, port))
+        raise last_error
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self._backend.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+
+# httpcore errors and the httpx errors callers catch (see FETCH_ERRORS), most specific first
+_ERRORS = [
+    (httpcore.ConnectTimeout, httpx.ConnectTimeout),
+    (httpcore.ReadTimeout, httpx.ReadTimeout),
+    (httpcore.WriteTimeout, httpx.WriteTimeout),
+    (httpcore.PoolTimeout, httpx.PoolTimeout),
+    (httpcore.TimeoutException, httpx.TimeoutException),
+    (httpcore.ConnectError, httpx.ConnectError),
+    (httpcore.ReadError, httpx.ReadError),
+    (httpcore.WriteError, httpx.WriteError),
+    (httpcore.NetworkError, httpx.NetworkError),
+    (httpcore.ProxyError, httpx.ProxyError),
+    (httpcore.UnsupportedProtocol, httpx.UnsupportedProtocol),
+    (httpcore.LocalProtocolError, httpx.LocalProtocolError),
+    (httpcore.RemoteProtocolError, httpx.RemoteProtocolError),
+    (httpcore.ProtocolError, httpx.ProtocolError),
+]
+
+
+@contextmanager
+def _httpx_errors() -> Iterator[None]:
+    try:
+        yield
+    except Exception as e:
+        for core_error, httpx_error in _ERRORS:
+            if isinstance(e, core_error):
+                raise httpx_error(str(e)) from e
+        raise
+
+
+class _ResponseStream(httpx.AsyncByteStream):
+    def __init__(self, stream):
+        self._stream = stream
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        with _httpx_errors():
+            async for part in self._stream:
+                yield part
+
+    async def aclose(self) -> None:
+        if hasattr(self._stream, "aclose"):
+            await self._stream.aclose()
+
+
+class _PooledTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport over an httpcore connection pool that resolves hosts through `_CachingResolverBackend`.
+    """
+
+    def __init__(self, limits: httpx.Limits, http2: bool, dns_cache: TTLCache = DNS_CACHE):
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(),
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            http1=True,
+            http2=http2,
+            network_backend=_CachingResolverBackend(dns_cache),
+        )
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        core_request = httpcore.Request(
+            method=request.method,
+            url=httpcore.URL(
+                scheme=request.url.raw_scheme,
+                host=request.url.raw_host,
+                port=request.url.port,
+                target=request.url.raw_path,
+            ),
+            headers=request.headers.raw,
+            content=request.stream,
+            extensions=request.extensions,
+        )
+        with _httpx_errors():
+            response = await self._pool.handle_async_request(core_request)
+        return httpx.Response(
+            status_code=response.status,
+            headers=response.headers,
+            stream=_ResponseStream(response.stream),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self._pool.aclose()
+
+
+class CappedBody:
+    """
+    Iterates over a streamed response body, stopping after `max_bytes` of
+    decompressed content or once `max_seconds` have passed since it was created.
+    `truncated` tells whether the body was cut short.
+    """
+
+    def __init__(self, response: httpx.Response, max_bytes: int = MAX_RESPONSE_BYTES, max_seconds: float = MAX_RESPONSE_SECONDS):
+        self.response = response
+        self.max_bytes = max_bytes
+        self.received = 0
+        self.truncated = False
+        self._deadline = asyncio.get_running_loop().time() + max_seconds
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        loop = asyncio.get_running_loop()
+        chunks = self.response.aiter_bytes()
+        try:
+            while True:
+                remaining = self._deadline - loop.time()
+                if remaining <= 0:
+                    self.truncated = True
+                    return
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), remaining)
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    self.truncated = True
+                    return
+                if self.received + len(chunk) > self.max_bytes:
+                    chunk = chunk[:self.max_bytes - self.received]
+                    self.truncated = True
+                self.received += len(chunk)
+                if chunk:
+                    yield chunk
+                if self.truncated:
+                    return
+        finally:
+            await chunks.aclose()
+
+
+async def fetch_bytes(url: str, timeout: float = DEFAULT_TIMEOUT, max_bytes: int = MAX_RESPONSE_BYTES,
+                      max_seconds: float = MAX_RESPONSE_SECONDS, headers: Optional[dict] = None) -> bytes:
+    """
+    GETs `url` and returns at most `max_bytes` of its body, read as a stream.
+    Raises `httpx.HTTPStatusError` for 4xx/5xx responses. `timeout` is shortened to what is left of the request deadline.
+    """
+    with metrics.stage("fetch"):
+        async with get_client().stream("GET", url, headers=headers, timeout=deadlines.timeout(timeout)) as response:
+            response.raise_for_status()
+            return b"".join([chunk async for chunk in CappedBody(response, max_bytes, max_seconds)])
+
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def create_client(max_connections: int = MAX_CONNECTIONS, max_keepalive_connections: int = MAX_KEEPALIVE_CONNECTIONS,
+                  timeout: float = DEFAULT_TIMEOUT, follow_redirects: bool = True) -> httpx.AsyncClient:
+    """
+    Builds a pooled client with the shared DNS cache and HTTP/2 settings.
+    Subsystems that need their own connection limits (e.g. webhook delivery) use this directly.
+    """
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(
+        transport=_PooledTransport(limits, http2=HTTP2_AVAILABLE),
+        headers={"User-Agent": USER_AGENT},
+        timeout=timeout,
+        follow_redirects=follow_redirects,
+    )
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Returns the shared client, creating it on first use if the app lifespan has not started it.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = create_client()
+    return _client
+
+
+async def startup() -> None:
+    get_client()
+
+
+async def shutdown() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -0,0 +1,177 @@
+"""
+Decoding of JSON replies from Gemini.
+
+Routers call `generate_json()` instead of parsing `response.text` themselves.
+Every call uses Gemini's JSON mode. Fixed shapes also pass a Pydantic
+`schema`, which Gemini enforces as structured output and which the decoded
+reply is validated against. Free-form shapes (user-written instructions) are
+decoded with `extract_json()`: one linear scan that yields the balanced
+`{...}` / `[...]` spans outside of strings and returns the first that parses,
+so code fences and surrounding prose are skipped without regex backtracking.
+
+A reply that does not decode gets a single repair pass instead of failing the
+request: trailing commas are dropped and the brackets of a truncated reply are
+closed locally, and only if that fails Gemini is asked once, with just the
+broken reply, to return it as valid JSON (an empty reply re-runs the original
+request instead). `LLMJSONError` is raised if that does not help either.
+"""
+import json
+import os
+import re
+from typing import Any, List, Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+from app.core import gemini, metrics
+
+REPAIR_ENABLED = os.getenv("LLM_JSON_REPAIR_ENABLED", "1") == "1"
+# Longest broken reply sent back to Gemini for repair
+REPAIR_MAX_CHARS = int(os.getenv("LLM_JSON_REPAIR_MAX_CHARS", "20000"))
+
+REPAIR_PROMPT = "次のテキストは不正な形式のJSONです。内容を変えずに、有効なJSONのみを出力してください。\n\n{text}"
+
+# Characters that can change the bracket/string state; everything else is skipped by the regex engine
+_TOKENS = re.compile(r'[{}\[\]"\\]')
+_CLOSERS = {"{": "}", "[": "]"}
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+
+STATS = {"decoded": 0, "repaired": 0, "repair_calls": 0, "failures": 0}
+
+
+class LLMJSONError(ValueError):
+    """
+    The Gemini reply could not be decoded as the expected JSON, even after the repair pass.
+    """
+
+    def __init__(self, text: str):
+        super().__init__("Gemini response is not valid JSON")
+        self.text = text
+
+
+def _scan(text: str) -> Tuple[List[Tuple[int, int]], int, List[str], bool]:
+    """
+    Returns the top-level balanced spans, and the start, expected closers and
+    in-string state of a span still open at the end of the text (a truncated reply).
+    """
+    spans = []
+    stack: List[str] = []
+    start = 0
+    in_string = False
+    skip = 0
+    for match in _TOKENS.finditer(text):
+        i = match.start()
+        if i < skip:
+            continue
+        char = match.group()
+        if in_string:
+            if char == "\\":
+                skip = i + 2
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            # Quotes in prose outside a candidate value do not start a string
+            in_string = bool(stack)
+        elif char in _CLOSERS:
+            if not stack:
+                start = i
+            stack.append(_CLOSERS[char])
+        elif stack:
+            if char != stack.pop():
+                # Mismatched bracket: this candidate is not JSON, look for the next one
+                stack.clear()
+            elif not stack:
+                spans.append((start, i + 1))
+    return spans, start, stack, in_string
+
+
+def extract_json(text: str) -> Any:
+    """
+    Returns the first balanced JSON object or array in `text` that parses. Raises ValueError if there is none.
+    """
+    stripped = text.strip()
+    if stripped[:1] in ("{", "["):
+        try:
+            return json.loads(stripped)
+        except ValueError:
+            pass
+    for start, end in _scan(text)[0]:
+        try:
+            return json.loads(text[start:end])
+        except ValueError:
+            continue
+    raise ValueError("no JSON object or array found")
+
+
+def repair_json(text: str) -> Any:
+    """
+    Cheap local fixes for a reply that did not parse: trailing commas and the brackets left open by truncation.
+    """
+    spans, start, pending, in_string = _scan(text)
+    if pending:
+        candidate = text[start:]
+        if in_string:
+            candidate += '"'
+        candidate = candidate.rstrip().rstrip(",")
+        if candidate.endswith(":"):
+            candidate += "null"
+        candidate += "".join(reversed(pending))
+        candidates = [candidate]
+    else:
+        candidates = [text[s:e] for s, e in spans]
+    for candidate in candidates:
+        try:
+            return json.loads(_TRAILING_COMMA.sub(r"\1", candidate))
+        except ValueError:
+            continue
+    raise ValueError("JSON could not be repaired")
+
+
+def decode(text: str, schema: Optional[Type[BaseModel]] = None, repair: bool = True) -> Any:
+    """
+    Decodes a reply (validated against `schema` if given). Raises ValueError when it cannot be decoded.
+    """
+    try:
+        data, outcome = extract_json(text), "decoded"
+    except ValueError:
+        if not repair:
+            raise
+        data, outcome = repair_json(text), "repaired"
+    if schema is not None:
+        data = schema.model_validate(data).model_dump()
+    STATS[outcome] += 1
+    return data
+
+
+async def generate_json(contents, schema: Optional[Type[BaseModel]] = None, **config) -> Any:
+    """
+    Calls Gemini in JSON mode (with `schema` as structured output) and returns the decoded reply.
+    Raises LLMJSONError when the reply cannot be decoded after one repair pass.
+    """
+    config.setdefault("temperature", 0.0)
+    config.setdefault("seed", 42)
+    config["response_mime_type"] = "application/json"
+    if schema is not None:
+        config["response_schema"] = schema
+    content_config = gemini.content_config(**config)
+
+    response = await gemini.generate_content(contents=contents, config=content_config)
+    text = response.text or ""
+    with metrics.stage("json"):
+        try:
+            return decode(text, schema)
+        except ValueError:
+            if not REPAIR_ENABLED:
+                STATS["failures"] += 1
+                raise LLMJSONError(text)
+
+    # One repair call: re-run an empty reply as is, otherwise send back only the broken reply
+    STATS["repair_calls"] += 1
+    if text.strip():
+        contents = REPAIR_PROMPT.format(text=text[:REPAIR_MAX_CHARS])
+    response = await gemini.generate_content(contents=contents, config=content_config)
+    with metrics.stage("json"):
+        try:
+            return decode(response.text or "", schema)
+        except ValueError:
+            STATS["failures"] += 1
+            raise LLMJSONError(text)
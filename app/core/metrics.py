@@ -0,0 +1,300 @@
+"""
+Lightweight request instrumentation and Prometheus text exposition.
+
+Handlers wrap their steps in `metrics.stage("fetch")` / `"parse"` / `"prompt"` /
+`"llm"` / `"json"`. Each stage is observed into a histogram labelled with the
+router that served the request, and summed per request into a `Server-Timing`
+response header. Gemini token usage is counted per router. Cache, rate-limit
+and other subsystem counters are read from their existing stats only when
+`/metrics` is scraped, so the hot paths pay nothing extra for them.
+
+Recording a stage is a `perf_counter()` pair, a bisect and a few dict updates,
+cheap enough to leave on in production. `METRICS_TOKEN`, if set, is required
+as a bearer token to read `/metrics`.
+"""
+import bisect
+import os
+import time
+from contextlib import contextmanager
+from contextvars import Context, ContextVar
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from starlette.datastructures import MutableHeaders
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Upper bounds in seconds, from cache hits to slow Gemini calls
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Router label for work done outside a request (monitor checks, warm-up, ...)
+BACKGROUND = "background"
+
+_router: ContextVar[str] = ContextVar("metrics_router", default=BACKGROUND)
+# Stage durations of the current request, summed per stage, for Server-Timing
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("metrics_timings", default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value:g}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (last one is +Inf), sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                yield f"{self.name}_bucket{_labels(self.labelnames + ('le',), labels + (le,))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {total:.6f}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {count}"
+
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time to the last response byte, by router.",
+                            ("router", "method", "status"))
+STAGE_SECONDS = Histogram("stage_duration_seconds", "Time spent per processing stage, by router.",
+                          ("router", "stage"))
+GEMINI_TOKENS = Counter("gemini_tokens_total", "Gemini tokens used, by router and kind (prompt/output).",
+                        ("router", "kind"))
+
+
+def router_context() -> Context:
+    """
+    A fresh context that keeps only the current router label: work shared by several
+    requests runs in it, so it is attributed to the router without any one request's timings.
+    """
+    context = Context()
+    context.run(_router.set, _router.get())
+    return context
+
+
+def observe_stage(name: str, seconds: float) -> None:
+    STAGE_SECONDS.observe((_router.get(), name), seconds)
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Times the enclosed block as processing stage `name` of the current request.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - start)
+
+
+def add_gemini_usage(usage) -> None:
+    """
+    Counts tokens from a Gemini response's `usage_metadata` (missing fields are ignored).
+    """
+    if usage is None:
+        return
+    router = _router.get()
+    for kind, field in (("prompt", "prompt_token_count"), ("output", "candidates_token_count"),
+                        ("thinking", "thoughts_token_count")):
+        count = getattr(usage, field, None)
+        if count:
+            GEMINI_TOKENS.inc((router, kind), count)
+
+
+def server_timing(timings: Dict[str, float], total: float) -> str:
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that labels each request with its router, collects stage
+    timings into `Server-Timing` and observes the request duration.
+    """
+
+    def __init__(self, app, prefixes: Iterable[str] = ()):
+        self.app = app
+        # "/api/v1/web-extract" -> "web_extract"; other paths share the "other" label
+        self.prefixes = [(prefix, prefix.rstrip("/").rsplit("/", 1)[-1].replace("-", "_")) for prefix in prefixes]
+
+    def _router_for(self, path: str) -> str:
+        for prefix, name in self.prefixes:
+            if path.startswith(prefix):
+                return name
+        return "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        router = self._router_for(scope["path"])
+        timings: Dict[str, float] = {}
+        router_token = _router.set(router)
+        timings_token = _timings.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", server_timing(timings, time.perf_counter() - start))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            REQUEST_SECONDS.observe((router, scope["method"], str(status)), time.perf_counter() - start)
+            _timings.reset(timings_token)
+            _router.reset(router_token)
+
+
+def _gauge(name: str, help: str, kind: str, samples: Iterable[Tuple[str, float]]) -> List[str]:
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    lines.extend(f"{name}{labels} {value:g}" for labels, value in samples)
+    return lines
+
+
+def render() -> str:
+    """
+    Prometheus text exposition of every metric.
+    """
+    # Imported here: these modules record stages themselves, so importing them at load time would be circular
+    from app.core import context_select, crawler, deadlines, feeds, gemini, llm_json, micro_batch, monitor, parse_pool, rate_limit, webhooks
+    from app.core.cache import CACHES
+
+    lines: List[str] = []
+    for metric in (REQUEST_SECONDS, STAGE_SECONDS, GEMINI_TOKENS):
+        lines.extend(metric.render())
+
+    caches = [(f'{{cache="{name}"}}', cache.stats()) for name, cache in CACHES.items()]
+    for field, kind, help in (
+        ("hits", "counter", "Cache hits."),
+        ("misses", "counter", "Cache misses."),
+        ("disk_hits", "counter", "Memory misses served by the SQLite tier."),
+        ("coalesced", "counter", "Misses that joined work already in flight."),
+        ("evictions", "counter", "Entries evicted to stay within limits."),
+        ("expirations", "counter", "Entries dropped after their TTL."),
+        ("entries", "gauge", "Entries currently cached."),
+        ("bytes", "gauge", "Approximate bytes currently cached."),
+    ):
+        name = f"cache_{field}" + ("_total" if kind == "counter" else "")
+        lines.extend(_gauge(name, help, kind, ((labels, stats[field]) for labels, stats in caches)))
+
+    lines.extend(_gauge("rate_limit_checks_total", "Free-tier rate limit checks.", "counter",
+                        [("", rate_limit.STATS["checks"])]))
+    lines.extend(_gauge("rate_limit_rejections_total", "Requests rejected with 429 by the free-tier limit.", "counter",
+                        [("", rate_limit.STATS["rejected"])]))
+    lines.extend(_gauge("context_tokens_total", "Estimated page tokens before and after context selection.", "counter",
+                        [('{phase="before"}', context_select.STATS["tokens_before"]),
+                         ('{phase="after"}', context_select.STATS["tokens_after"])]))
+
+    limiters = [(f'{{scope="{limiter.name}"}}', limiter.to_dict())
+                for limiter in [gemini.GLOBAL_LIMITER, *gemini.MODEL_LIMITERS.values()]]
+    for field, kind, help in (
+        ("limit", "gauge", "Current adaptive concurrency limit for Gemini calls."),
+        ("in_flight", "gauge", "Gemini calls in progress."),
+        ("queue_depth", "gauge", "Gemini calls waiting for a slot."),
+        ("peak_queue", "gauge", "Most Gemini calls ever waiting for a slot at once."),
+        ("queued", "counter", "Gemini calls that had to wait for a slot."),
+        ("wait_seconds", "counter", "Total time Gemini calls spent waiting for a slot."),
+        ("timeouts", "counter", "Gemini calls whose deadline passed while waiting for a slot."),
+        ("decreases", "counter", "Limit decreases after 429/503 replies or high latency."),
+    ):
+        name = f"gemini_limiter_{field}" + ("_total" if kind == "counter" else "")
+        lines.extend(_gauge(name, help, kind, ((labels, stats[field]) for labels, stats in limiters)))
+    lines.extend(_gauge("gemini_gateway_events_total", "Gemini gateway calls, attempts, retries and failures.", "counter",
+                        [(f'{{event="{key}"}}', value) for key, value in gemini.STATS.items()]))
+
+    lines.extend(_gauge("feed_events_total", "RSS feed downloads, 304s, fresh cache hits, early stops and fallback parses.",
+                        "counter", [(f'{{event="{key}"}}', value) for key, value in feeds.STATS.items()]))
+
+    lines.extend(_gauge("crawl_events_total", "ai-scrape crawls, pages, scrape cache hits, duplicates, errors and host politeness waits.",
+                        "counter", [(f'{{event="{key}"}}', value) for key, value in crawler.STATS.items()]))
+
+    pool = parse_pool.PARSE_POOL.to_dict()
+    lines.extend(_gauge("parse_pool_workers", "Parse pool slots (0 when parsing runs on the event loop).", "gauge",
+                        [("", pool["workers"] if parse_pool.PARSE_POOL.enabled else 0)]))
+    lines.extend(_gauge("parse_pool_busy", "Parse jobs running.", "gauge", [("", pool["busy"])]))
+    lines.extend(_gauge("parse_pool_waiting", "Parse jobs waiting for a slot.", "gauge", [("", pool["waiting"])]))
+    lines.extend(_gauge("parse_pool_jobs_total", "Parse jobs, by how they ended up running or failing.", "counter",
+                        [(f'{{outcome="{key}"}}', pool[key])
+                         for key in ("inline", "offloaded", "rejected", "timeouts", "killed", "failed")]))
+    lines.extend(_gauge("parse_pool_seconds_total", "Time parse jobs spent queued and running.", "counter",
+                        [('{phase="queue"}', pool["queue_seconds"]), ('{phase="parse"}', pool["parse_seconds"])]))
+
+    lines.extend(_gauge("request_cancellations_total",
+                        "Requests cut short by their deadline or a disconnect, and what happened to shared work they left.",
+                        "counter", [(f'{{reason="{key}"}}', value) for key, value in deadlines.STATS.items()]))
+
+    lines.extend(_gauge("llm_json_replies_total", "Gemini JSON replies, by how they were decoded.", "counter",
+                        [('{outcome="decoded"}', llm_json.STATS["decoded"]),
+                         ('{outcome="repaired"}', llm_json.STATS["repaired"]),
+                         ('{outcome="failed"}', llm_json.STATS["failures"])]))
+    lines.extend(_gauge("llm_json_repair_calls_total", "Extra Gemini calls made to repair a reply.", "counter",
+                        [("", llm_json.STATS["repair_calls"])]))
+
+    batchers = [(f'{{batcher="{name}"}}', stats) for name, stats in micro_batch.batcher_stats().items()]
+    lines.extend(_gauge("micro_batch_batches_total", "Multi-item Gemini calls sent by the micro-batcher.", "counter",
+                        ((labels, stats["batches"]) for labels, stats in batchers)))
+    lines.extend(_gauge("micro_batch_fallbacks_total", "Batches retried item by item.", "counter",
+                        ((labels, stats["fallbacks"]) for labels, stats in batchers)))
+
+    dispatcher = webhooks.DISPATCHER
+    lines.extend(_gauge("webhook_deliveries_total", "Finished webhook deliveries, by outcome.", "counter",
+                        [('{outcome="delivered"}', dispatcher.stats["delivered"]),
+                         ('{outcome="failed"}', dispatcher.stats["failed"])]))
+    lines.extend(_gauge("webhook_retries_total", "Webhook delivery retries scheduled.", "counter",
+                        [("", dispatcher.stats["retries"])]))
+    lines.extend(_gauge("webhook_queue_depth", "Deliveries waiting in the queue.", "gauge",
+                        [("", dispatcher.queue_depth())]))
+
+    scheduler = monitor.SCHEDULER
+    lines.extend(_gauge("monitor_checks_total", "Monitor checks, by outcome.", "counter",
+                        [('{outcome="unchanged"}', scheduler.stats["unchanged"]),
+                         ('{outcome="evaluated"}', scheduler.stats["evaluations"]),
+                         ('{outcome="error"}', scheduler.stats["errors"])]))
+    return "\n".join(lines) + "\n"
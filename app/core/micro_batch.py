@@ -0,0 +1,155 @@
+"""
+Opt-in micro-batching of small, compatible LLM requests.
+
+Requests submitted under the same group key (e.g. the same `format_instruction`)
+within `MICRO_BATCH_WINDOW_MS` are collected and sent to Gemini as one
+multi-item prompt, up to `MICRO_BATCH_MAX_ITEMS` items or `MICRO_BATCH_MAX_CHARS`
+characters of input. The array result is split back to the waiting callers.
+If the batched call fails or its result cannot be split, every item falls back
+to its own single request, so batching never changes what a caller can get.
+
+Disabled unless `MICRO_BATCH_ENABLED=1`. Compare throughput and latency with
+`python benchmarks/bench_micro_batch.py`.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set
+
+from fastapi import HTTPException
+
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("MICRO_BATCH_ENABLED", "0") == "1"
+WINDOW_MS = float(os.getenv("MICRO_BATCH_WINDOW_MS", "20"))
+MAX_ITEMS = int(os.getenv("MICRO_BATCH_MAX_ITEMS", "8"))
+MAX_CHARS = int(os.getenv("MICRO_BATCH_MAX_CHARS", "20000"))
+
+# All batchers, by name, for the metrics endpoint
+BATCHERS: Dict[str, "MicroBatcher"] = {}
+
+
+class BatchSplitError(Exception):
+    """The batched result did not contain exactly one result per item."""
+
+
+class _Batch:
+    __slots__ = ("items", "futures", "chars", "timer")
+
+    def __init__(self):
+        self.items: List[str] = []
+        self.futures: List[asyncio.Future] = []
+        self.chars = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class MicroBatcher:
+    """
+    Collects items per group key and runs them through `run_many(group, items)`,
+    which must return one result per item in order. `run_one(group, item)` is
+    used for batches of one, when batching is disabled, and as the fallback.
+    """
+
+    def __init__(self, name: str,
+                 run_one: Callable[[Hashable, str], Awaitable[Any]],
+                 run_many: Callable[[Hashable, List[str]], Awaitable[List[Any]]],
+                 enabled: bool = ENABLED, window_ms: float = WINDOW_MS,
+                 max_items: int = MAX_ITEMS, max_chars: int = MAX_CHARS):
+        self.name = name
+        self.run_one = run_one
+        self.run_many = run_many
+        self.enabled = enabled
+        self.window_ms = window_ms
+        self.max_items = max_items
+        self.max_chars = max_chars
+        self._pending: Dict[Hashable, _Batch] = {}
+        # Batches being sent; the loop only keeps weak references to tasks
+        self._running: Set[asyncio.Task] = set()
+        self.submitted = 0
+        self.batches = 0
+        self.batched_items = 0
+        self.fallbacks = 0
+
+    async def submit(self, group: Hashable, item: str) -> Any:
+        self.submitted += 1
+        if not self.enabled or self.max_items <= 1 or len(item) >= self.max_chars:
+            return await self.run_one(group, item)
+
+        batch = self._pending.get(group)
+        # Start a new batch when this item would push the current one over the size cap
+        if batch is not None and batch.chars + len(item) > self.max_chars:
+            self._flush(group)
+            batch = None
+        if batch is None:
+            batch = self._pending[group] = _Batch()
+            batch.timer = asyncio.get_running_loop().call_later(self.window_ms / 1000, self._flush, group)
+
+        future = asyncio.get_running_loop().create_future()
+        batch.items.append(item)
+        batch.futures.append(future)
+        batch.chars += len(item)
+        if len(batch.items) >= self.max_items:
+            self._flush(group)
+        return await future
+
+    def _flush(self, group: Hashable) -> None:
+        batch = self._pending.pop(group, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        # Not in the flushing caller's context: its request deadline and stage timings must not
+        # cut short or be charged for a call made on behalf of the whole batch
+        task = asyncio.get_running_loop().create_task(self._run(group, batch), context=metrics.router_context())
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, group: Hashable, batch: _Batch) -> None:
+        if len(batch.items) == 1:
+            results = await asyncio.gather(self.run_one(group, batch.items[0]), return_exceptions=True)
+        else:
+            self.batches += 1
+            self.batched_items += len(batch.items)
+            try:
+                results = await self.run_many(group, batch.items)
+                if not isinstance(results, list) or len(results) != len(batch.items):
+                    raise BatchSplitError(f"expected {len(batch.items)} results")
+            except Exception as e:
+                if isinstance(e, HTTPException) and e.status_code in (503, 504):
+                    # Gemini is overloaded or out of time after the gateway's retries; splitting would only add calls
+                    results = [e] * len(batch.items)
+                else:
+                    logger.warning("%s: batch of %d failed (%s); retrying items one by one", self.name, len(batch.items), e)
+                    self.fallbacks += 1
+                    results = await asyncio.gather(*(self.run_one(group, item) for item in batch.items),
+                                                   return_exceptions=True)
+
+        for future, result in zip(batch.futures, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "window_ms": self.window_ms,
+            "max_items": self.max_items,
+            "submitted": self.submitted,
+            "batches": self.batches,
+            "batched_items": self.batched_items,
+            "fallbacks": self.fallbacks,
+        }
+
+
+def create_batcher(name: str, run_one, run_many) -> MicroBatcher:
+    batcher = MicroBatcher(name, run_one, run_many)
+    BATCHERS[name] = batcher
+    return batcher
+
+
+def batcher_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: batcher.stats() for name, batcher in BATCHERS.items()}
@@ -0,0 +1,270 @@
+"""
+Scheduler that watches webhook targets for condition changes.
+
+A webhook subscription registered with a `condition` is attached to a monitor
+for its (target_url, condition) pair, so any number of subscribers of the same
+check share one fetch and one Gemini call. Each monitor runs every
+`MONITOR_INTERVAL_SECONDS` (± `MONITOR_JITTER`), and requests to the same
+host are spaced at least `MONITOR_HOST_SPACING` seconds apart.
+
+On each run the page comes through the document cache (a 304 costs no
+download or parse), and the text blocks relevant to the condition are
+fingerprinted. Gemini is only asked again when that fingerprint changes.
+When `condition_met` flips, every subscriber is notified through the webhook
+delivery queue.
+
+The condition-check router provides the Gemini evaluation with
+`register_evaluator()`.
+"""
+import asyncio
+import hashlib
+import heapq
+import logging
+import os
+import random
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from app.core import webhooks
+from app.core.context_select import select_context
+from app.core.documents import DOCUMENT_CACHE, fetch_document
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("MONITOR_ENABLED", "1") == "1"
+INTERVAL_SECONDS = float(os.getenv("MONITOR_INTERVAL_SECONDS", "300"))
+MIN_INTERVAL_SECONDS = float(os.getenv("MONITOR_MIN_INTERVAL_SECONDS", "60"))
+# Fraction of the interval added or removed at random, so monitors do not run in lockstep
+JITTER = float(os.getenv("MONITOR_JITTER", "0.1"))
+HOST_SPACING = float(os.getenv("MONITOR_HOST_SPACING", "2"))
+CONCURRENCY = int(os.getenv("MONITOR_CONCURRENCY", "20"))
+
+MESSAGE_MET = "条件を満たしました"
+MESSAGE_UNMET = "条件を満たさなくなりました"
+
+_WHITESPACE = re.compile(r"\s+")
+
+# (url, condition, relevant page text) -> condition-check result with a boolean "condition_met"
+Evaluator = Callable[[str, str, str], Awaitable[Dict[str, Any]]]
+
+_evaluator: Optional[Evaluator] = None
+
+
+def register_evaluator(evaluator: Evaluator) -> None:
+    global _evaluator
+    _evaluator = evaluator
+
+
+def fingerprint(text: str) -> str:
+    """
+    Hash of the text with whitespace normalised, so re-wrapped but identical content matches.
+    """
+    return hashlib.sha256(_WHITESPACE.sub(" ", text).strip().encode("utf-8")).hexdigest()
+
+
+class Monitor:
+    __slots__ = ("url", "condition", "interval", "subscription_ids", "fingerprint", "condition_met",
+                 "last_result", "last_error", "last_checked_at", "last_changed_at", "checks", "evaluations")
+
+    def __init__(self, url: str, condition: str, interval: float):
+        self.url = url
+        self.condition = condition
+        self.interval = interval
+        self.subscription_ids: Set[str] = set()
+        self.fingerprint: Optional[str] = None
+        self.condition_met: Optional[bool] = None
+        self.last_result: Optional[Dict[str, Any]] = None
+        self.last_error: Optional[str] = None
+        self.last_checked_at: Optional[float] = None
+        self.last_changed_at: Optional[float] = None
+        self.checks = 0
+        self.evaluations = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "target_url": self.url,
+            "condition": self.condition,
+            "interval_seconds": self.interval,
+            "subscribers": len(self.subscription_ids),
+            "condition_met": self.condition_met,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+            "last_checked_at": self.last_checked_at,
+            "last_changed_at": self.last_changed_at,
+            "checks": self.checks,
+            "evaluations": self.evaluations,
+        }
+
+
+class MonitorScheduler:
+    def __init__(self):
+        self.monitors: Dict[Tuple[str, str], Monitor] = {}
+        self._by_subscription: Dict[str, Tuple[str, str]] = {}
+        # (due time on the loop clock, sequence, monitor); entries of removed monitors are skipped
+        self._heap: List[Tuple[float, int, Monitor]] = []
+        self._sequence = 0
+        self._host_next: Dict[str, float] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.stats = {"checks": 0, "unchanged": 0, "evaluations": 0, "notifications": 0, "errors": 0}
+
+    def watch(self, subscription_id: str, url: str, condition: str, interval: Optional[float] = None) -> Monitor:
+        key = (url, condition)
+        monitor = self.monitors.get(key)
+        if monitor is None:
+            monitor = Monitor(url, condition, max(interval or INTERVAL_SECONDS, MIN_INTERVAL_SECONDS))
+            self.monitors[key] = monitor
+            # First run soon, spread out so a burst of registrations does not hit hosts at once
+            self._schedule(monitor, random.uniform(0, min(monitor.interval * JITTER, 10)))
+        elif interval:
+            # A shared monitor runs as often as its most demanding subscriber asks
+            monitor.interval = min(monitor.interval, max(interval, MIN_INTERVAL_SECONDS))
+        monitor.subscription_ids.add(subscription_id)
+        self._by_subscription[subscription_id] = key
+        return monitor
+
+    def unwatch(self, subscription_id: str) -> None:
+        key = self._by_subscription.pop(subscription_id, None)
+        if key is None:
+            return
+        monitor = self.monitors[key]
+        monitor.subscription_ids.discard(subscription_id)
+        if not monitor.subscription_ids:
+            del self.monitors[key]
+
+    def get(self, subscription_id: str) -> Optional[Monitor]:
+        key = self._by_subscription.get(subscription_id)
+        return self.monitors.get(key) if key is not None else None
+
+    def _schedule(self, monitor: Monitor, delay: float) -> None:
+        self._sequence += 1
+        heapq.heappush(self._heap, (self._now() + delay, self._sequence, monitor))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _now(self) -> float:
+        try:
+            return asyncio.get_running_loop().time()
+        except RuntimeError:
+            return time.monotonic()
+
+    def _next_delay(self, monitor: Monitor) -> float:
+        return monitor.interval * (1 + random.uniform(-JITTER, JITTER))
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._semaphore = asyncio.Semaphore(CONCURRENCY)
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for task in list(self._running):
+            task.cancel()
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def _loop(self) -> None:
+        while True:
+            self._wakeup.clear()
+            now = self._now()
+            while self._heap and self._heap[0][0] <= now:
+                _, _, monitor = heapq.heappop(self._heap)
+                if self.monitors.get((monitor.url, monitor.condition)) is not monitor:
+                    continue
+                # Keep the host spacing unless the page can be served from the document cache
+                host = urlsplit(monitor.url).hostname or ""
+                cached = DOCUMENT_CACHE.peek(monitor.url)
+                if cached is None or not cached.is_fresh():
+                    if self._host_next.get(host, 0) > now:
+                        self._schedule(monitor, self._host_next[host] - now)
+                        continue
+                    self._host_next[host] = now + HOST_SPACING
+                task = asyncio.create_task(self._run(monitor))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+
+            if len(self._host_next) > 10000:
+                self._host_next = {host: due for host, due in self._host_next.items() if due > now}
+
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self, monitor: Monitor) -> None:
+        try:
+            async with self._semaphore:
+                await self.check(monitor)
+        finally:
+            if self.monitors.get((monitor.url, monitor.condition)) is monitor:
+                self._schedule(monitor, self._next_delay(monitor))
+
+    async def check(self, monitor: Monitor) -> None:
+        """
+        Fetches the target, and asks Gemini again only if the relevant text changed.
+        """
+        monitor.checks += 1
+        monitor.last_checked_at = time.time()
+        self.stats["checks"] += 1
+        try:
+            document = await fetch_document(monitor.url)
+            relevant = select_context(document.text, monitor.condition, record=False)
+            current = fingerprint(relevant)
+            if current == monitor.fingerprint:
+                self.stats["unchanged"] += 1
+                return
+
+            if _evaluator is None:
+                raise RuntimeError("no condition evaluator registered")
+            result = await _evaluator(monitor.url, monitor.condition, relevant)
+            monitor.evaluations += 1
+            self.stats["evaluations"] += 1
+            monitor.fingerprint = current
+            monitor.last_result = result
+            monitor.last_error = None
+        except Exception as e:
+            # Leave the fingerprint alone so the next run tries again
+            monitor.last_error = str(getattr(e, "detail", None) or e) or type(e).__name__
+            self.stats["errors"] += 1
+            logger.warning("monitor check failed for %s: %s", monitor.url, monitor.last_error)
+            return
+
+        met = bool(result.get("condition_met")) if isinstance(result, dict) else False
+        previous = monitor.condition_met
+        monitor.condition_met = met
+        # The first result only notifies when the condition is already met
+        if met != previous and (previous is not None or met):
+            monitor.last_changed_at = time.time()
+            self._notify(monitor, met, result)
+
+    def _notify(self, monitor: Monitor, met: bool, result: Dict[str, Any]) -> None:
+        subscriptions = [
+            subscription for subscription in (webhooks.SUBSCRIPTIONS.get(i) for i in monitor.subscription_ids)
+            if subscription is not None
+        ]
+        data = {"condition": monitor.condition, "condition_met": met, "result": result}
+        try:
+            webhooks.notify(subscriptions, MESSAGE_MET if met else MESSAGE_UNMET, data)
+        except webhooks.QueueFullError:
+            logger.warning("webhook queue full; dropped change notification for %s", monitor.url)
+            return
+        self.stats["notifications"] += len(subscriptions)
+
+
+SCHEDULER = MonitorScheduler()
+
+
+async def startup() -> None:
+    if ENABLED:
+        SCHEDULER.start()
+
+
+async def shutdown() -> None:
+    await SCHEDULER.stop()
@@ -0,0 +1,228 @@
+"""
+Worker pool for CPU-bound parsing (HTML cleanup, trafilatura extraction).
+
+Parsing a large page is pure CPU work; run on the event loop it delays every
+other request, cache hits included. `PARSE_POOL` moves it off the loop:
+
+- `process` (default): `PARSE_POOL_WORKERS` single-process slots started
+  with `spawn`. A job that runs past `PARSE_TIMEOUT_SECONDS` has its process
+  killed and the slot restarted, so a runaway document cannot hold a worker.
+- `thread`: a thread pool. Only keeps the loop responsive (the GIL is shared),
+  and a timed-out job is abandoned rather than killed.
+- `off`: parse on the event loop, as before.
+
+Documents smaller than `PARSE_POOL_MIN_BYTES` are parsed inline, where that is
+cheaper than the hand-off. At most `PARSE_POOL_MAX_QUEUE` jobs wait for a
+slot; beyond that requests get a 503 instead of queueing without bound. The
+wait is recorded as the "parse_queue" stage and the job itself as "parse".
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, List, Optional
+
+from fastapi import HTTPException
+
+from app.core import metrics
+
+logger = logging.getLogger(__name__)
+
+KIND = os.getenv("PARSE_POOL", "process")
+WORKERS = int(os.getenv("PARSE_POOL_WORKERS", "2"))
+MAX_QUEUE = int(os.getenv("PARSE_POOL_MAX_QUEUE", "64"))
+MIN_BYTES = int(os.getenv("PARSE_POOL_MIN_BYTES", str(64 * 1024)))
+TIMEOUT_SECONDS = float(os.getenv("PARSE_TIMEOUT_SECONDS", "10"))
+
+
+def _warm() -> None:
+    # Runs in each worker process so the first real job does not pay for the imports
+    import lxml.etree  # noqa: F401
+    try:
+        import trafilatura  # noqa: F401
+    except ImportError:
+        pass
+
+
+class _Slot:
+    """
+    One unit of pool capacity. In process mode it owns a single-process executor that can be killed.
+    """
+
+    def __init__(self, executor: Executor, own: bool):
+        self.executor = executor
+        self.own = own
+
+    def kill(self) -> bool:
+        """
+        Kills the slot's process and replaces its executor. Returns False when it cannot (threads).
+        """
+        if not self.own:
+            return False
+        # ProcessPoolExecutor has no per-job cancel; killing the worker is the only way to stop it
+        for process in list(getattr(self.executor, "_processes", {}).values()):
+            process.kill()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = _process_executor()
+        return True
+
+
+def _process_executor() -> ProcessPoolExecutor:
+    # spawn: forking a process that runs an event loop and helper threads is not safe
+    return ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+
+
+class ParsePool:
+    def __init__(self, kind: str = KIND, workers: int = WORKERS, max_queue: int = MAX_QUEUE,
+                 min_bytes: int = MIN_BYTES, timeout: float = TIMEOUT_SECONDS):
+        self.kind = kind if kind in ("process", "thread") else "off"
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.min_bytes = min_bytes
+        self.timeout = timeout
+        self._slots: List[_Slot] = []
+        self._idle: Optional[asyncio.Queue] = None
+        self._threads: Optional[ThreadPoolExecutor] = None
+        self.waiting = 0
+        self.busy = 0
+        self.stats = {"inline": 0, "offloaded": 0, "rejected": 0, "timeouts": 0, "killed": 0, "failed": 0,
+                      "queue_seconds": 0.0, "parse_seconds": 0.0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.kind != "off"
+
+    def _start(self) -> asyncio.Queue:
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            if self.kind == "thread":
+                self._threads = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="parse")
+                self._slots = [_Slot(self._threads, own=False) for _ in range(self.workers)]
+            else:
+                self._slots = [_Slot(_process_executor(), own=True) for _ in range(self.workers)]
+            for slot in self._slots:
+                self._idle.put_nowait(slot)
+        return self._idle
+
+    async def run(self, func: Callable[..., Any], *args, size: Optional[int] = None) -> Any:
+        """
+        Runs `func(*args)` in the pool (inline when disabled or `size` is below PARSE_POOL_MIN_BYTES).
+        `func` and its arguments must be picklable in process mode.
+        Raises a 503 when the queue is full and a 422 when the job times out.
+        """
+        if not self.enabled or (size is not None and size < self.min_bytes):
+            self.stats["inline"] += 1
+            with metrics.stage("parse"):
+                return func(*args)
+
+        idle = self._start()
+        if self.waiting >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise HTTPException(status_code=503, detail="サーバーが混雑しています。しばらくしてから再度お試しください。",
+                                headers={"Retry-After": "1"})
+
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            slot = await idle.get()
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter() - queued
+        self.stats["queue_seconds"] += waited
+        metrics.observe_stage("parse_queue", waited)
+
+        self.stats["offloaded"] += 1
+        self.busy += 1
+        started = time.perf_counter()
+        future = asyncio.get_running_loop().run_in_executor(slot.executor, func, *args)
+        released = False
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            logger.warning("parse job %s timed out after %g s", getattr(func, "__name__", func), self.timeout)
+            released = self._kill(slot, future)
+            raise HTTPException(status_code=422, detail="ページの解析が制限時間内に終わりませんでした。")
+        except asyncio.CancelledError:
+            # Nobody is waiting for the result any more
+            released = self._kill(slot, future)
+            raise
+        except BrokenProcessPool:
+            # The worker died (e.g. out of memory); start a fresh one for the next job
+            self.stats["failed"] += 1
+            slot.kill()
+            raise
+        except Exception:
+            self.stats["failed"] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stats["parse_seconds"] += elapsed
+            metrics.observe_stage("parse", elapsed)
+            if released or future.done():
+                self._release(slot)
+            else:
+                # The job keeps its slot until it actually finishes (cancelled caller or abandoned thread)
+                future.add_done_callback(lambda _: self._release(slot))
+
+    def _kill(self, slot: _Slot, future: asyncio.Future) -> bool:
+        """
+        Stops a job that is still running, if the slot allows it. Returns True when the slot is free again.
+        """
+        if future.done() or not slot.kill():
+            return False
+        self.stats["killed"] += 1
+        # The killed job fails with BrokenProcessPool, which nobody awaits
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return True
+
+    def _release(self, slot: _Slot) -> None:
+        self.busy -= 1
+        if self._idle is not None:
+            self._idle.put_nowait(slot)
+
+    async def warm(self) -> None:
+        """
+        Starts the worker processes and imports the parsers in them.
+        """
+        if self.kind != "process":
+            return
+        self._start()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(slot.executor, _warm) for slot in self._slots),
+                             return_exceptions=True)
+
+    def shutdown(self) -> None:
+        for slot in self._slots:
+            if slot.own:
+                slot.executor.shutdown(wait=False, cancel_futures=True)
+        if self._threads is not None:
+            self._threads.shutdown(wait=False, cancel_futures=True)
+        self._slots = []
+        self._idle = None
+        self._threads = None
+
+    def to_dict(self) -> dict:
+        return dict(self.stats, kind=self.kind, workers=self.workers, busy=self.busy, waiting=self.waiting)
+
+
+PARSE_POOL = ParsePool()
+
+_warm_task: Optional[asyncio.Task] = None
+
+
+async def startup() -> None:
+    global _warm_task
+    # Worker processes start in the background, like the import warm-up
+    _warm_task = asyncio.create_task(PARSE_POOL.warm())
+
+
+async def shutdown() -> None:
+    global _warm_task
+    if _warm_task is not None:
+        _warm_task.cancel()
+        _warm_task = None
+    PARSE_POOL.shutdown()
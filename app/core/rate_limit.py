@@ -0,0 +1,182 @@
+"""
+Token-bucket rate limiting for the free tier.
+
+Each client IP has a bucket of `RATE_LIMIT_FREE_CALLS` tokens that refills
+continuously over `RATE_LIMIT_WINDOW_SECONDS`; every call takes one token.
+Buckets live in the shared SQLite file (`app/core/disk_cache.py`), so every
+worker on the host sees the same counts, and each check is one primary-key
+read and write inside a short write transaction. A bucket that has been idle
+for a whole window is full again, so those rows are pruned periodically.
+
+When the disk tier is disabled or unavailable, buckets are kept per process in
+a bounded LRU cache instead.
+"""
+import asyncio
+import logging
+import math
+import os
+import sqlite3
+import time
+from typing import NamedTuple, Optional, Tuple
+
+from app.core import disk_cache
+from app.core.cache import create_cache
+
+logger = logging.getLogger(__name__)
+
+FREE_CALLS = int(os.getenv("RATE_LIMIT_FREE_CALLS", "5"))
+WINDOW_SECONDS = float(os.getenv("RATE_LIMIT_WINDOW_SECONDS", str(24 * 60 * 60)))
+PRUNE_INTERVAL = float(os.getenv("RATE_LIMIT_PRUNE_INTERVAL", "600"))
+
+# Tokens regained per second
+_REFILL_RATE = FREE_CALLS / WINDOW_SECONDS
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rate_limit (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rate_limit_updated_at ON rate_limit (updated_at);
+"""
+
+# Per-process fallback: { key: (tokens, updated_at) }, forgotten once idle for a whole window
+_MEMORY_BUCKETS = create_cache("rate_limit", max_entries=100000, max_bytes=16 * 1024 * 1024, ttl=WINDOW_SECONDS)
+
+# Running totals reported by the metrics endpoint
+STATS = {
+    "checks": 0,
+    "rejected": 0,
+}
+
+_shared = False
+_prune_task: Optional[asyncio.Task] = None
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    # Seconds until the bucket is full again
+    reset_after: int
+    # Seconds until the next call is allowed (0 when allowed)
+    retry_after: int
+
+    def headers(self) -> dict:
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(self.reset_after),
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.retry_after)
+        return headers
+
+
+def _take(state: Optional[Tuple[float, float]], now: float) -> Tuple[bool, float]:
+    """
+    Refills a bucket up to `now` and takes one token if available. Returns (allowed, tokens left).
+    """
+    if state is None:
+        tokens = float(FREE_CALLS)
+    else:
+        tokens, updated_at = state
+        tokens = min(float(FREE_CALLS), tokens + max(0.0, now - updated_at) * _REFILL_RATE)
+    if tokens >= 1:
+        return True, tokens - 1
+    return False, tokens
+
+
+def _hit_shared(key: str, now: float) -> Tuple[bool, float]:
+    conn = disk_cache.connect()
+    # IMMEDIATE takes the write lock up front so concurrent workers cannot both spend the last token
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT tokens, updated_at FROM rate_limit WHERE key = ?", (key,)).fetchone()
+        allowed, tokens = _take(row, now)
+        conn.execute(
+            "INSERT OR REPLACE INTO rate_limit (key, tokens, updated_at) VALUES (?, ?, ?)",
+            (key, tokens, now),
+        )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return allowed, tokens
+
+
+def _hit_memory(key: str, now: float) -> Tuple[bool, float]:
+    allowed, tokens = _take(_MEMORY_BUCKETS.get(key), now)
+    _MEMORY_BUCKETS.set(key, (tokens, now))
+    return allowed, tokens
+
+
+async def hit(key: str) -> RateLimitResult:
+    """
+    Takes one call from `key`'s bucket and reports whether it is allowed.
+    """
+    now = time.time()
+    if _shared:
+        try:
+            allowed, tokens = await asyncio.to_thread(_hit_shared, key, now)
+        except sqlite3.Error:
+            logger.exception("shared rate limit check failed; using this worker's buckets")
+            allowed, tokens = _hit_memory(key, now)
+    else:
+        allowed, tokens = _hit_memory(key, now)
+
+    STATS["checks"] += 1
+    if not allowed:
+        STATS["rejected"] += 1
+    return RateLimitResult(
+        allowed=allowed,
+        limit=FREE_CALLS,
+        remaining=int(tokens),
+        reset_after=math.ceil((FREE_CALLS - tokens) / _REFILL_RATE),
+        retry_after=0 if allowed else math.ceil((1 - tokens) / _REFILL_RATE),
+    )
+
+
+def prune() -> int:
+    """
+    Deletes buckets idle for a whole window (they would be full anyway). Returns the number removed.
+    """
+    return disk_cache.connect().execute(
+        "DELETE FROM rate_limit WHERE updated_at < ?", (time.time() - WINDOW_SECONDS,)
+    ).rowcount
+
+
+def _create_schema() -> None:
+    disk_cache.connect().executescript(_SCHEMA)
+    prune()
+
+
+async def _prune_loop() -> None:
+    while True:
+        await asyncio.sleep(PRUNE_INTERVAL)
+        try:
+            removed = await asyncio.to_thread(prune)
+            logger.info("rate limiter pruned %d idle buckets", removed)
+        except sqlite3.Error:
+            logger.exception("rate limiter pruning failed")
+
+
+async def startup() -> None:
+    global _shared, _prune_task
+    if not disk_cache.ENABLED:
+        return
+    try:
+        await asyncio.to_thread(_create_schema)
+    except sqlite3.Error:
+        logger.exception("shared rate limiter unavailable; using per-worker buckets")
+        return
+    _shared = True
+    _prune_task = asyncio.create_task(_prune_loop())
+
+
+async def shutdown() -> None:
+    global _shared, _prune_task
+    _shared = False
+    if _prune_task is not None:
+        _prune_task.cancel()
+        _prune_task = None
@@ -0,0 +1,62 @@
+"""
+Background warm-up of heavy libraries.
+
+google-genai, trafilatura and BeautifulSoup are imported where they are first
+used instead of at module load, so a cold worker starts accepting connections
+and answers `/` and cache hits without waiting for them. Right after startup
+this module imports them (and creates the Gemini client) in a background
+thread, so they are usually loaded before the first request that needs them.
+
+Disable with `IMPORT_WARMUP_ENABLED=0`. `python benchmarks/bench_import_time.py`
+reports import time and checks it against a budget.
+"""
+import asyncio
+import importlib
+import logging
+import os
+import time
+from typing import Optional
+
+from app.core import gemini
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("IMPORT_WARMUP_ENABLED", "1") == "1"
+
+# Imported lazily by the routers; loaded here in the order they are most likely needed
+WARM_MODULES = ("google.genai", "trafilatura", "bs4")
+
+_task: Optional[asyncio.Task] = None
+
+
+def _warm() -> None:
+    for name in WARM_MODULES:
+        start = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            logger.warning("warm-up could not import %s", name)
+            continue
+        logger.info("warm-up imported %s in %.0f ms", name, (time.perf_counter() - start) * 1000)
+    gemini.warm()
+
+
+async def _run() -> None:
+    try:
+        await asyncio.to_thread(_warm)
+    except Exception:
+        logger.exception("warm-up failed; modules will be imported on first use")
+
+
+async def startup() -> None:
+    global _task
+    if ENABLED:
+        _task = asyncio.create_task(_run())
+
+
+async def shutdown() -> None:
+    global _task
+    if _task is not None:
+        # The import thread cannot be interrupted; this only drops the waiting task
+        _task.cancel()
+        _task = None
@@ -0,0 +1,365 @@
+"""
+Webhook subscriptions and asynchronous delivery.
+
+Subscriptions are indexed by `event_type` and by `target_url`, so finding the
+subscribers of an event is a set lookup rather than a scan. Deliveries are put
+on an in-process queue and sent by a pool of worker tasks through a dedicated
+pooled client, so callback hosts get reused keep-alive connections and slow
+callbacks cannot exhaust the pool used for page fetches.
+
+Failed deliveries (connection errors, timeouts, 408/429/5xx) are retried with
+exponential backoff and full jitter, honouring a numeric `Retry-After`, up to
+`WEBHOOK_MAX_ATTEMPTS` attempts. A fan-out sends one event to every matching
+subscriber and keeps a per-delivery status record for `WEBHOOK_FANOUT_TTL`.
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Set
+
+import httpx
+
+from app.core.cache import create_cache
+from app.core.http_client import FETCH_ERRORS, create_client
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.getenv("WEBHOOK_WORKERS", "100"))
+QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "100000"))
+MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "200"))
+TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", "5"))
+MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
+BACKOFF_BASE = float(os.getenv("WEBHOOK_BACKOFF_BASE", "1"))
+BACKOFF_MAX = float(os.getenv("WEBHOOK_BACKOFF_MAX", "60"))
+# Seconds to let queued deliveries finish when the worker shuts down
+DRAIN_SECONDS = float(os.getenv("WEBHOOK_DRAIN_SECONDS", "5"))
+
+DEFAULT_MESSAGE = "変化を検知しました"
+
+# Status codes worth another attempt; anything else outside 2xx fails immediately
+_RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class QueueFullError(Exception):
+    """The delivery queue cannot take the requested number of deliveries."""
+
+
+class Subscription:
+    __slots__ = ("id", "target_url", "callback_url", "event_type")
+
+    def __init__(self, id: str, target_url: str, callback_url: str, event_type: str):
+        self.id = id
+        self.target_url = target_url
+        self.callback_url = callback_url
+        self.event_type = event_type
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"target_url": self.target_url, "callback_url": self.callback_url, "event_type": self.event_type}
+
+
+class SubscriptionStore:
+    """
+    Subscriptions by id, with secondary indexes on event_type and target_url.
+    """
+
+    def __init__(self):
+        self.subscriptions: Dict[str, Subscription] = {}
+        self._by_event: Dict[str, Set[str]] = {}
+        self._by_target: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.subscriptions)
+
+    def __contains__(self, subscription_id: str) -> bool:
+        return subscription_id in self.subscriptions
+
+    def get(self, subscription_id: str) -> Optional[Subscription]:
+        return self.subscriptions.get(subscription_id)
+
+    def add(self, target_url: str, callback_url: str, event_type: str) -> Subscription:
+        subscription = Subscription(str(uuid.uuid4()), target_url, callback_url, event_type)
+        self.subscriptions[subscription.id] = subscription
+        self._by_event.setdefault(event_type, set()).add(subscription.id)
+        self._by_target.setdefault(target_url, set()).add(subscription.id)
+        return subscription
+
+    def remove(self, subscription_id: str) -> bool:
+        subscription = self.subscriptions.pop(subscription_id, None)
+        if subscription is None:
+            return False
+        for index, value in ((self._by_event, subscription.event_type), (self._by_target, subscription.target_url)):
+            ids = index[value]
+            ids.discard(subscription_id)
+            if not ids:
+                del index[value]
+        return True
+
+    def find(self, event_type: Optional[str] = None, target_url: Optional[str] = None) -> List[Subscription]:
+        """
+        Subscriptions matching every given filter (all of them when neither is given).
+        """
+        if event_type is None and target_url is None:
+            return list(self.subscriptions.values())
+        candidates = [
+            index.get(value, set())
+            for index, value in ((self._by_event, event_type), (self._by_target, target_url))
+            if value is not None
+        ]
+        ids = set.intersection(*candidates) if len(candidates) > 1 else candidates[0]
+        return [self.subscriptions[subscription_id] for subscription_id in ids]
+
+
+class Delivery:
+    __slots__ = ("id", "subscription_id", "callback_url", "payload", "status", "attempts", "max_attempts",
+                 "status_code", "error", "response_text", "created_at", "finished_at", "_waiter")
+
+    def __init__(self, subscription: Subscription, payload: Dict[str, Any], waiter: Optional[asyncio.Future] = None,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.id = str(uuid.uuid4())
+        self.subscription_id = subscription.id
+        self.callback_url = subscription.callback_url
+        self.payload = payload
+        self.status = "pending"
+        self.attempts = 0
+        self.max_attempts = max_attempts
+        self.status_code: Optional[int] = None
+        self.error: Optional[str] = None
+        # Only kept for deliveries someone is waiting on (simulate)
+        self.response_text: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._waiter = waiter
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "delivery_id": self.id,
+            "subscription_id": self.subscription_id,
+            "callback_url": self.callback_url,
+            "status": self.status,
+            "attempts": self.attempts,
+            "status_code": self.status_code,
+            "error": self.error,
+        }
+
+
+class FanOut:
+    __slots__ = ("id", "event_type", "target_url", "deliveries", "created_at")
+
+    def __init__(self, event_type: Optional[str], target_url: Optional[str], deliveries: List[Delivery]):
+        self.id = str(uuid.uuid4())
+        self.event_type = event_type
+        self.target_url = target_url
+        self.deliveries = deliveries
+        self.created_at = time.time()
+
+    @property
+    def cache_size(self) -> int:
+        # Rough bytes held per delivery record (payloads are shared)
+        return 256 * len(self.deliveries) + 256
+
+    def counts(self) -> Dict[str, int]:
+        counts = {"pending": 0, "retrying": 0, "delivered": 0, "failed": 0}
+        for delivery in self.deliveries:
+            counts[delivery.status] += 1
+        return counts
+
+    def to_dict(self, include_deliveries: bool = True) -> Dict[str, Any]:
+        result = {
+            "fanout_id": self.id,
+            "event_type": self.event_type,
+            "target_url": self.target_url,
+            "subscribers": len(self.deliveries),
+            "counts": self.counts(),
+        }
+        if include_deliveries:
+            result["deliveries"] = [delivery.to_dict() for delivery in self.deliveries]
+        return result
+
+
+def build_payload(subscription: Subscription, message: str = DEFAULT_MESSAGE, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    payload = {
+        "event": subscription.event_type,
+        "message": message,
+        "target": subscription.target_url,
+    }
+    if data is not None:
+        payload["data"] = data
+    return payload
+
+
+def _backoff(attempt: int, retry_after: Optional[str]) -> float:
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), BACKOFF_MAX)
+    # Full jitter: spreads retries from many subscribers of one failing host
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+class Dispatcher:
+    """
+    Queue plus worker pool that sends deliveries and schedules their retries.
+    """
+
+    def __init__(self, workers: int = WORKERS, queue_size: int = QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # Backoff timers of deliveries waiting to be retried, by delivery id
+        self._retry_handles: Dict[str, asyncio.TimerHandle] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self.stats = {"enqueued": 0, "attempts": 0, "retries": 0, "delivered": 0, "failed": 0}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._client = create_client(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS, timeout=TIMEOUT)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain_seconds: float = DRAIN_SECONDS) -> None:
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), drain_seconds)
+        except asyncio.TimeoutError:
+            logger.warning("webhook queue not drained; dropping %d deliveries", self._queue.qsize())
+        for handle in self._retry_handles.values():
+            handle.cancel()
+        self._retry_handles.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._client.aclose()
+        self._client = None
+
+    def enqueue(self, deliveries: List[Delivery]) -> None:
+        """
+        Queues all deliveries or none of them; raises QueueFullError when there is not enough room.
+        """
+        self.start()
+        if self._queue.qsize() + len(deliveries) > self.queue_size:
+            raise QueueFullError(f"{len(deliveries)} deliveries do not fit in the queue")
+        for delivery in deliveries:
+            self._queue.put_nowait(delivery)
+        self.stats["enqueued"] += len(deliveries)
+
+    async def deliver(self, subscription: Subscription, payload: Dict[str, Any],
+                      max_attempts: int = MAX_ATTEMPTS) -> Delivery:
+        """
+        Queues one delivery and waits until it has been delivered or has failed `max_attempts` times.
+        """
+        waiter = asyncio.get_running_loop().create_future()
+        delivery = Delivery(subscription, payload, waiter, max_attempts)
+        self.enqueue([delivery])
+        await asyncio.shield(waiter)
+        return delivery
+
+    async def _worker(self) -> None:
+        while True:
+            delivery = await self._queue.get()
+            try:
+                await self._attempt(delivery)
+            except Exception:
+                logger.exception("webhook delivery %s crashed", delivery.id)
+                self._finish(delivery, "failed")
+            finally:
+                self._queue.task_done()
+
+    async def _attempt(self, delivery: Delivery) -> None:
+        delivery.attempts += 1
+        self.stats["attempts"] += 1
+        retry_after = None
+        try:
+            response = await self._client.post(delivery.callback_url, json=delivery.payload)
+        except FETCH_ERRORS as e:
+            delivery.error = str(e) or type(e).__name__
+            retryable = not isinstance(e, httpx.InvalidURL) and not isinstance(e, httpx.UnsupportedProtocol)
+        else:
+            delivery.status_code = response.status_code
+            if delivery._waiter is not None:
+                delivery.response_text = response.text
+            if response.is_success:
+                delivery.error = None
+                self._finish(delivery, "delivered")
+                return
+            delivery.error = f"HTTP {response.status_code}"
+            retryable = response.status_code in _RETRY_STATUS
+            retry_after = response.headers.get("Retry-After")
+
+        if not retryable or delivery.attempts >= delivery.max_attempts:
+            self._finish(delivery, "failed")
+            return
+
+        delivery.status = "retrying"
+        self.stats["retries"] += 1
+        self._retry_handles[delivery.id] = asyncio.get_running_loop().call_later(
+            _backoff(delivery.attempts, retry_after), self._retry, delivery
+        )
+
+    def _retry(self, delivery: Delivery) -> None:
+        self._retry_handles.pop(delivery.id, None)
+        try:
+            self._queue.put_nowait(delivery)
+        except asyncio.QueueFull:
+            delivery.error = "delivery queue full"
+            self._finish(delivery, "failed")
+
+    def _finish(self, delivery: Delivery, status: str) -> None:
+        delivery.status = status
+        delivery.finished_at = time.time()
+        self.stats[status] += 1
+        if delivery._waiter is not None and not delivery._waiter.done():
+            delivery._waiter.set_result(delivery)
+
+
+SUBSCRIPTIONS = SubscriptionStore()
+DISPATCHER = Dispatcher()
+
+# Fan-out status records, by fanout_id
+FANOUTS = create_cache(
+    "webhook_fanouts",
+    max_entries=1000,
+    max_bytes=64 * 1024 * 1024,
+    ttl=float(os.getenv("WEBHOOK_FANOUT_TTL", str(60 * 60))),
+)
+
+
+def notify(subscriptions: List[Subscription], message: str = DEFAULT_MESSAGE, data: Optional[Dict[str, Any]] = None,
+           event_type: Optional[str] = None, target_url: Optional[str] = None) -> FanOut:
+    """
+    Queues one delivery per subscription and records them as a fan-out.
+    Raises QueueFullError without queueing anything when the queue cannot take them all.
+    """
+    deliveries = [Delivery(subscription, build_payload(subscription, message, data)) for subscription in subscriptions]
+    DISPATCHER.enqueue(deliveries)
+    fanout = FanOut(event_type, target_url, deliveries)
+    FANOUTS.set(fanout.id, fanout)
+    return fanout
+
+
+def fan_out(event_type: str, target_url: Optional[str] = None, message: str = DEFAULT_MESSAGE,
+            data: Optional[Dict[str, Any]] = None) -> FanOut:
+    """
+    Queues one delivery per subscriber of `event_type` (optionally only for `target_url`).
+    """
+    subscribers = SUBSCRIPTIONS.find(event_type=event_type, target_url=target_url)
+    return notify(subscribers, message, data, event_type=event_type, target_url=target_url)
+
+
+async def startup() -> None:
+    DISPATCHER.start()
+
+
+async def shutdown() -> None:
+    await DISPATCHER.stop()
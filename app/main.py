@@ -1,18 +1,52 @@
 from fastapi import FastAPI, Request, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from app.routers import ai_scrape, format_json, esg_score, niche_data, webhook, web_extract, text_to_json, condition_check
+from app.core import deadlines, disk_cache, gemini, http_client, metrics, monitor, parse_pool, rate_limit, warmup, webhooks
+from app.core.cache import warm_persistent_caches
+from contextlib import asynccontextmanager
 import os
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open shared outbound resources once per worker and release them on shutdown
+    await http_client.startup()
+    await disk_cache.startup()
+    await rate_limit.startup()
+    await warm_persistent_caches()
+    await webhooks.startup()
+    await monitor.startup()
+    await parse_pool.startup()
+    # Heavy libraries and the Gemini client load in the background while requests are served
+    await warmup.startup()
+    try:
+        yield
+    finally:
+        await warmup.shutdown()
+        await parse_pool.shutdown()
+        await monitor.shutdown()
+        await webhooks.shutdown()
+        await rate_limit.shutdown()
+        await disk_cache.shutdown()
+        await gemini.shutdown()
+        await http_client.shutdown()
+
 app = FastAPI(
     title="Business APIs",
     description="Backend foundation for scalable business APIs",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
-# In-memory storage for IP-based rate limiting
-# { "client_ip": call_count }
-DEMO_USAGE = {}
-MAX_FREE_CALLS = 5
+# Free calls per client IP; the bucket refills over RATE_LIMIT_WINDOW_SECONDS (see app/core/rate_limit.py)
+MAX_FREE_CALLS = rate_limit.FREE_CALLS
+
+@app.middleware("http")
+async def add_rate_limit_headers(request: Request, call_next):
+    response = await call_next(request)
+    result = getattr(request.state, "rate_limit", None)
+    if result is not None:
+        response.headers.update(result.headers())
+    return response
 
 async def check_rate_limit(request: Request):
     api_key = request.headers.get("X-RapidAPI-Key")
@@ -26,15 +60,16 @@ async def check_rate_limit(request: Request):
         else:
             client_ip = request.client.host if request.client else "unknown-ip"
             
-        usage = DEMO_USAGE.get(client_ip, 0)
+        result = await rate_limit.hit(client_ip)
         
-        if usage >= MAX_FREE_CALLS:
+        if not result.allowed:
             raise HTTPException(
                 status_code=429, 
-                detail="無料枠（5回）を使い切りました。継続するにはPremiumプランをご検討ください。"
+                detail=f"無料枠（{MAX_FREE_CALLS}回）を使い切りました。継続するにはPremiumプランをご検討ください。",
+                headers=result.headers(),
             )
         
-        DEMO_USAGE[client_ip] = usage + 1
+        request.state.rate_limit = result
         return client_ip
     return "premium-bypass"
 
@@ -48,6 +83,22 @@ app.include_router(ai_scrape.router, dependencies=[Depends(check_rate_limit)])
 app.include_router(format_json.router, dependencies=[Depends(check_rate_limit)])
 app.include_router(webhook.router) # Webhook sender is free
 
+API_PREFIXES = [
+    router.prefix for router in (esg_score.router, niche_data.router, web_extract.router, text_to_json.router,
+                                 condition_check.router, ai_scrape.router, format_json.router, webhook.router)
+]
+
+# Request deadline (REQUEST_TIMEOUT_SECONDS or X-Request-Timeout); cancels work on expiry or client disconnect
+app.add_middleware(deadlines.DeadlineMiddleware, prefixes=API_PREFIXES)
+# Per-router request/stage timings; stage timings are also returned in a Server-Timing header
+app.add_middleware(metrics.MetricsMiddleware, prefixes=API_PREFIXES)
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(request: Request):
+    if metrics.METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {metrics.METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="認証が必要です。")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Business API Backend Foundation. Swagger UI is available at /docs"}
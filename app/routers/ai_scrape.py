@@ -1,5 +1,15 @@
 from fastapi import APIRouter, HTTPException
-import trafilatura
+from fastapi.responses import StreamingResponse
+import re
+from pydantic import BaseModel, Field
+from typing import List, Optional
+
+from app.core import crawler
+from app.core.documents import fetch_document
+from app.core.html_text import extract_markdown
+from app.core.http_client import FETCH_ERRORS
+from app.core.cache import create_cache
+from app.core.parse_pool import PARSE_POOL
 
 router = APIRouter(
     prefix="/api/v1/ai-scrape",
@@ -7,8 +17,27 @@ router = APIRouter(
 )
 
 # In-memory cache for scraped content
-# Key: url, Value: scraped dict
-SCRAPE_CACHE = {}
+# Key: crawler.cache_key(url), Value: scraped dict, serialized to JSON bytes
+SCRAPE_CACHE = create_cache("ai_scrape", max_entries=2000, max_bytes=64 * 1024 * 1024, ttl=60 * 60, persistent=True, serialize=True)
+
+class CrawlRequest(BaseModel):
+    url: Optional[str] = None
+    sitemap_url: Optional[str] = None
+    max_depth: int = Field(1, ge=0)
+    max_pages: int = Field(50, ge=1)
+    include: List[str] = []
+    exclude: List[str] = []
+    same_host: bool = True
+
+class CrawlItem(BaseModel):
+    index: int
+    url: str
+    depth: int
+    status: str
+    content: Optional[str] = None
+    duplicate_of: Optional[str] = None
+    status_code: Optional[int] = None
+    error: Optional[str] = None
 
 @router.get("/")
 async def get_ai_scrape(url: str):
@@ -16,18 +45,21 @@ async def get_ai_scrape(url: str):
     Extracts the main content from the provided URL.
     Returns the content in markdown format.
     """
-    # Check cache first
-    if url in SCRAPE_CACHE:
-        return SCRAPE_CACHE[url]
+    # Serve from cache; concurrent misses for the same URL share one download.
+    # Keyed like the crawler's entries, so crawled pages are hits here and vice versa
+    return await SCRAPE_CACHE.get_or_create_response(crawler.cache_key(url), lambda: _scrape(url))
 
+async def _scrape(url: str):
     try:
-        # Fetch the web page
-        downloaded = trafilatura.fetch_url(url)
-        if downloaded is None:
+        # Fetch the web page through the shared document cache
+        try:
+            document = await fetch_document(url, parse=False)
+        except FETCH_ERRORS:
             raise HTTPException(status_code=400, detail="URLが無効、またはアクセスがブロックされました。")
+        downloaded = document.html
         
-        # Extract main content as markdown
-        content = trafilatura.extract(downloaded, output_format="markdown")
+        # Extract main content as markdown, in the parse pool when enabled (see app/core/parse_pool.py)
+        content = await PARSE_POOL.run(extract_markdown, downloaded, size=len(document.content))
         
         if content is None:
             raise HTTPException(status_code=500, detail="本文の抽出に失敗しました。")
@@ -37,13 +69,51 @@ async def get_ai_scrape(url: str):
             "url": url,
             "content": content
         }
-        
-        # Save to cache
-        SCRAPE_CACHE[url] = res_obj
-        
         return res_obj
         
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"予期せぬエラーが発生しました: {str(e)}")
+
+@router.post("/crawl")
+async def post_ai_scrape_crawl(payload: CrawlRequest):
+    """
+    Crawls a site from a seed URL and/or a sitemap and extracts each page as markdown.
+    Returns one NDJSON line per page as soon as it is done (see app/core/crawler.py for
+    the per-host limits and duplicate detection). Pages are shared with GET / through SCRAPE_CACHE.
+    """
+    if not payload.url and not payload.sitemap_url:
+        raise HTTPException(status_code=400, detail="url または sitemap_url を指定してください。")
+    if payload.max_depth > crawler.MAX_DEPTH:
+        raise HTTPException(status_code=400, detail=f"max_depthは{crawler.MAX_DEPTH}以下で指定してください。")
+    if payload.max_pages > crawler.MAX_PAGES:
+        raise HTTPException(status_code=400, detail=f"一度にクロールできるページは{crawler.MAX_PAGES}件までです。")
+    try:
+        include = [re.compile(pattern) for pattern in payload.include]
+        exclude = [re.compile(pattern) for pattern in payload.exclude]
+    except re.error as e:
+        raise HTTPException(status_code=400, detail=f"URLパターンが正しくありません: {str(e)}")
+
+    crawl = crawler.Crawl(SCRAPE_CACHE, _scrape, payload.max_depth, payload.max_pages,
+                          include=include, exclude=exclude, same_host=payload.same_host)
+    if payload.url:
+        crawl.add_seed(payload.url)
+    if payload.sitemap_url:
+        try:
+            await crawl.add_sitemap(payload.sitemap_url)
+        except FETCH_ERRORS:
+            raise HTTPException(status_code=400, detail="サイトマップのURLが無効、またはアクセスがブロックされました。")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="サイトマップを読み取れませんでした。")
+
+    async def stream():
+        pages = crawl.run()
+        try:
+            async for item in pages:
+                yield CrawlItem(**item).model_dump_json(exclude_none=True) + "\n"
+        finally:
+            # Stop crawling when the client disconnects before the crawl completes
+            await pages.aclose()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
@@ -1,15 +1,12 @@
 from fastapi import APIRouter, HTTPException, Query
-import requests
-from bs4 import BeautifulSoup
-import os
-import json
-import re
-from dotenv import load_dotenv
+from pydantic import BaseModel
+from typing import Optional
 
-# Use the new google-genai library as previously configured
-from google import genai
-
-load_dotenv()
+from app.core import gemini, llm_json, metrics, monitor
+from app.core.context_select import select_context
+from app.core.documents import fetch_document
+from app.core.http_client import FETCH_ERRORS
+from app.core.cache import create_cache
 
 router = APIRouter(
     prefix="/api/v1/condition-check",
@@ -17,7 +14,12 @@ router = APIRouter(
 )
 
 # In-memory cache
-CONDITION_CACHE = {}
+CONDITION_CACHE = create_cache("condition_check", max_entries=5000, max_bytes=8 * 1024 * 1024, ttl=10 * 60, persistent=True, serialize=True)
+
+class ConditionCheckResult(BaseModel):
+    condition_met: bool
+    current_status: Optional[str] = None
+    reason: str
 
 @router.get("/")
 async def check_condition(
@@ -27,58 +29,39 @@ async def check_condition(
     """
     指定されたURLのWebページからテキストを抽出し、Gemini APIを用いてユーザーが要求する条件を満たしているか判定してJSONで返却します。
     """
-    # Check cache first
     cache_key = (url, condition)
-    if cache_key in CONDITION_CACHE:
-        return CONDITION_CACHE[cache_key]
+    # Serve from cache; concurrent misses for the same (url, condition) share one fetch and Gemini call
+    return await CONDITION_CACHE.get_or_create_response(cache_key, lambda: _evaluate_condition(url, condition))
 
-    # 1. Fetch HTML using requests
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"
-    }
-    
+async def _evaluate_condition(url: str, condition: str):
+    # 1. Fetch HTML through the shared document cache (revalidated with ETag / Last-Modified)
     try:
-        response = requests.get(url, headers=headers, timeout=15)
-        response.raise_for_status()
-    except requests.RequestException as e:
+        document = await fetch_document(url, timeout=15)
+    except FETCH_ERRORS as e:
         raise HTTPException(
             status_code=400, 
             detail=f"指定されたURLへのアクセスに失敗しました: {str(e)}"
         )
         
-    # 2. Extract text using BeautifulSoup
+    # 2. Extract text (cleaned once per document and reused)
     try:
-        soup = BeautifulSoup(response.content, "html.parser")
-        
-        # Remove unwanted tags
-        for script_or_style in soup(["script", "style", "noscript", "meta", "link", "header", "footer"]):
-            script_or_style.decompose()
-            
-        text = soup.get_text(separator="\n")
-        # Clean up whitespace
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = "\n".join(chunk for chunk in chunks if chunk)
-        
-        # Truncate to 15000 characters
-        truncated_text = text[:15000]
+        page_text = document.text
+        # Keep the blocks most relevant to the condition, within the prompt token budget
+        with metrics.stage("prompt"):
+            truncated_text = select_context(page_text, condition)
     except Exception as e:
         raise HTTPException(
             status_code=500, 
             detail=f"HTMLからテキストを抽出中にエラーが発生しました: {str(e)}"
         )
         
+    return await _judge_condition(condition, truncated_text)
+
+async def _judge_condition(condition: str, truncated_text: str):
     # 3. Call Gemini API
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise HTTPException(
-            status_code=500, 
-            detail="GEMINI_API_KEYが設定されていません。.envファイルに設定してください。"
-        )
+    gemini.ensure_configured()
 
     try:
-        client = genai.Client(api_key=api_key)
-        
         # 4. Prompt instruction
         prompt = f"""
 以下のWebページのテキストを読み、ユーザーの条件（{condition}）が現在満たされているか判定し、必ず純粋なJSON形式のみで出力してください。フォーマットは {{"condition_met": true または false, "current_status": "抽出した現在の価格や状況", "reason": "判定理由"}} としてください。マークダウン記法（```jsonなど）や前置きの文章、解説は一切含めないでください。
@@ -87,31 +70,27 @@ async def check_condition(
 {truncated_text}
 """
 
-        gemini_response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=prompt,
-            config=genai.types.GenerateContentConfig(temperature=0.0, seed=42),
-        )
-        
-        # 5. Parse JSON
-        result_text = gemini_response.text.strip()
-        
-        # 確実なJSON抽出処理 (前後の余分なテキストを削る)
-        json_match = re.search(r'(\{.*\}|\[.*\])', result_text, re.DOTALL)
-        if json_match:
-            result_text = json_match.group(1)
-            
-        extracted_data = json.loads(result_text)
-        
-        # Save to cache
-        CONDITION_CACHE[cache_key] = extracted_data
-        
-        return extracted_data
+        # 5. Structured output, decoded (and repaired once if needed) by the shared JSON layer
+        return await llm_json.generate_json(prompt, schema=ConditionCheckResult)
 
-    except json.JSONDecodeError:
+    except llm_json.LLMJSONError as e:
         raise HTTPException(
             status_code=500, 
-            detail=f"GeminiからのレスポンスをJSONとしてパースできませんでした。レスポンス: {gemini_response.text}"
+            detail=f"GeminiからのレスポンスをJSONとしてパースできませんでした。レスポンス: {e.text}"
         )
+    except HTTPException:
+        # Gemini overload (503) or timeout (504) from the gateway
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Gemini APIエラー: {str(e)}")
+
+async def _evaluate_for_monitor(url: str, condition: str, truncated_text: str):
+    """
+    Gemini judgement for the monitor scheduler, which has already fetched and selected the page text.
+    The result also refreshes the cache (memory and disk tiers), so clients polling this endpoint get it without another call.
+    """
+    result = await _judge_condition(condition, truncated_text)
+    await CONDITION_CACHE.store((url, condition), result)
+    return result
+
+monitor.register_evaluator(_evaluate_for_monitor)
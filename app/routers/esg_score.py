@@ -1,13 +1,12 @@
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+import asyncio
 import os
-import json
-import re
-from dotenv import load_dotenv
-from google import genai
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, Field, ValidationError
+from typing import List, Optional
 
-load_dotenv()
+from app.core import gemini, llm_json
+from app.core.cache import create_cache, loads
 
 router = APIRouter(
     prefix="/api/v1/esg-score",
@@ -15,8 +14,12 @@ router = APIRouter(
 )
 
 # In-memory cache for ESG scores
-# Key: company_name, Value: structured JSON response
-ESG_CACHE = {}
+# Key: company_name, Value: structured JSON response, serialized to bytes
+ESG_CACHE = create_cache("esg_score", max_entries=10000, max_bytes=16 * 1024 * 1024, ttl=7 * 24 * 60 * 60, persistent=True, serialize=True)
+
+# Batch scoring limits: Gemini calls in flight per batch, and companies per request
+ESG_BATCH_CONCURRENCY = int(os.getenv("ESG_BATCH_CONCURRENCY", "8"))
+ESG_BATCH_MAX_ITEMS = int(os.getenv("ESG_BATCH_MAX_ITEMS", "1000"))
 
 class ESGScoreResponse(BaseModel):
     company_name: str
@@ -27,60 +30,97 @@ class ESGScoreResponse(BaseModel):
     summary: str
     key_initiatives: List[str]
 
+class ESGBatchRequest(BaseModel):
+    company_names: List[str] = Field(..., min_length=1)
+
+class ESGBatchItem(BaseModel):
+    index: int
+    company_name: str
+    status: str
+    result: Optional[ESGScoreResponse] = None
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+
 @router.get("/")
 async def get_esg_score(company_name: str):
     """
     ESG・サステナビリティ簡易スコアリング機能
     Takes a company_name parameter.
     """
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise HTTPException(
-            status_code=500, 
-            detail="GEMINI_API_KEYが設定されていません。.envファイルに設定してください。"
-        )
+    gemini.ensure_configured()
 
-    # Check cache first
-    if company_name in ESG_CACHE:
-        return ESG_CACHE[company_name]
+    # Serve from cache; concurrent misses for the same company share one Gemini call
+    return await ESG_CACHE.get_or_create_response(company_name, lambda: _score_company(company_name))
 
+async def _score_company(company_name: str):
     try:
-        client = genai.Client(api_key=api_key)
-        
         prompt = f"企業『{company_name}』の一般的なESG（環境・社会・ガバナンス）の取り組みについて評価し、必ず指定されたJSON構造で出力してください。\n出力するJSONのキーは company_name (文字列), esg_score (1〜100の推定総合スコア数値), environmental_score (1〜100の推定Eスコア数値), social_score (1〜100の推定Sスコア数値), governance_score (1〜100の推定Gスコア数値), summary (100字程度の要約), key_initiatives (主な取り組み3つの配列) としてください。"
 
-        response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=prompt,
-            config=genai.types.GenerateContentConfig(
-                temperature=0.0, 
-                seed=42,
-                response_mime_type="application/json",
-                response_schema=ESGScoreResponse,
-            ),
-        )
-        
-        # パースして有効なJSONか確認
-        try:
-            result_text = response.text.strip()
-            
-            # 確実なJSON抽出処理 (前後の余分なテキストを削る)
-            import re
-            json_match = re.search(r'(\{.*\}|\[.*\])', result_text, re.DOTALL)
-            if json_match:
-                result_text = json_match.group(1)
-            
-            structured_json = json.loads(result_text)
-            
-            # Save to cache
-            ESG_CACHE[company_name] = structured_json
-            
-            return structured_json
-        except json.JSONDecodeError:
-            raise HTTPException(
-                status_code=500, 
-                detail=f"GeminiからのレスポンスをJSONとしてパースできませんでした。レスポンス: {response.text}"
-            )
+        return await llm_json.generate_json(prompt, schema=ESGScoreResponse)
 
+    except llm_json.LLMJSONError as e:
+        raise HTTPException(
+            status_code=500, 
+            detail=f"GeminiからのレスポンスをJSONとしてパースできませんでした。レスポンス: {e.text}"
+        )
+    except HTTPException:
+        # Gemini overload (503) or timeout (504) from the gateway
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Gemini APIエラー: {str(e)}")
+
+@router.post("/batch")
+async def post_esg_score_batch(payload: ESGBatchRequest):
+    """
+    複数企業のESGスコアを一括で取得します。
+    Returns one NDJSON line per company as soon as it is ready: cache hits first,
+    then misses scored with at most ESG_BATCH_CONCURRENCY Gemini calls at a time.
+    `index` is the position of the company in the request.
+    """
+    gemini.ensure_configured()
+
+    if len(payload.company_names) > ESG_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"一度に指定できる企業は{ESG_BATCH_MAX_ITEMS}件までです。"
+        )
+
+    semaphore = asyncio.Semaphore(ESG_BATCH_CONCURRENCY)
+
+    def to_line(index: int, company_name: str, data) -> str:
+        try:
+            item = ESGBatchItem(index=index, company_name=company_name, status="success",
+                                result=ESGScoreResponse.model_validate(loads(data)))
+        except ValidationError as e:
+            item = ESGBatchItem(index=index, company_name=company_name, status="error",
+                                status_code=500, error=f"GeminiのレスポンスがESGスコアの形式ではありません: {str(e)}")
+        return item.model_dump_json(exclude_none=True) + "\n"
+
+    async def score(index: int, company_name: str) -> str:
+        try:
+            async with semaphore:
+                data = await ESG_CACHE.get_or_create(company_name, lambda: _score_company(company_name))
+        except HTTPException as e:
+            item = ESGBatchItem(index=index, company_name=company_name, status="error",
+                                status_code=e.status_code, error=str(e.detail))
+            return item.model_dump_json(exclude_none=True) + "\n"
+        return to_line(index, company_name, data)
+
+    async def stream():
+        misses = []
+        for index, company_name in enumerate(payload.company_names):
+            if company_name in ESG_CACHE:
+                yield to_line(index, company_name, ESG_CACHE.get(company_name))
+            else:
+                misses.append((index, company_name))
+
+        tasks = [asyncio.ensure_future(score(index, company_name)) for index, company_name in misses]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Stop scoring when the client disconnects before the batch completes
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
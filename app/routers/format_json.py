@@ -1,13 +1,10 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-import os
-import json
-import re
-from dotenv import load_dotenv
-from google import genai
-from google.genai import types
+from typing import List
 
-load_dotenv()
+from app.core import gemini, llm_json
+from app.core.cache import create_cache
+from app.core.micro_batch import create_batcher
 
 router = APIRouter(
     prefix="/api/v1/format-json",
@@ -15,7 +12,7 @@ router = APIRouter(
 )
 
 # In-memory cache
-FORMAT_JSON_CACHE = {}
+FORMAT_JSON_CACHE = create_cache("format_json", max_entries=10000, max_bytes=32 * 1024 * 1024, ttl=24 * 60 * 60, persistent=True, serialize=True)
 
 class FormattingRequest(BaseModel):
     text: str
@@ -27,59 +24,58 @@ async def post_format_json(payload: FormattingRequest):
     Uses Gemini API to format raw text into structured JSON 
     based on the provided schema instruction.
     """
-    # Check cache first
     cache_key = (payload.text, payload.schema_instruction)
-    if cache_key in FORMAT_JSON_CACHE:
-        return FORMAT_JSON_CACHE[cache_key]
+    # Serve from cache; concurrent misses for the same text and schema share one Gemini call
+    return await FORMAT_JSON_CACHE.get_or_create_response(cache_key, lambda: _format(payload))
 
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise HTTPException(
-            status_code=500, 
-            detail="GEMINI_API_KEYが設定されていません。.envファイルに設定してください。"
-        )
+async def _format(payload: FormattingRequest):
+    gemini.ensure_configured()
+    # Short texts with the same schema may be merged into one Gemini call (MICRO_BATCH_ENABLED)
+    structured_json = await FORMAT_JSON_BATCHER.submit(payload.schema_instruction, payload.text)
+    return {"status": "success", "data": structured_json}
 
+async def _format_one(schema_instruction: str, text: str):
     try:
-        client = genai.Client(api_key=api_key)
-        
         prompt = f"""
         以下のテキストを分析し、指示されたスキーマ（JSON構造）に従って純粋なJSONフォーマットのみで出力してください。
         必ず有効なJSONテキストのみを出力し、マークダウン記法（```jsonなど）や前置きの文章、解説は一切含めないでください。
 
         [テキスト]
-        {payload.text}
+        {text}
 
         [スキーマ（出力形式の指示）]
-        {payload.schema_instruction}
+        {schema_instruction}
         """
 
-        response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=prompt,
-            config=genai.types.GenerateContentConfig(temperature=0.0, seed=42),
-        )
-        
-        # パースして有効なJSONか確認
-        try:
-            result_text = response.text.strip()
-            
-            # 確実なJSON抽出処理 (前後の余分なテキストを削る)
-            json_match = re.search(r'(\{.*\}|\[.*\])', result_text, re.DOTALL)
-            if json_match:
-                result_text = json_match.group(1)
-            
-            structured_json = json.loads(result_text)
-            res_obj = {"status": "success", "data": structured_json}
-            
-            # Save to cache
-            FORMAT_JSON_CACHE[cache_key] = res_obj
-            
-            return res_obj
-        except json.JSONDecodeError:
-            raise HTTPException(
-                status_code=500, 
-                detail=f"GeminiからのレスポンスをJSONとしてパースできませんでした。レスポンス: {response.text}"
-            )
+        return await llm_json.generate_json(prompt)
 
+    except llm_json.LLMJSONError as e:
+        raise HTTPException(
+            status_code=500, 
+            detail=f"GeminiからのレスポンスをJSONとしてパースできませんでした。レスポンス: {e.text}"
+        )
+    except HTTPException:
+        # Gemini overload (503) or timeout (504) from the gateway
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Gemini APIエラー: {str(e)}")
+
+async def _format_many(schema_instruction: str, texts: List[str]) -> list:
+    """
+    Formats several texts with one Gemini call; returns one result per text, in order.
+    """
+    numbered = "\n\n".join(f"[テキスト{i}]\n{text}" for i, text in enumerate(texts, 1))
+    prompt = f"""
+以下の{len(texts)}件のテキストをそれぞれ分析し、指示されたスキーマ（JSON構造）に従ってJSONに変換してください。
+出力は必ず要素数{len(texts)}のJSON配列のみとし、i番目の要素を[テキストi]の変換結果にしてください。テキスト同士の情報を混ぜないでください。
+マークダウン記法（```jsonなど）や前置きの文章、解説は一切含めないでください。
+
+{numbered}
+
+[スキーマ（出力形式の指示）]
+{schema_instruction}
+"""
+
+    return await llm_json.generate_json(prompt)
+
+FORMAT_JSON_BATCHER = create_batcher("format_json", _format_one, _format_many)
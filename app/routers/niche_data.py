@@ -1,23 +1,40 @@
 from fastapi import APIRouter, HTTPException, Query
-import requests
-from bs4 import BeautifulSoup
+from pydantic import BaseModel
+from typing import List, Tuple
+from urllib.parse import quote_plus
 import os
-import json
-import re
-from dotenv import load_dotenv
-from google import genai
-import xml.etree.ElementTree as ET
 
-load_dotenv()
+from app.core import feeds, gemini, llm_json
+from app.core.http_client import FETCH_ERRORS
+from app.core.cache import create_cache
 
 router = APIRouter(
     prefix="/api/v1/niche-data",
     tags=["niche-data"],
 )
 
+# News search feed, fetched once per locale ("hl:gl", e.g. "ja:JP,en-US:US") and merged.
+# {query} is URL-encoded; override to point at a local stand-in (see benchmarks/static_site.py)
+FEED_URL = os.getenv("NICHE_DATA_FEED_URL", "https://news.google.com/rss/search?q={query}&hl={hl}&gl={gl}&ceid={ceid}")
+LOCALES = [locale.strip() for locale in os.getenv("NICHE_DATA_LOCALES", "ja:JP").split(",") if locale.strip()]
+# Further feed URLs with a {query} placeholder, merged with the news search results
+EXTRA_FEEDS = [url.strip() for url in os.getenv("NICHE_DATA_EXTRA_FEEDS", "").split(",") if url.strip()]
+MAX_ARTICLES = int(os.getenv("NICHE_DATA_MAX_ARTICLES", "10"))
+
 # In-memory cache for niche data
-# Key: query, Value: extracted data
-NICHE_CACHE = {}
+# Key: (query, fingerprint of the article titles), Value: trend analysis, serialized to JSON bytes.
+# Feeds are cached separately (app/core/feeds.py), so Gemini runs again only when the set of articles changes.
+NICHE_CACHE = create_cache("niche_data", max_entries=2000, max_bytes=8 * 1024 * 1024, ttl=24 * 60 * 60, persistent=True, serialize=True)
+
+class NicheArticle(BaseModel):
+    title: str
+    url: str
+
+class NicheDataResult(BaseModel):
+    query: str
+    summary: str
+    key_trends: List[str]
+    articles: List[NicheArticle]
 
 @router.get("/")
 async def get_niche_data(
@@ -30,55 +47,43 @@ async def get_niche_data(
     if not query:
         raise HTTPException(status_code=400, detail="query parameter is required")
 
-    # Check cache first
-    if query in NICHE_CACHE:
-        return NICHE_CACHE[query]
-
-    url = f"https://news.google.com/rss/search?q={query}&hl=ja&gl=JP&ceid=JP:ja"
-    
+    # Feeds come from their own short-lived cache (revalidated with ETag / Last-Modified)
     try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-        }
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
+        articles = await feeds.fetch_feeds(feed_urls(query), max_items=MAX_ARTICLES)
+    except FETCH_ERRORS as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch data: {str(e)}")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Parsing error: {str(e)}")
+
+    if not articles:
+        raise HTTPException(status_code=404, detail="No relevant articles could be extracted.")
 
-        articles = []
-        try:
-            root = ET.fromstring(response.content)
-            for i, item in enumerate(root.findall(".//item")):
-                if i >= 10:
-                    break
-                title = item.find("title").text if item.find("title") is not None else ""
-                link = item.find("link").text if item.find("link") is not None else ""
-                if title:
-                    articles.append({
-                        "title": title,
-                        "url": link
-                    })
-        except Exception:
-            # fallback
-            soup = BeautifulSoup(response.content, "html.parser")
-            for item in soup.find_all("item")[:10]:
-                title = item.title.text if item.title else ""
-                link = item.link.text if item.link else ""
-                if title:
-                    articles.append({
-                        "title": title,
-                        "url": link
-                    })
-                    
-        if not articles:
-            raise HTTPException(status_code=404, detail="No relevant articles could be extracted.")
-            
+    # Serve from cache while the same articles are in the feed; concurrent misses share one Gemini call
+    cache_key = (query, feeds.fingerprint(articles))
+    return await NICHE_CACHE.get_or_create_response(cache_key, lambda: _analyze_news(query, articles))
+
+def feed_urls(query: str) -> List[str]:
+    """
+    Feed URLs for `query`: one news search per locale, then the extra feeds.
+    """
+    encoded = quote_plus(query)
+    urls = []
+    for locale in LOCALES:
+        hl, _, gl = locale.partition(":")
+        gl = gl or hl.split("-")[-1].upper()
+        urls.append(FEED_URL.format(query=encoded, hl=hl, gl=gl, ceid=f"{gl}:{hl.split('-')[0]}"))
+    urls.extend(url.format(query=encoded) for url in EXTRA_FEEDS)
+    # A FEED_URL without locale placeholders yields the same URL for every locale
+    return list(dict.fromkeys(urls))
+
+async def _analyze_news(query: str, articles: List[Tuple[str, str]]):
+    try:
         # Analyze with Gemini
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise HTTPException(status_code=500, detail="GEMINI_API_KEY is not set.")
+        gemini.ensure_configured()
 
-        client = genai.Client(api_key=api_key)
-        
-        articles_text = "\n".join([f"- {a['title']} ({a['url']})" for a in articles])
+        articles_text = "\n".join([f"- {title} ({url})" for title, url in articles])
         
         prompt = f"""
 以下のキーワード「{query}」に関連する最新ニュース記事のリストから、現在の市場・競合の最新トレンドを要約・分析して、必ず指定のJSON形式のみで出力してください。
@@ -100,26 +105,8 @@ async def get_niche_data(
     ]
 }}
 """
-        gemini_response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=prompt,
-            config=genai.types.GenerateContentConfig(temperature=0.0, seed=42),
-        )
-        
-        result_text = gemini_response.text.strip()
-        json_match = re.search(r'(\{.*\}|\[.*\])', result_text, re.DOTALL)
-        if json_match:
-            result_text = json_match.group(1)
-            
-        extracted_data = json.loads(result_text)
-        
-        # Save to cache
-        NICHE_CACHE[query] = extracted_data
-        
-        return extracted_data
-    except requests.RequestException as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch data: {str(e)}")
-    except json.JSONDecodeError:
+        return await llm_json.generate_json(prompt, schema=NicheDataResult)
+    except llm_json.LLMJSONError:
         raise HTTPException(status_code=500, detail="Failed to parse Gemini response as JSON.")
     except HTTPException:
         raise
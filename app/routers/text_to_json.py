@@ -1,14 +1,10 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-import os
-import json
-import re
-from dotenv import load_dotenv
+from typing import List
 
-# Use the google-genai library as previously configured
-from google import genai
-
-load_dotenv()
+from app.core import gemini, llm_json
+from app.core.cache import create_cache
+from app.core.micro_batch import create_batcher
 
 router = APIRouter(
     prefix="/api/v1/text-to-json",
@@ -16,7 +12,7 @@ router = APIRouter(
 )
 
 # In-memory cache
-TEXT_TO_JSON_CACHE = {}
+TEXT_TO_JSON_CACHE = create_cache("text_to_json", max_entries=10000, max_bytes=32 * 1024 * 1024, ttl=24 * 60 * 60, persistent=True, serialize=True)
 
 class TextToJsonRequest(BaseModel):
     text: str
@@ -27,51 +23,47 @@ async def convert_text_to_json(request_data: TextToJsonRequest):
     """
     ぐちゃぐちゃなテキストを指定された指示に従ってJSON構造に変換して返却します。
     """
-    # Check cache first
     cache_key = (request_data.text, request_data.format_instruction)
-    if cache_key in TEXT_TO_JSON_CACHE:
-        return TEXT_TO_JSON_CACHE[cache_key]
+    # Serve from cache; concurrent misses for the same text and instruction share one Gemini call
+    return await TEXT_TO_JSON_CACHE.get_or_create_response(cache_key, lambda: _convert(request_data))
 
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise HTTPException(
-            status_code=500, 
-            detail="GEMINI_API_KEYが設定されていません。.envファイルに設定してください。"
-        )
+async def _convert(request_data: TextToJsonRequest):
+    gemini.ensure_configured()
+    # Short texts with the same instruction may be merged into one Gemini call (MICRO_BATCH_ENABLED)
+    return await TEXT_TO_JSON_BATCHER.submit(request_data.format_instruction, request_data.text)
 
+async def _convert_one(format_instruction: str, text: str):
     try:
-        client = genai.Client(api_key=api_key)
-        
-        prompt = f"""以下のテキストから情報を抽出し、ユーザーの指示（{request_data.format_instruction}）に従って、必ず純粋なJSON形式のみで出力してください。見つからない項目はnullにしてください。マークダウン記法（```jsonなど）や前置きの文章、解説は一切含めないでください。
+        prompt = f"""以下のテキストから情報を抽出し、ユーザーの指示（{format_instruction}）に従って、必ず純粋なJSON形式のみで出力してください。見つからない項目はnullにしてください。マークダウン記法（```jsonなど）や前置きの文章、解説は一切含めないでください。
 
 【対象テキスト】
-{request_data.text}
+{text}
 """
 
-        gemini_response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=prompt,
-            config=genai.types.GenerateContentConfig(temperature=0.0, seed=42),
-        )
-        
-        result_text = gemini_response.text.strip()
-        
-        # 確実なJSON抽出処理 (前後の余分なテキストを削る)
-        json_match = re.search(r'(\{.*\}|\[.*\])', result_text, re.DOTALL)
-        if json_match:
-            result_text = json_match.group(1)
-            
-        extracted_data = json.loads(result_text)
-        
-        # Save to cache
-        TEXT_TO_JSON_CACHE[cache_key] = extracted_data
-        
-        return extracted_data
+        return await llm_json.generate_json(prompt)
 
-    except json.JSONDecodeError:
+    except llm_json.LLMJSONError as e:
         raise HTTPException(
             status_code=500, 
-            detail=f"GeminiからのレスポンスをJSONとしてパースできませんでした。レスポンス: {gemini_response.text}"
+            detail=f"GeminiからのレスポンスをJSONとしてパースできませんでした。レスポンス: {e.text}"
         )
+    except HTTPException:
+        # Gemini overload (503) or timeout (504) from the gateway
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Gemini APIエラー: {str(e)}")
+
+async def _convert_many(format_instruction: str, texts: List[str]) -> list:
+    """
+    Converts several texts with one Gemini call; returns one result per text, in order.
+    """
+    numbered = "\n\n".join(f"【対象テキスト{i}】\n{text}" for i, text in enumerate(texts, 1))
+    prompt = f"""以下の{len(texts)}件のテキストそれぞれから情報を抽出し、ユーザーの指示（{format_instruction}）に従ってJSONに変換してください。見つからない項目はnullにしてください。
+出力は必ず要素数{len(texts)}のJSON配列のみとし、i番目の要素を【対象テキストi】の変換結果にしてください。テキスト同士の情報を混ぜないでください。マークダウン記法（```jsonなど）や前置きの文章、解説は一切含めないでください。
+
+{numbered}
+"""
+
+    return await llm_json.generate_json(prompt)
+
+TEXT_TO_JSON_BATCHER = create_batcher("text_to_json", _convert_one, _convert_many)
@@ -1,15 +1,10 @@
 from fastapi import APIRouter, HTTPException, Query
-import requests
-from bs4 import BeautifulSoup
-import os
-import json
-import re
-from dotenv import load_dotenv
 
-# Use the new google-genai library as previously configured
-from google import genai
-
-load_dotenv()
+from app.core import gemini, llm_json, metrics
+from app.core.context_select import select_context
+from app.core.documents import fetch_document
+from app.core.http_client import FETCH_ERRORS
+from app.core.cache import create_cache
 
 router = APIRouter(
     prefix="/api/v1/web-extract",
@@ -17,8 +12,8 @@ router = APIRouter(
 )
 
 # In-memory cache for web extraction
-# Key: (url, target), Value: extracted data
-WEB_EXTRACT_CACHE = {}
+# Key: (url, target), Value: extracted data, serialized to JSON bytes
+WEB_EXTRACT_CACHE = create_cache("web_extract", max_entries=5000, max_bytes=32 * 1024 * 1024, ttl=60 * 60, persistent=True, serialize=True)
 
 @router.get("/")
 async def get_web_extract(
@@ -28,41 +23,26 @@ async def get_web_extract(
     """
     指定されたURLのWebページからテキストを抽出し、Gemini APIを用いてユーザーが要求する情報を抽出してJSONで返却します。
     """
-    # Check cache first
     cache_key = (url, target)
-    if cache_key in WEB_EXTRACT_CACHE:
-        return WEB_EXTRACT_CACHE[cache_key]
+    # Serve from cache; concurrent misses for the same (url, target) share one fetch and Gemini call
+    return await WEB_EXTRACT_CACHE.get_or_create_response(cache_key, lambda: _extract_from_page(url, target))
 
-    # 1. Fetch HTML using requests
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/115.0.0.0 Safari/537.36"
-    }
-    
+async def _extract_from_page(url: str, target: str):
+    # 1. Fetch HTML through the shared document cache (revalidated with ETag / Last-Modified)
     try:
-        response = requests.get(url, headers=headers, timeout=15)
-        response.raise_for_status()
-    except requests.RequestException as e:
+        document = await fetch_document(url, timeout=15)
+    except FETCH_ERRORS as e:
         raise HTTPException(
             status_code=400, 
             detail=f"指定されたURLへのアクセスに失敗しました: {str(e)}"
         )
         
-    # 2. Extract text using BeautifulSoup
+    # 2. Extract text (cleaned once per document and reused)
     try:
-        soup = BeautifulSoup(response.content, "html.parser")
-        
-        # Remove unwanted tags
-        for script_or_style in soup(["script", "style", "noscript", "meta", "link", "header", "footer"]):
-            script_or_style.decompose()
-            
-        text = soup.get_text(separator="\n")
-        # Clean up whitespace
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = "\n".join(chunk for chunk in chunks if chunk)
-        
-        # Truncate to 15000 characters
-        truncated_text = text[:15000]
+        page_text = document.text
+        # Keep the blocks most relevant to the target, within the prompt token budget
+        with metrics.stage("prompt"):
+            truncated_text = select_context(page_text, target)
     except Exception as e:
         raise HTTPException(
             status_code=500, 
@@ -70,16 +50,9 @@ async def get_web_extract(
         )
         
     # 3. Call Gemini API
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise HTTPException(
-            status_code=500, 
-            detail="GEMINI_API_KEYが設定されていません。.envファイルに設定してください。"
-        )
+    gemini.ensure_configured()
 
     try:
-        client = genai.Client(api_key=api_key)
-        
         # 4. Prompt instruction
         prompt = f"""
 以下のWebページのテキストから、ユーザーの要求（{target}）を満たす情報を抽出し、必ず純粋なJSON形式のみで出力してください。見つからない場合はnullにしてください。マークダウン記法（```jsonなど）や前置きの文章、解説は一切含めないでください。
@@ -88,31 +61,16 @@ async def get_web_extract(
 {truncated_text}
 """
 
-        gemini_response = client.models.generate_content(
-            model='gemini-2.5-flash',
-            contents=prompt,
-            config=genai.types.GenerateContentConfig(temperature=0.0, seed=42),
-        )
-        
-        # 5. Parse JSON
-        result_text = gemini_response.text.strip()
-        
-        # 確実なJSON抽出処理 (前後の余分なテキストを削る)
-        json_match = re.search(r'(\{.*\}|\[.*\])', result_text, re.DOTALL)
-        if json_match:
-            result_text = json_match.group(1)
-            
-        extracted_data = json.loads(result_text)
-        
-        # Save to cache
-        WEB_EXTRACT_CACHE[cache_key] = extracted_data
-        
-        return extracted_data
+        # 5. JSON mode; the free-form reply is decoded (and repaired once if needed) by the shared JSON layer
+        return await llm_json.generate_json(prompt)
 
-    except json.JSONDecodeError:
+    except llm_json.LLMJSONError as e:
         raise HTTPException(
             status_code=500, 
-            detail=f"GeminiからのレスポンスをJSONとしてパースできませんでした。レスポンス: {gemini_response.text}"
+            detail=f"GeminiからのレスポンスをJSONとしてパースできませんでした。レスポンス: {e.text}"
         )
+    except HTTPException:
+        # Gemini overload (503) or timeout (504) from the gateway
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Gemini APIエラー: {str(e)}")
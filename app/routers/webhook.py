@@ -1,66 +1,127 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-import uuid
-import requests
-from typing import Dict
+from typing import Any, Dict, Optional
+
+from app.core.monitor import SCHEDULER
+from app.core.webhooks import (
+    DEFAULT_MESSAGE,
+    DISPATCHER,
+    FANOUTS,
+    SUBSCRIPTIONS,
+    QueueFullError,
+    build_payload,
+    fan_out,
+)
 
 router = APIRouter(
     prefix="/api/v1/webhook",
     tags=["webhook"],
 )
 
-# In-memory storage for webhook subscriptions
-webhook_subscriptions: Dict[str, dict] = {}
-
 class WebhookRegistration(BaseModel):
     target_url: str
     callback_url: str
     event_type: str
+    # When set, target_url is watched and the callback fires whenever this condition flips
+    condition: Optional[str] = None
+    interval_seconds: Optional[int] = None
+
+class FanOutRequest(BaseModel):
+    event_type: str
+    # Only subscribers registered for this target_url, if given
+    target_url: Optional[str] = None
+    message: str = DEFAULT_MESSAGE
+    data: Optional[Dict[str, Any]] = None
 
 @router.post("/register/")
 async def register_webhook(data: WebhookRegistration):
     """
     Registers a new webhook and returns a subscription_id.
+    With a condition, target_url is checked periodically and the callback is sent when the condition flips.
     """
-    subscription_id = str(uuid.uuid4())
-    webhook_subscriptions[subscription_id] = {
-        "target_url": data.target_url,
-        "callback_url": data.callback_url,
-        "event_type": data.event_type
-    }
+    subscription = SUBSCRIPTIONS.add(data.target_url, data.callback_url, data.event_type)
+    if data.condition:
+        SCHEDULER.watch(subscription.id, data.target_url, data.condition, data.interval_seconds)
     return {
         "status": "success",
         "message": "Webhook registered successfully",
-        "subscription_id": subscription_id
+        "subscription_id": subscription.id,
+        "monitoring": bool(data.condition)
     }
 
+@router.get("/{subscription_id}/")
+async def get_webhook(subscription_id: str):
+    """
+    Returns a registered webhook and, for condition webhooks, the latest monitor result.
+    """
+    subscription = SUBSCRIPTIONS.get(subscription_id)
+    if subscription is None:
+        raise HTTPException(status_code=404, detail="Subscription ID not found")
+    monitor = SCHEDULER.get(subscription_id)
+    return {
+        "subscription_id": subscription.id,
+        **subscription.to_dict(),
+        "monitor": monitor.to_dict() if monitor is not None else None
+    }
+
+@router.delete("/{subscription_id}/")
+async def unregister_webhook(subscription_id: str):
+    """
+    Removes a registered webhook.
+    """
+    if not SUBSCRIPTIONS.remove(subscription_id):
+        raise HTTPException(status_code=404, detail="Subscription ID not found")
+    SCHEDULER.unwatch(subscription_id)
+    return {"status": "success", "message": "Webhook unregistered successfully"}
+
 @router.post("/simulate/{subscription_id}/")
 async def simulate_webhook(subscription_id: str):
     """
     Simulates sending an event to the registered callback URL.
+    The event goes through the delivery queue and the result of a single attempt is returned;
+    retries are left to real (fan-out) deliveries so a dead callback_url fails at once.
     """
-    if subscription_id not in webhook_subscriptions:
+    subscription = SUBSCRIPTIONS.get(subscription_id)
+    if subscription is None:
         raise HTTPException(status_code=404, detail="Subscription ID not found")
-        
-    subscription = webhook_subscriptions[subscription_id]
-    
-    payload = {
-        "event": subscription["event_type"],
-        "message": "変化を検知しました",
-        "target": subscription["target_url"]
-    }
-    
+
     try:
-        response = requests.post(subscription["callback_url"], json=payload, timeout=5)
-        
-        return {
-            "status": "success",
-            "message": f"Webhook execution simulated successfully.",
-            "callback_response_status": response.status_code,
-            "callback_response_text": response.text
-        }
-    except requests.RequestException as e:
+        delivery = await DISPATCHER.deliver(subscription, build_payload(subscription), max_attempts=1)
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Webhook delivery queue is full. Please retry later.")
+
+    if delivery.status_code is None:
         raise HTTPException(
             status_code=500, 
-            detail=f"Failed to send webhook request to callback_url: {str(e)}"
+            detail=f"Failed to send webhook request to callback_url: {delivery.error}"
         )
+
+    return {
+        "status": "success",
+        "message": f"Webhook execution simulated successfully.",
+        "callback_response_status": delivery.status_code,
+        "callback_response_text": delivery.response_text,
+        "attempts": delivery.attempts
+    }
+
+@router.post("/fanout/", status_code=202)
+async def fan_out_event(request_data: FanOutRequest):
+    """
+    Sends an event to every subscriber of event_type (optionally narrowed to target_url).
+    Deliveries run in the background; poll GET /fanout/{fanout_id}/ for per-delivery status.
+    """
+    try:
+        fanout = fan_out(request_data.event_type, request_data.target_url, request_data.message, request_data.data)
+    except QueueFullError:
+        raise HTTPException(status_code=503, detail="Webhook delivery queue is full. Please retry later.")
+    return {"status": "accepted", **fanout.to_dict(include_deliveries=False)}
+
+@router.get("/fanout/{fanout_id}/")
+async def get_fan_out_status(fanout_id: str):
+    """
+    Returns delivery counts and the status of each delivery of a fan-out.
+    """
+    fanout = FANOUTS.get(fanout_id)
+    if fanout is None:
+        raise HTTPException(status_code=404, detail="Fan-out ID not found")
+    return fanout.to_dict()
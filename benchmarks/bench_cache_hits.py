@@ -0,0 +1,144 @@
+"""
+Cache-hit throughput: cached dicts re-encoded by FastAPI vs. pre-serialized bytes.
+
+Fills the AI Scrape, Web Extract and ESG Score caches with one entry each
+(the AI Scrape entry is the markdown of a corpus page, the Web Extract entry a
+nested product list) and calls the app's ASGI entry point directly, with no
+network or HTTP parsing, so the numbers are the app's own cost per hit.
+Each endpoint is run with the cache storing parsed values, as before
+(`CACHE_SERIALIZED_RESPONSES=0`), and storing JSON bytes (the default), and
+the response bodies of both modes are checked to be identical JSON.
+
+Usage:
+    python benchmarks/bench_cache_hits.py [--requests N] [--repeat N]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DISK_CACHE_ENABLED", "0")
+os.environ.setdefault("IMPORT_WARMUP_ENABLED", "0")
+os.environ.setdefault("MONITOR_ENABLED", "0")
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+
+from app.core.cache import dumps  # noqa: E402
+from app.main import app  # noqa: E402
+from app.routers.ai_scrape import SCRAPE_CACHE  # noqa: E402
+from app.routers.esg_score import ESG_CACHE  # noqa: E402
+from app.routers.web_extract import WEB_EXTRACT_CACHE  # noqa: E402
+
+CORPUS_PAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus", "html", "ecommerce_listing.html")
+PAGE_URL = "https://shop.example.com/listing"
+
+
+def scrape_value() -> dict:
+    import trafilatura
+    with open(CORPUS_PAGE, "rb") as f:
+        content = trafilatura.extract(f.read(), output_format="markdown") or ""
+    return {"status": "success", "url": PAGE_URL, "content": content}
+
+
+def web_extract_value() -> dict:
+    return {
+        "shop": "Example Shop",
+        "products": [
+            {"name": f"商品 {i}", "price": 1000 + i * 37, "currency": "JPY", "in_stock": i % 3 != 0,
+             "tags": ["セール", "送料無料"] if i % 2 else ["新着"], "rating": {"average": 4.2, "count": i * 3}}
+            for i in range(200)
+        ],
+    }
+
+
+def esg_value() -> dict:
+    return {"company_name": "株式会社サンプル", "esg_score": 72, "environmental_score": 70, "social_score": 75,
+            "governance_score": 71, "summary": "環境負荷の低減と人的資本への投資を進めている。" * 3,
+            "key_initiatives": ["再生可能エネルギーの導入", "女性管理職比率の向上", "取締役会の独立性強化"]}
+
+
+# name -> (cache, key, value factory, path, query)
+CASES = {
+    "ai_scrape": (SCRAPE_CACHE, PAGE_URL, scrape_value, "/api/v1/ai-scrape/", {"url": PAGE_URL}),
+    "web_extract": (WEB_EXTRACT_CACHE, (PAGE_URL, "商品一覧"), web_extract_value, "/api/v1/web-extract/",
+                    {"url": PAGE_URL, "target": "商品一覧"}),
+    "esg_score": (ESG_CACHE, "株式会社サンプル", esg_value, "/api/v1/esg-score/", {"company_name": "株式会社サンプル"}),
+}
+
+
+async def call(path: str, query: dict) -> bytes:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": urlencode(query).encode(), "root_path": "",
+        # A premium key skips the free-tier limit, so only the cache hit is measured
+        "headers": [(b"host", b"bench"), (b"x-rapidapi-key", b"bench")],
+        "client": ("127.0.0.1", 1234), "server": ("bench", 80),
+    }
+    body = []
+    received = False
+    finished = asyncio.Event()
+
+    async def receive():
+        # The (empty) body once, then nothing until the response is done, like a real server
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start" and message["status"] != 200:
+            raise RuntimeError(f"{path} returned {message['status']}")
+        if message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    try:
+        await app(scope, receive, send)
+    finally:
+        finished.set()
+    return b"".join(body)
+
+
+async def measure(path: str, query: dict, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        await call(path, query)
+    return requests / (time.perf_counter() - start)
+
+
+async def run(requests: int, repeat: int) -> None:
+    print(f"{'endpoint':<14}{'payload KB':>12}{'dict req/s':>14}{'bytes req/s':>14}{'speedup':>10}")
+    print("-" * 64)
+    async with app.router.lifespan_context(app):
+        for name, (cache, key, make_value, path, query) in CASES.items():
+            value = make_value()
+            results, bodies = {}, {}
+            for serialize in (False, True):
+                cache.serialize = serialize
+                cache.set(key, cache.encode(value))
+                bodies[serialize] = await call(path, query)
+                await measure(path, query, requests // 10)  # warm-up
+                results[serialize] = statistics.median(
+                    [await measure(path, query, requests) for _ in range(repeat)]
+                )
+            if json.loads(bodies[False]) != json.loads(bodies[True]):
+                sys.exit(f"{name}: serialized response differs from the encoded dict")
+            print(f"{name:<14}{len(dumps(value)) / 1024:>12.1f}{results[False]:>14.0f}{results[True]:>14.0f}"
+                  f"{results[True] / results[False]:>9.1f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500, help="requests per measurement")
+    parser.add_argument("--repeat", type=int, default=5, help="measurements per mode (median is reported)")
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Reports prompt size before and after relevance-ranked context selection.
+
+For each (page, query, expected phrase) case the page text is extracted as the
+routers do, then compared between the old `text[:15000]` truncation and
+`select_context`: estimated tokens, selection time, and whether the phrase the
+query is looking for survives.
+
+Usage:
+    python benchmarks/bench_context_select.py [--budget TOKENS]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.context_select import TOKEN_BUDGET, estimate_tokens, select_context  # noqa: E402
+from app.core.html_text import html_to_text  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus", "html")
+
+CASES = [
+    ("ecommerce_listing.html", "membership plan prices", "$19.99 / month"),
+    ("ecommerce_listing.html", "price of Trail Tent Model 512", "Trail Tent Model 512"),
+    ("corporate_outline_sjis.html", "代表者名と資本金", "代表取締役社長"),
+    ("news_article.html", "related articles", "Related"),
+]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=int, default=TOKEN_BUDGET)
+    args = parser.parse_args()
+
+    header = f"{'page':<30}{'query':<32}{'truncated tok':>14}{'found':>7}{'selected tok':>14}{'found':>7}{'ms':>8}"
+    print(header)
+    print("-" * len(header))
+    for filename, query, expected in CASES:
+        with open(os.path.join(CORPUS, filename), "rb") as f:
+            text = html_to_text(f.read())
+        truncated = text[:15000]
+        start = time.perf_counter()
+        selected = select_context(text, query, args.budget)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(
+            f"{filename[:29]:<30}{query[:31]:<32}"
+            f"{estimate_tokens(truncated):>14}{'yes' if expected in truncated else 'no':>7}"
+            f"{estimate_tokens(selected):>14}{'yes' if expected in selected else 'no':>7}{elapsed:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
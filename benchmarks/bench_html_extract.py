@@ -0,0 +1,117 @@
+"""
+Micro-benchmark for HTML-to-text extraction.
+
+Compares the original BeautifulSoup cleanup (as it was inlined in
+web_extract / condition_check) with the extractors in app/core/html_text.py
+over a corpus of saved pages, and checks that every extractor returns exactly
+the same text as the original.
+
+Usage:
+    python benchmarks/bench_html_extract.py [--corpus DIR] [--repeat N] [--max-chars N]
+    python benchmarks/bench_html_extract.py --save https://example.com/page.html
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+from app.core.html_text import EXTRACTORS  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus", "html")
+
+
+def original_extract(content: bytes, max_chars: int) -> str:
+    soup = BeautifulSoup(content, "html.parser")
+    for script_or_style in soup(["script", "style", "noscript", "meta", "link", "header", "footer"]):
+        script_or_style.decompose()
+    text = soup.get_text(separator="\n")
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    text = "\n".join(chunk for chunk in chunks if chunk)
+    return text[:max_chars]
+
+
+def time_call(func, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+
+def save_page(url: str, corpus: str) -> None:
+    import httpx
+    from app.core.http_client import USER_AGENT
+
+    response = httpx.get(url, headers={"User-Agent": USER_AGENT}, follow_redirects=True, timeout=15)
+    response.raise_for_status()
+    name = url.split("://", 1)[-1].strip("/").replace("/", "_") or "index"
+    path = os.path.join(corpus, name if name.endswith(".html") else name + ".html")
+    with open(path, "wb") as f:
+        f.write(response.content)
+    print(f"saved {len(response.content)} bytes to {path}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--max-chars", type=int, default=15000)
+    parser.add_argument("--save", metavar="URL", nargs="+", help="download pages into the corpus and exit")
+    args = parser.parse_args()
+
+    if args.save:
+        for url in args.save:
+            save_page(url, args.corpus)
+        return
+
+    files = sorted(f for f in os.listdir(args.corpus) if f.endswith((".html", ".htm")))
+    if not files:
+        sys.exit(f"no .html files in {args.corpus}")
+
+    names = list(EXTRACTORS)
+    header = f"{'page':<36}{'KB':>8}{'original ms':>14}" + "".join(f"{name + ' ms':>12}{'x':>7}" for name in names)
+    print(header)
+    print("-" * len(header))
+
+    totals = {"original": 0.0, **{name: 0.0 for name in names}}
+    mismatches = []
+    for filename in files:
+        with open(os.path.join(args.corpus, filename), "rb") as f:
+            content = f.read()
+
+        expected = original_extract(content, args.max_chars)
+        base_ms = time_call(lambda: original_extract(content, args.max_chars), args.repeat)
+        totals["original"] += base_ms
+        row = f"{filename[:35]:<36}{len(content) / 1024:>8.0f}{base_ms:>14.2f}"
+        for name in names:
+            extractor = EXTRACTORS[name]
+            if extractor.extract(content, args.max_chars) != expected:
+                mismatches.append((filename, name))
+            ms = time_call(lambda: extractor.extract(content, args.max_chars), args.repeat)
+            totals[name] += ms
+            row += f"{ms:>12.2f}{base_ms / ms:>6.1f}x"
+        print(row)
+
+    print("-" * len(header))
+    total_row = f"{'total':<36}{'':>8}{totals['original']:>14.2f}"
+    for name in names:
+        total_row += f"{totals[name]:>12.2f}{totals['original'] / totals[name]:>6.1f}x"
+    print(total_row)
+
+    if mismatches:
+        print("\noutput differs from the original for:")
+        for filename, name in mismatches:
+            print(f"  {filename} ({name})")
+        sys.exit(1)
+    print("\nall extractors match the original output")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Cold-start report: import time of `app.main` and time to the first response.
+
+Each run starts a fresh interpreter with `-X importtime`, imports the app,
+runs the lifespan startup and serves `GET /` in-process. The median run is
+reported with the modules that took longest to import (cumulative, like
+`python -X importtime`), and which heavy libraries were already loaded.
+
+With `--budget-ms` (or `IMPORT_TIME_BUDGET_MS`) the script exits with status 1
+when the median import time of `app.main` exceeds the budget, or when one of
+the heavy libraries is imported at startup, so it can be used as a regression
+check before deploying.
+
+Usage:
+    python benchmarks/bench_import_time.py [--runs N] [--top N] [--budget-ms MS]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Libraries the app should not import before the first request that needs them
+HEAVY_MODULES = ("google.genai", "trafilatura", "bs4")
+
+_CHILD = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+from app.main import app
+imported = time.perf_counter()
+loaded = [name for name in %r if name in sys.modules]
+
+async def first_response():
+    import httpx
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            response = await client.get("/")
+            response.raise_for_status()
+
+asyncio.run(first_response())
+served = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "first_response_ms": (served - start) * 1000, "loaded": loaded}))
+""" % (HEAVY_MODULES,)
+
+
+def parse_importtime(stderr: str):
+    """
+    Returns [(module, self_us, cumulative_us)] from `-X importtime` output.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        rows.append((module.rstrip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def run_once():
+    # PARSE_POOL=off: spawned pool workers would inherit -X importtime and mix their rows into
+    # stderr, and starting them would count towards the first response
+    env = dict(os.environ, IMPORT_WARMUP_ENABLED="0", DISK_CACHE_ENABLED=os.getenv("DISK_CACHE_ENABLED", "0"),
+               PARSE_POOL="off")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _CHILD],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1]), parse_importtime(result.stderr)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    budget = os.getenv("IMPORT_TIME_BUDGET_MS")
+    parser.add_argument("--budget-ms", type=float, default=float(budget) if budget else None)
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    runs.sort(key=lambda run: run[0]["import_ms"])
+    summary, modules = runs[len(runs) // 2]
+    import_ms = statistics.median(run[0]["import_ms"] for run in runs)
+    first_response_ms = statistics.median(run[0]["first_response_ms"] for run in runs)
+
+    print(f"{'module':<50}{'self ms':>10}{'cumulative ms':>15}")
+    print("-" * 75)
+    for module, self_us, cumulative_us in sorted(modules, key=lambda row: -row[2])[:args.top]:
+        print(f"{module[:49]:<50}{self_us / 1000:>10.1f}{cumulative_us / 1000:>15.1f}")
+    print("-" * 75)
+    print(f"import app.main (median of {args.runs}): {import_ms:.0f} ms")
+    print(f"first response to GET /:          {first_response_ms:.0f} ms")
+    print(f"heavy modules loaded at startup:  {', '.join(summary['loaded']) or 'none'}")
+
+    if args.budget_ms is not None:
+        if import_ms > args.budget_ms:
+            sys.exit(f"\nimport time {import_ms:.0f} ms exceeds the budget of {args.budget_ms:.0f} ms")
+        if summary["loaded"]:
+            sys.exit(f"\n{', '.join(summary['loaded'])} should be imported lazily, not at startup")
+        print(f"\nwithin the import budget of {args.budget_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,462 @@
+"""
+Offline load test of every `/api/v1/*` endpoint.
+
+Starts three local processes and drives the API with closed-loop clients:
+
+- `benchmarks/fake_gemini.py`, answering Gemini calls after `--gemini-latency-ms`
+  and failing `--gemini-error-rate` of them;
+- `benchmarks/static_site.py`, serving the HTML and RSS fixtures in
+  `benchmarks/corpus` (and webhook callbacks);
+- the app itself under `uvicorn --workers N`, pointed at both through
+  `GEMINI_BASE_URL` / `NICHE_DATA_FEED_URL`. Other settings (e.g.
+  `MICRO_BATCH_ENABLED=1`) are passed through from the environment.
+
+Each endpoint is run at each `--concurrency` level for `--duration` seconds.
+By default every request uses a new cache key, so the full fetch/parse/Gemini
+path is measured. `--key-space N` cycles through N keys to measure cache hits.
+The report shows requests per second, p50/p95/p99 latency, errors, Gemini
+calls, and the CPU use and peak RSS of the server processes (read from
+/proc, so Linux only).
+
+Results are written to `benchmarks/results/<label>.json`. `--compare latest`
+(or a path) prints the change against an earlier run and marks a regression
+when p95 latency rises, or throughput falls, by more than `--threshold`.
+`--fail-on-regression` turns that into a non-zero exit status.
+
+Usage:
+    python benchmarks/bench_load.py [--endpoints web_extract,text_to_json] [--concurrency 1,8,32]
+        [--duration 10] [--workers 2] [--key-space 0] [--label NAME] [--compare latest]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(ROOT, "benchmarks")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# Any key other than RAPIDAPI_KEY skips the free-tier limit (see check_rate_limit in app/main.py)
+HEADERS = {"X-RapidAPI-Key": "bench-load"}
+
+
+async def web_extract(client: httpx.AsyncClient, key: str, site: str) -> httpx.Response:
+    return await client.get("/api/v1/web-extract/", params={
+        "url": f"{site}/html/news_article.html?v={key}", "target": "記事の見出しと公開日"})
+
+
+async def condition_check(client: httpx.AsyncClient, key: str, site: str) -> httpx.Response:
+    return await client.get("/api/v1/condition-check/", params={
+        "url": f"{site}/html/ecommerce_listing.html?v={key}", "condition": "価格が5000円以下になっているか"})
+
+
+async def ai_scrape(client: httpx.AsyncClient, key: str, site: str) -> httpx.Response:
+    return await client.get("/api/v1/ai-scrape/", params={"url": f"{site}/html/corporate_outline_sjis.html?v={key}"})
+
+
+async def niche_data(client: httpx.AsyncClient, key: str, site: str) -> httpx.Response:
+    return await client.get("/api/v1/niche-data/", params={"query": f"アニメ {key}"})
+
+
+async def esg_score(client: httpx.AsyncClient, key: str, site: str) -> httpx.Response:
+    return await client.get("/api/v1/esg-score/", params={"company_name": f"株式会社サンプル{key}"})
+
+
+async def esg_score_batch(client: httpx.AsyncClient, key: str, site: str) -> httpx.Response:
+    return await client.post("/api/v1/esg-score/batch", json={
+        "company_names": [f"株式会社バッチ{key}-{i}" for i in range(4)]})
+
+
+async def text_to_json(client: httpx.AsyncClient, key: str, site: str) -> httpx.Response:
+    return await client.post("/api/v1/text-to-json/", json={
+        "text": f"明日の10時から第一会議室でキックオフを行います。参加者は田中と佐藤です。({key})",
+        "format_instruction": "日時、場所、参加者を抽出してください"})
+
+
+async def format_json(client: httpx.AsyncClient, key: str, site: str) -> httpx.Response:
+    return await client.post("/api/v1/format-json/", json={
+        "text": f"注文番号 {key}: りんご 3個 (1個120円)、みかん 5個 (1個80円)",
+        "schema_instruction": "注文番号と商品ごとの名前・数量・単価をJSONで"})
+
+
+async def webhook(client: httpx.AsyncClient, key: str, site: str) -> httpx.Response:
+    # Subscriptions live in one worker's memory; each user's single connection keeps both calls on the same worker
+    response = await client.post("/api/v1/webhook/register/", json={
+        "target_url": f"{site}/html/news_article.html", "callback_url": f"{site}/hook", "event_type": f"bench-{key}"})
+    if response.status_code != 200:
+        return response
+    return await client.post(f"/api/v1/webhook/simulate/{response.json()['subscription_id']}/")
+
+
+# One request (or, for webhooks, register + simulate) per call, with the cache key and static site URL
+SCENARIOS: Dict[str, Callable[[httpx.AsyncClient, str, str], Awaitable[httpx.Response]]] = {
+    scenario.__name__: scenario
+    for scenario in (web_extract, condition_check, ai_scrape, niche_data, esg_score, esg_score_batch,
+                     text_to_json, format_json, webhook)
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+class ProcessSampler:
+    """
+    CPU time and peak RSS of a process and all its descendants (the uvicorn workers), read from /proc.
+    """
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.available = os.path.exists(f"/proc/{pid}/stat")
+        self.peak_rss = 0
+        self._task: Optional[asyncio.Task] = None
+        self._ticks = os.sysconf("SC_CLK_TCK") if self.available else 100
+
+    def _pids(self) -> List[int]:
+        pids, pending = [], [self.pid]
+        while pending:
+            pid = pending.pop()
+            pids.append(pid)
+            try:
+                with open(f"/proc/{pid}/task/{pid}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+            except OSError:
+                pass
+        return pids
+
+    def cpu_seconds(self) -> float:
+        total = 0
+        for pid in self._pids():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    # Fields after the parenthesised command name; utime and stime are the 14th and 15th overall
+                    fields = f.read().rsplit(")", 1)[1].split()
+                total += int(fields[11]) + int(fields[12])
+            except (OSError, IndexError, ValueError):
+                pass
+        return total / self._ticks
+
+    def rss_bytes(self) -> int:
+        total = 0
+        for pid in self._pids():
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            total += int(line.split()[1]) * 1024
+                            break
+            except OSError:
+                pass
+        return total
+
+    async def _sample(self) -> None:
+        while True:
+            self.peak_rss = max(self.peak_rss, self.rss_bytes())
+            await asyncio.sleep(0.25)
+
+    def start(self) -> None:
+        if self.available:
+            self.peak_rss = 0
+            self._task = asyncio.create_task(self._sample())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+def start_process(args: List[str], log_path: str, env: Optional[dict] = None) -> subprocess.Popen:
+    with open(log_path, "wb") as log:
+        process = subprocess.Popen([sys.executable] + args, cwd=ROOT, env=env or os.environ.copy(),
+                                   stdout=log, stderr=subprocess.STDOUT)
+    process.log_path = log_path
+    return process
+
+
+def stop_process(process: subprocess.Popen) -> None:
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+async def wait_ready(client: httpx.AsyncClient, url: str, process: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            with open(process.log_path, encoding="utf-8", errors="replace") as f:
+                raise RuntimeError(f"{url} exited during startup:\n{f.read()}")
+        try:
+            await client.get(url)
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not start within {timeout:.0f} s")
+
+
+async def run_level(app_url: str, name: str, concurrency: int, duration: float, keys, site: str,
+                    sampler: ProcessSampler, gemini_url: str) -> dict:
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    deadline = time.perf_counter() + duration
+
+    scenario = SCENARIOS[name]
+
+    async def user() -> None:
+        # One keep-alive connection per simulated user, like a real client
+        async with httpx.AsyncClient(base_url=app_url, headers=HEADERS, timeout=120,
+                                     limits=httpx.Limits(max_connections=1)) as client:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    response = await scenario(client, next(keys), site)
+                    status = str(response.status_code)
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    gemini_before = await gemini_calls(gemini_url)
+    cpu_before = sampler.cpu_seconds() if sampler.available else None
+    sampler.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await sampler.stop()
+    cpu_after = sampler.cpu_seconds() if sampler.available else None
+    gemini_after = await gemini_calls(gemini_url)
+
+    latencies.sort()
+    ok = sum(count for status, count in statuses.items() if status.startswith("2"))
+    return {
+        "endpoint": name,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": len(latencies) - ok,
+        "statuses": statuses,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "gemini_calls": gemini_after - gemini_before,
+        # Percent of one core, summed over the workers
+        "cpu_percent": (cpu_after - cpu_before) / elapsed * 100 if cpu_before is not None and elapsed else None,
+        "peak_rss_mb": sampler.peak_rss / 1024 / 1024 if sampler.available else None,
+    }
+
+
+async def gemini_calls(gemini_url: str) -> int:
+    async with httpx.AsyncClient() as client:
+        return (await client.get(f"{gemini_url}/stats")).json()["calls"]
+
+
+def key_source(key_space: int):
+    counter = 0
+    while True:
+        yield str(counter % key_space if key_space else counter)
+        counter += 1
+
+
+def print_table(results: List[dict]) -> None:
+    print(f"{'endpoint':<18}{'conc':>5}{'reqs':>7}{'err':>6}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'gemini':>8}{'cpu %':>8}{'rss MB':>8}")
+    print("-" * 96)
+    for r in results:
+        cpu = f"{r['cpu_percent']:.0f}" if r["cpu_percent"] is not None else "-"
+        rss = f"{r['peak_rss_mb']:.0f}" if r["peak_rss_mb"] is not None else "-"
+        print(f"{r['endpoint']:<18}{r['concurrency']:>5}{r['requests']:>7}{r['errors']:>6}{r['rps']:>9.1f}"
+              f"{r['p50_ms']:>9.0f}{r['p95_ms']:>9.0f}{r['p99_ms']:>9.0f}{r['gemini_calls']:>8}{cpu:>8}{rss:>8}")
+
+
+def find_baseline(compare: str, current_path: str) -> Optional[str]:
+    if compare != "latest":
+        return compare
+    if not os.path.isdir(RESULTS_DIR):
+        return None
+    paths = [os.path.join(RESULTS_DIR, name) for name in os.listdir(RESULTS_DIR) if name.endswith(".json")]
+    paths = [path for path in paths if os.path.abspath(path) != os.path.abspath(current_path)]
+    return max(paths, key=os.path.getmtime) if paths else None
+
+
+def compare_results(baseline: dict, results: List[dict], threshold: float) -> List[str]:
+    """
+    Prints p95 and throughput changes per (endpoint, concurrency) and returns the regressions.
+    """
+    previous = {(r["endpoint"], r["concurrency"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"\ncompared with {baseline.get('label')} ({baseline.get('git_commit') or 'unknown commit'}):")
+    print(f"{'endpoint':<18}{'conc':>5}{'p95 ms':>18}{'rps':>18}")
+    for r in results:
+        old = previous.get((r["endpoint"], r["concurrency"]))
+        if old is None:
+            continue
+        p95_change = r["p95_ms"] / old["p95_ms"] - 1 if old["p95_ms"] else 0.0
+        rps_change = r["rps"] / old["rps"] - 1 if old["rps"] else 0.0
+        flag = ""
+        if p95_change > threshold or rps_change < -threshold:
+            flag = "  REGRESSION"
+            regressions.append(f"{r['endpoint']} x{r['concurrency']}")
+        print(f"{r['endpoint']:<18}{r['concurrency']:>5}{old['p95_ms']:>7.0f} -> {r['p95_ms']:<6.0f}{p95_change:>+5.0%}"
+              f"{old['rps']:>7.1f} -> {r['rps']:<6.1f}{rps_change:>+5.0%}{flag}")
+    return regressions
+
+
+async def run(args) -> Tuple[List[dict], dict]:
+    gemini_port, site_port, app_port = free_port(), free_port(), free_port()
+    gemini_url, site_url, app_url = (f"http://127.0.0.1:{port}" for port in (gemini_port, site_port, app_port))
+    # Cache file and process logs of this run
+    work_dir = tempfile.mkdtemp(prefix="bench-load-")
+
+    env = dict(
+        os.environ,
+        GEMINI_API_KEY="bench",
+        GEMINI_BASE_URL=gemini_url,
+        NICHE_DATA_FEED_URL=f"{site_url}/rss/search?q={{query}}",
+        # A fresh cache file per run, so earlier runs cannot turn misses into hits
+        DISK_CACHE_PATH=os.path.join(work_dir, "cache.sqlite3"),
+    )
+    app_cmd = ["-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(app_port),
+               "--workers", str(args.workers), "--http", "httptools", "--log-level", "warning", "--no-access-log"]
+    if os.name != "nt":
+        app_cmd += ["--loop", "uvloop"]
+
+    processes = [
+        start_process([os.path.join(BENCH_DIR, "fake_gemini.py"), "--port", str(gemini_port),
+                       "--latency-ms", str(args.gemini_latency_ms), "--jitter-ms", str(args.gemini_jitter_ms),
+                       "--error-rate", str(args.gemini_error_rate), "--quota", str(args.gemini_quota)],
+                      os.path.join(work_dir, "fake_gemini.log")),
+        start_process([os.path.join(BENCH_DIR, "static_site.py"), "--port", str(site_port),
+                       "--latency-ms", str(args.site_latency_ms)], os.path.join(work_dir, "static_site.log")),
+    ]
+    try:
+        async with httpx.AsyncClient() as client:
+            await wait_ready(client, f"{gemini_url}/stats", processes[0])
+            await wait_ready(client, f"{site_url}/stats", processes[1])
+            processes.append(start_process(app_cmd, os.path.join(work_dir, "app.log"), env))
+            await wait_ready(client, f"{app_url}/", processes[2])
+        # Background warm-up (library imports, parse pool processes) is not part of the steady state
+        await asyncio.sleep(args.settle)
+
+        sampler = ProcessSampler(processes[2].pid)
+        results = []
+        for name in args.endpoints:
+            keys = key_source(args.key_space)
+            for concurrency in args.concurrency:
+                result = await run_level(app_url, name, concurrency, args.duration, keys, site_url, sampler, gemini_url)
+                results.append(result)
+                print(f"  {name} x{concurrency}: {result['rps']:.1f} req/s, p95 {result['p95_ms']:.0f} ms, "
+                      f"{result['errors']} errors", flush=True)
+    finally:
+        for process in reversed(processes):
+            stop_process(process)
+
+    config = {
+        "workers": args.workers,
+        "duration": args.duration,
+        "key_space": args.key_space,
+        "gemini_latency_ms": args.gemini_latency_ms,
+        "gemini_jitter_ms": args.gemini_jitter_ms,
+        "gemini_error_rate": args.gemini_error_rate,
+        "gemini_quota": args.gemini_quota,
+        "site_latency_ms": args.site_latency_ms,
+        "cpu_count": os.cpu_count(),
+        "python": sys.version.split()[0],
+        # App settings under test that change the numbers
+        "env": {key: value for key, value in os.environ.items()
+                if key.startswith(("MICRO_BATCH_", "CACHE_", "CONTEXT_", "HTTP_", "DOCUMENT_", "HTML_", "GEMINI_"))
+                and key not in ("GEMINI_API_KEY", "GEMINI_BASE_URL")},
+    }
+    print(f"server logs in {work_dir}")
+    return results, config
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", default=",".join(SCENARIOS),
+                        help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per endpoint and level")
+    parser.add_argument("--workers", type=int, default=2, help="uvicorn worker processes")
+    parser.add_argument("--key-space", type=int, default=0,
+                        help="distinct cache keys per endpoint (0: every request is a cache miss)")
+    parser.add_argument("--gemini-latency-ms", type=float, default=800)
+    parser.add_argument("--gemini-jitter-ms", type=float, default=200)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--settle", type=float, default=3.0, help="seconds to wait after the app is up")
+    parser.add_argument("--gemini-quota", type=int, default=0, help="Gemini calls in flight before 429 (0: unlimited)")
+    parser.add_argument("--site-latency-ms", type=float, default=50)
+    parser.add_argument("--label", help="name of the results file (default: commit and time)")
+    parser.add_argument("--compare", help="earlier results file to compare with, or 'latest'")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative p95 increase or throughput drop counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+    args.endpoints = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    unknown = [name for name in args.endpoints if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(unknown)}")
+    args.concurrency = [int(level) for level in args.concurrency.split(",")]
+
+    commit = git_commit()
+    label = args.label or f"{commit or 'run'}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    print(f"load test '{label}': {len(args.endpoints)} endpoints x concurrency {args.concurrency}, "
+          f"{args.duration:g} s each, {args.workers} workers")
+    results, config = asyncio.run(run(args))
+
+    print()
+    print_table(results)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"{label}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "label": label,
+            "git_commit": commit,
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "config": config,
+            "results": results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\nresults saved to {os.path.relpath(path, ROOT)}")
+
+    if args.compare:
+        baseline_path = find_baseline(args.compare, path)
+        if baseline_path is None:
+            print("no earlier results to compare with")
+            return
+        with open(baseline_path, encoding="utf-8") as f:
+            regressions = compare_results(json.load(f), results, args.threshold)
+        if regressions and args.fail_on_regression:
+            sys.exit(f"\nregressions beyond {args.threshold:.0%}: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Throughput and latency of text-to-json with and without micro-batching.
+
+Gemini is replaced by a stub whose latency grows slowly with prompt size
+(`--base-ms` per call plus `--per-kchar-ms` per 1000 prompt characters) and
+which allows at most `--gemini-concurrency` calls at a time, like a per-key
+quota. `--requests` short texts sharing one format instruction are sent at
+once through the router's cache-miss path, first one call per text and then
+through the micro-batcher.
+
+Usage:
+    python benchmarks/bench_micro_batch.py [--requests N] [--window-ms MS] [--max-items N]
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+os.environ.setdefault("DISK_CACHE_ENABLED", "0")
+
+from app.core import gemini  # noqa: E402
+from app.routers import text_to_json  # noqa: E402
+
+INSTRUCTION = "日付、時間、場所、参加者をキーにしたJSON"
+TEXT = "明日の15時から渋谷のオフィスで山田さんと佐藤さんと新規プロジェクトの打ち合わせ #{}"
+
+
+class _Response:
+    def __init__(self, text: str):
+        self.text = text
+
+
+def fake_gemini(args, counter):
+    semaphore = asyncio.Semaphore(args.gemini_concurrency)
+
+    async def generate_content(contents, config=None, model=gemini.MODEL):
+        async with semaphore:
+            counter["calls"] += 1
+            await asyncio.sleep((args.base_ms + args.per_kchar_ms * len(contents) / 1000) / 1000)
+        items = len(re.findall(r"【対象テキスト\d+】", contents))
+        result = {"日付": "明日", "時間": "15:00", "場所": "渋谷", "参加者": ["山田", "佐藤"]}
+        return _Response(json.dumps([result] * items if items else result, ensure_ascii=False))
+
+    return generate_content
+
+
+async def run(args, batching: bool) -> dict:
+    counter = {"calls": 0}
+    gemini.generate_content = fake_gemini(args, counter)
+    batcher = text_to_json.TEXT_TO_JSON_BATCHER
+    batcher.enabled = batching
+    batcher.window_ms = args.window_ms
+    batcher.max_items = args.max_items
+
+    latencies = []
+
+    async def one(i: int) -> None:
+        start = time.perf_counter()
+        request = text_to_json.TextToJsonRequest(text=TEXT.format(i), format_instruction=INSTRUCTION)
+        await text_to_json._convert(request)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "calls": counter["calls"],
+        "rps": args.requests / elapsed,
+        "p50": statistics.median(latencies),
+        "p95": latencies[int(len(latencies) * 0.95) - 1],
+        "max": latencies[-1],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--window-ms", type=float, default=20)
+    parser.add_argument("--max-items", type=int, default=8)
+    parser.add_argument("--gemini-concurrency", type=int, default=4)
+    parser.add_argument("--base-ms", type=float, default=400)
+    parser.add_argument("--per-kchar-ms", type=float, default=40)
+    args = parser.parse_args()
+
+    header = f"{'mode':<12}{'gemini calls':>14}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for label, batching in (("single", False), ("batched", True)):
+        result = asyncio.run(run(args, batching))
+        print(
+            f"{label:<12}{result['calls']:>14}{result['rps']:>10.1f}"
+            f"{result['p50']:>10.0f}{result['p95']:>10.0f}{result['max']:>10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
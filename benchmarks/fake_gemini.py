@@ -0,0 +1,157 @@
+"""
+Local stand-in for the Gemini `generateContent` REST endpoint.
+
+Point the app at it with `GEMINI_BASE_URL=http://127.0.0.1:<port>` (any
+`GEMINI_API_KEY` is accepted). Each call sleeps for a configurable latency and
+fails with a configurable probability, and answers with JSON the routers can
+parse:
+
+- with a `responseSchema` (ESG score), an object filled in from the schema;
+- for numbered multi-text prompts (micro-batching), an array with one object per text;
+- otherwise an object that also satisfies the condition-check format.
+
+Token usage is reported from the prompt and answer length, so `/metrics`
+token counters move as they would against the real API. With `--quota N`,
+calls beyond N in flight get a 429 with a `RetryInfo` delay, like an exhausted
+per-minute quota.
+
+Usage:
+    python benchmarks/fake_gemini.py [--port 8701] [--latency-ms 800] [--jitter-ms 200] [--error-rate 0.02]
+        [--quota 16]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+LATENCY_MS = float(os.getenv("FAKE_GEMINI_LATENCY_MS", "800"))
+JITTER_MS = float(os.getenv("FAKE_GEMINI_JITTER_MS", "200"))
+ERROR_RATE = float(os.getenv("FAKE_GEMINI_ERROR_RATE", "0"))
+# 429 / 500 / 503 are what the real API returns under load
+ERROR_STATUS = int(os.getenv("FAKE_GEMINI_ERROR_STATUS", "503"))
+# Calls allowed in flight before answering 429 (0: unlimited), and the retry delay suggested with it
+QUOTA = int(os.getenv("FAKE_GEMINI_QUOTA", "0"))
+RETRY_DELAY_SECONDS = float(os.getenv("FAKE_GEMINI_RETRY_DELAY", "1"))
+
+# Markers of the numbered multi-text prompts built by the micro-batched routers
+_BATCH_ITEM = re.compile(r"【対象テキスト\d+】|\[テキスト\d+\]")
+
+_ERROR_REASONS = {429: "RESOURCE_EXHAUSTED", 500: "INTERNAL", 503: "UNAVAILABLE"}
+
+app = FastAPI(title="Fake Gemini")
+stats = {"calls": 0, "errors": 0, "throttled": 0, "in_flight": 0, "peak_in_flight": 0}
+
+
+def from_schema(schema, name: str = "value"):
+    """
+    Builds a value that matches an OpenAPI-style Gemini `responseSchema`.
+    """
+    kind = (schema.get("type") or "OBJECT").upper()
+    if kind == "OBJECT":
+        return {key: from_schema(value, key) for key, value in (schema.get("properties") or {}).items()}
+    if kind == "ARRAY":
+        return [from_schema(schema.get("items") or {}, name) for _ in range(2)]
+    if kind == "INTEGER":
+        return random.randint(40, 90)
+    if kind == "NUMBER":
+        return round(random.uniform(0, 100), 1)
+    if kind == "BOOLEAN":
+        return random.random() < 0.5
+    return f"sample {name}"
+
+
+def answer(prompt: str, generation_config: dict):
+    schema = generation_config.get("responseSchema")
+    if schema:
+        return from_schema(schema)
+    item = {
+        "condition_met": random.random() < 0.5,
+        "current_status": "5,980円",
+        "reason": "ページ内の価格表記から判定しました",
+        "summary": "サンプル要約",
+        "items": ["sample 1", "sample 2"],
+    }
+    batch_size = len(_BATCH_ITEM.findall(prompt))
+    if batch_size:
+        return [dict(item, index=i) for i in range(batch_size)]
+    return item
+
+
+def prompt_text(body: dict) -> str:
+    return "".join(
+        part.get("text", "")
+        for content in body.get("contents") or []
+        for part in content.get("parts") or []
+    )
+
+
+@app.post("/{version}/models/{model_action}")
+async def generate_content(version: str, model_action: str, request: Request):
+    body = await request.json()
+    stats["calls"] += 1
+    if QUOTA and stats["in_flight"] >= QUOTA:
+        stats["throttled"] += 1
+        return JSONResponse({"error": {
+            "code": 429, "message": "Resource has been exhausted (e.g. check quota).", "status": "RESOURCE_EXHAUSTED",
+            "details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{RETRY_DELAY_SECONDS:g}s"}],
+        }}, status_code=429)
+    stats["in_flight"] += 1
+    stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+    try:
+        await asyncio.sleep(max(0.0, LATENCY_MS + random.uniform(-JITTER_MS, JITTER_MS)) / 1000)
+    finally:
+        stats["in_flight"] -= 1
+
+    if random.random() < ERROR_RATE:
+        stats["errors"] += 1
+        status = _ERROR_REASONS.get(ERROR_STATUS, "UNAVAILABLE")
+        return JSONResponse(
+            {"error": {"code": ERROR_STATUS, "message": "fake Gemini error", "status": status}},
+            status_code=ERROR_STATUS,
+        )
+
+    prompt = prompt_text(body)
+    text = json.dumps(answer(prompt, body.get("generationConfig") or {}), ensure_ascii=False)
+    # Roughly 4 characters per token, as the context selector estimates
+    prompt_tokens, output_tokens = len(prompt) // 4 + 1, len(text) // 4 + 1
+    return {
+        "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+        "usageMetadata": {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens,
+        },
+        "modelVersion": model_action.split(":")[0],
+    }
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+def main() -> None:
+    global LATENCY_MS, JITTER_MS, ERROR_RATE, ERROR_STATUS, QUOTA
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8701)
+    parser.add_argument("--latency-ms", type=float, default=LATENCY_MS)
+    parser.add_argument("--jitter-ms", type=float, default=JITTER_MS)
+    parser.add_argument("--error-rate", type=float, default=ERROR_RATE, help="fraction of calls that fail (0-1)")
+    parser.add_argument("--error-status", type=int, default=ERROR_STATUS)
+    parser.add_argument("--quota", type=int, default=QUOTA, help="calls in flight before answering 429 (0: unlimited)")
+    args = parser.parse_args()
+    LATENCY_MS, JITTER_MS, ERROR_RATE, ERROR_STATUS = args.latency_ms, args.jitter_ms, args.error_rate, args.error_status
+    QUOTA = args.quota
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Local stand-in for the websites and news feed the API fetches.
+
+- `GET /html/<name>` serves `benchmarks/corpus/html/<name>` with an ETag, so
+  the document cache's conditional requests get 304s as they would from a real
+  site. Query strings are ignored, which lets a load test request the same page
+  under many distinct URLs (cache misses) or one URL (cache hits).
+- `GET /rss/search?q=...` serves `benchmarks/corpus/rss/google_news_ja.xml`
+  for any query, also with an ETag. Point Niche Data at it with
+  `NICHE_DATA_FEED_URL=http://127.0.0.1:<port>/rss/search?q={query}`.
+- `GET /site/<n>` is a generated site of `--site-pages` linked pages for the
+  ai-scrape crawler: page n links to 2n+1 and 2n+2, to page 0 with tracking
+  parameters, and to a copy of itself (`/site/<n>/copy`) that declares page n
+  as its canonical URL. `GET /site/sitemap.xml` lists every page.
+- `POST /hook` answers 200, for webhook callbacks.
+
+Usage:
+    python benchmarks/static_site.py [--port 8702] [--latency-ms 50] [--site-pages 50]
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+LATENCY_MS = float(os.getenv("STATIC_SITE_LATENCY_MS", "50"))
+SITE_PAGES = int(os.getenv("STATIC_SITE_PAGES", "50"))
+
+app = FastAPI(title="Benchmark static site")
+stats = {"pages": 0, "not_modified": 0, "feeds": 0, "feeds_not_modified": 0, "hooks": 0, "site_pages": 0,
+         "site_peak_in_flight": 0}
+site_in_flight = 0
+
+# name -> (body, etag), read once
+_files = {}
+
+
+def load(kind: str, name: str):
+    key = (kind, name)
+    if key not in _files:
+        path = os.path.join(CORPUS_DIR, kind, os.path.basename(name))
+        if not os.path.isfile(path):
+            raise HTTPException(status_code=404, detail="fixture not found")
+        with open(path, "rb") as f:
+            body = f.read()
+        _files[key] = (body, '"' + hashlib.sha256(body).hexdigest()[:16] + '"')
+    return _files[key]
+
+
+def fixtures(kind: str):
+    return sorted(os.listdir(os.path.join(CORPUS_DIR, kind)))
+
+
+@app.get("/html/{name}")
+async def page(name: str, request: Request):
+    body, etag = load("html", name)
+    await asyncio.sleep(LATENCY_MS / 1000)
+    if request.headers.get("if-none-match") == etag:
+        stats["not_modified"] += 1
+        return Response(status_code=304, headers={"ETag": etag})
+    stats["pages"] += 1
+    # No charset: the app detects it from the BOM / <meta charset>, as with many real sites.
+    # Set directly, since media_type="text/html" would make Starlette append "; charset=utf-8"
+    return Response(body, headers={"Content-Type": "text/html", "ETag": etag, "Cache-Control": "max-age=0"})
+
+
+@app.get("/rss/search")
+async def feed(request: Request, q: str = ""):
+    body, etag = load("rss", "google_news_ja.xml")
+    await asyncio.sleep(LATENCY_MS / 1000)
+    if request.headers.get("if-none-match") == etag:
+        stats["feeds_not_modified"] += 1
+        return Response(status_code=304, headers={"ETag": etag})
+    stats["feeds"] += 1
+    return Response(body, media_type="application/rss+xml; charset=utf-8", headers={"ETag": etag})
+
+
+def site_page(n: int, request: Request) -> str:
+    links = "".join(f'<li><a href="/site/{child}">Page {child}</a></li>' for child in (2 * n + 1, 2 * n + 2) if child < SITE_PAGES)
+    paragraphs = "".join(f"<p>Page {n} paragraph {i}: notes on topic {n * 7 + i} for the crawl benchmark.</p>" for i in range(5))
+    return (f'<html><head><title>Page {n}</title><link rel="canonical" href="{request.base_url}site/{n}"></head>'
+            f'<body><nav><a href="/site/0?utm_source=nav#top">Home</a> <a href="/site/{n}/copy">Copy</a></nav>'
+            f'<article><h1>Page {n}</h1>{paragraphs}</article><ul>{links}</ul></body></html>')
+
+
+@app.get("/site/sitemap.xml")
+async def sitemap(request: Request):
+    urls = "".join(f"<url><loc>{request.base_url}site/{n}</loc></url>" for n in range(SITE_PAGES))
+    body = f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>'
+    return Response(body, media_type="application/xml")
+
+
+@app.get("/site/{n}")
+@app.get("/site/{n}/copy")
+async def site(n: int, request: Request):
+    global site_in_flight
+    if not 0 <= n < SITE_PAGES:
+        raise HTTPException(status_code=404, detail="page not found")
+    # Lets a crawl benchmark check the per-host connection cap
+    site_in_flight += 1
+    stats["site_peak_in_flight"] = max(stats["site_peak_in_flight"], site_in_flight)
+    try:
+        await asyncio.sleep(LATENCY_MS / 1000)
+    finally:
+        site_in_flight -= 1
+    stats["site_pages"] += 1
+    return Response(site_page(n, request), media_type="text/html; charset=utf-8")
+
+
+@app.post("/hook")
+async def hook(request: Request):
+    await request.body()
+    stats["hooks"] += 1
+    return {"received": True}
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+def main() -> None:
+    global LATENCY_MS, SITE_PAGES
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8702)
+    parser.add_argument("--latency-ms", type=float, default=LATENCY_MS, help="delay before each page/feed response")
+    parser.add_argument("--site-pages", type=int, default=SITE_PAGES, help="pages in the generated /site/ crawl fixture")
+    args = parser.parse_args()
+    LATENCY_MS, SITE_PAGES = args.latency_ms, args.site_pages
+
+    import uvicorn
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,81 @@
+import argparse
+import hashlib
 import os
+import signal
 import subprocess
 import sys
 import time
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Set up the virtual environment and start the API server.")
+    parser.add_argument("--production", action="store_true",
+                        help="multi-worker server with uvloop/httptools; skips pip install when requirements.txt is unchanged")
+    parser.add_argument("--host", default=os.getenv("HOST"),
+                        help="bind address (default: 127.0.0.1, or 0.0.0.0 with --production)")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1,
+                        help="worker processes with --production (default: $WEB_CONCURRENCY or the CPU count)")
+    parser.add_argument("--graceful-timeout", type=int, default=int(os.getenv("GRACEFUL_TIMEOUT", "30")),
+                        help="seconds to let in-flight requests finish on shutdown (--production)")
+    return parser.parse_args()
+
+def requirements_hash(requirements_path):
+    with open(requirements_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def install_requirements(base_dir, venv_dir, venv_pip, skip_if_unchanged):
+    requirements_path = os.path.join(base_dir, "requirements.txt")
+    # Hash of the requirements.txt last installed into this venv
+    stamp_path = os.path.join(venv_dir, ".requirements.sha256")
+    current_hash = requirements_hash(requirements_path)
+
+    if skip_if_unchanged and os.path.exists(stamp_path):
+        with open(stamp_path) as f:
+            if f.read().strip() == current_hash:
+                print("Requirements unchanged since last install, skipping pip install.")
+                return
+
+    print("Installing requirements...")
+    pip_cmd = [venv_pip, "install", "-r", "requirements.txt"]
+    subprocess.run(pip_cmd, check=True, cwd=base_dir)
+    with open(stamp_path, "w") as f:
+        f.write(current_hash)
+    print("Requirements installed successfully.")
+
+def run_production(base_dir, venv_uvicorn, args):
+    host = args.host or "0.0.0.0"
+    uvicorn_cmd = [
+        venv_uvicorn, "app.main:app",
+        "--host", host,
+        "--port", str(args.port),
+        "--workers", str(args.workers),
+        "--http", "httptools",
+        # Stop accepting connections on SIGTERM, then wait for in-flight requests before exiting
+        "--timeout-graceful-shutdown", str(args.graceful_timeout),
+    ]
+    # uvloop is not available on Windows
+    if os.name != 'nt':
+        uvicorn_cmd += ["--loop", "uvloop"]
+
+    print("\n" + "="*50)
+    print(f"Starting FastAPI Application in production mode ({args.workers} workers)")
+    print(f"Listening on http://{host}:{args.port}")
+    print("="*50 + "\n")
+
+    server = subprocess.Popen(uvicorn_cmd, cwd=base_dir)
+
+    def forward(signum, frame):
+        # Let the uvicorn supervisor drain its workers
+        if server.poll() is None:
+            server.send_signal(signum)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    sys.exit(server.wait())
+
 def setup_and_run():
+    args = parse_args()
+
     # Define directories
     base_dir = os.path.dirname(os.path.abspath(__file__))
     venv_dir = os.path.join(base_dir, "venv")
@@ -28,22 +100,24 @@ def setup_and_run():
         print("Virtual environment already exists.")
 
     # Step 2: Install requirements
-    print("Installing requirements...")
-    pip_cmd = [venv_pip, "install", "-r", "requirements.txt"]
-    subprocess.run(pip_cmd, check=True, cwd=base_dir)
-    print("Requirements installed successfully.")
+    install_requirements(base_dir, venv_dir, venv_pip, skip_if_unchanged=args.production)
     
     # Step 3: Run the Uvicorn server
+    if args.production:
+        run_production(base_dir, venv_uvicorn, args)
+        return
+
+    host = args.host or "127.0.0.1"
     print("\n" + "="*50)
     print("Starting FastAPI Application with Uvicorn")
-    print("Swagger UI will be available at: http://127.0.0.1:8000/docs")
+    print(f"Swagger UI will be available at: http://{host}:{args.port}/docs")
     print("="*50 + "\n")
     
     # Run uvicorn
     # Using subprocess.Popen blockingly, so it runs indefinitely
     try:
         print("Press Ctrl+C to stop the server.")
-        subprocess.run([venv_uvicorn, "app.main:app", "--reload", "--host", "127.0.0.1", "--port", "8000"], cwd=base_dir)
+        subprocess.run([venv_uvicorn, "app.main:app", "--reload", "--host", host, "--port", str(args.port)], cwd=base_dir)
     except KeyboardInterrupt:
         print("\nServer stopped by user.")
     except Exception as e:
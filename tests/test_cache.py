@@ -0,0 +1,20 @@
+from app.core.cache import TTLCache
+
+
+def test_peek_does_not_count_or_reorder():
+    cache = TTLCache("test", max_entries=2, max_bytes=10 ** 6, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.peek("a") == 1
+    assert cache.peek("missing") is None
+    assert (cache.hits, cache.misses) == (0, 0)
+    # "a" is still the least recently used entry, so it is the one evicted
+    cache.set("c", 3)
+    assert cache.peek("a") is None
+    assert cache.peek("b") == 2
+
+
+def test_peek_ignores_expired_entries():
+    cache = TTLCache("test", max_entries=10, max_bytes=10 ** 6, ttl=60)
+    cache.set("a", 1, ttl=-1)
+    assert cache.peek("a", "default") == "default"
@@ -0,0 +1,27 @@
+from app.core.context_select import estimate_tokens, select_context
+
+
+def _page() -> str:
+    lines = []
+    for i in range(400):
+        if i % 3 == 0:
+            lines.append(f"価格 {i * 10}円 在庫あり 商品{i}の説明です。")
+        else:
+            lines.append(f"Item {i}: shipping notes, reviews and unrelated text {'x' * (i % 37)}")
+    return "\n".join(lines)
+
+
+def test_selection_stays_within_budget():
+    page = _page()
+    for budget in range(50, 3000, 37):
+        selected = select_context(page, "価格 在庫", token_budget=budget, record=False)
+        assert estimate_tokens(selected) <= budget
+
+
+def test_selection_marks_gaps():
+    selected = select_context(_page(), "価格 在庫", token_budget=500, record=False)
+    assert "\n...\n" in selected
+
+
+def test_page_within_budget_is_unchanged():
+    assert select_context("short page\nprice 100", "price", token_budget=100, record=False) == "short page\nprice 100"
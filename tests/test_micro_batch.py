@@ -0,0 +1,35 @@
+import asyncio
+import time
+
+from app.core import deadlines, metrics
+from app.core.micro_batch import MicroBatcher
+
+
+def test_batch_runs_outside_the_flushing_callers_context():
+    seen = {}
+
+    async def run_one(group, item):
+        return item.upper()
+
+    async def run_many(group, items):
+        seen["deadline"] = deadlines.remaining()
+        seen["router"] = metrics._router.get()
+        seen["timings"] = metrics._timings.get()
+        return [item.upper() for item in items]
+
+    async def caller(batcher, item, deadline):
+        # Each caller has its own request deadline and stage timings
+        deadlines._current.set(deadlines.Deadline(deadline))
+        metrics._router.set("text_to_json")
+        metrics._timings.set({})
+        return await batcher.submit("group", item)
+
+    async def main():
+        batcher = MicroBatcher("test", run_one, run_many, enabled=True, window_ms=10, max_items=2)
+        results = await asyncio.gather(caller(batcher, "a", time.monotonic() + 0.001),
+                                       caller(batcher, "b", time.monotonic() + 60))
+        assert not batcher._running
+        return results
+
+    assert asyncio.run(main()) == ["A", "B"]
+    assert seen == {"deadline": None, "router": "text_to_json", "timings": None}
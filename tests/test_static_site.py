@@ -0,0 +1,28 @@
+import asyncio
+
+import httpx
+
+from app.core.html_text import html_to_text, sniff_encoding
+from benchmarks import static_site
+
+
+def _get(path: str) -> httpx.Response:
+    async def get():
+        transport = httpx.ASGITransport(app=static_site.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://site") as client:
+            return await client.get(path)
+    return asyncio.run(get())
+
+
+def test_html_fixtures_are_served_without_charset():
+    response = _get("/html/corporate_outline_sjis.html")
+    assert response.headers["content-type"] == "text/html"
+    assert response.charset_encoding is None
+
+
+def test_sjis_fixture_decodes_from_meta_charset():
+    response = _get("/html/corporate_outline_sjis.html")
+    assert sniff_encoding(response.content[:4096], response.charset_encoding) == "shift_jis"
+    text = html_to_text(response.content, encoding=response.charset_encoding)
+    assert "会社概要" in text
+    assert "サンプル株式会社" in text